@@ -0,0 +1,61 @@
+""" Benchmarks for reading Canvas gradebooks and submission names
+"""
+
+import os
+from os.path import join as pjoin
+
+from gradools.canvastools import (to_minimal_df, check_unique_stid,
+                                  index_submissions)
+
+from .synth import write_gradebook, make_submission_names
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+
+class TimeGradebook:
+    params = SIZES
+    param_names = ['n_students']
+    timeout = 600
+
+    def setup_cache(self):
+        for n in SIZES:
+            write_gradebook(f'gradebook_{n}.csv', n)
+        return os.getcwd()
+
+    def setup(self, cache_dir, n):
+        self.fname = pjoin(cache_dir, f'gradebook_{n}.csv')
+
+    def time_to_minimal_df(self, cache_dir, n):
+        to_minimal_df(self.fname)
+
+    def time_to_minimal_df_chunked(self, cache_dir, n):
+        to_minimal_df(self.fname, chunksize=10000)
+
+    def peakmem_to_minimal_df(self, cache_dir, n):
+        to_minimal_df(self.fname)
+
+    def peakmem_to_minimal_df_chunked(self, cache_dir, n):
+        to_minimal_df(self.fname, chunksize=10000)
+
+
+class TimeSubmissions:
+    params = SIZES
+    param_names = ['n_students']
+    timeout = 300
+
+    def setup_cache(self):
+        for n in SIZES:
+            os.mkdir(f'submissions_{n}')
+            for fname in make_submission_names(n):
+                open(pjoin(f'submissions_{n}', fname), 'wb').close()
+        return os.getcwd()
+
+    def setup(self, cache_dir, n):
+        self.sub_dir = pjoin(cache_dir, f'submissions_{n}')
+        self.fnames = make_submission_names(n)
+
+    def time_check_unique_stid(self, cache_dir, n):
+        check_unique_stid(self.fnames)
+
+    def time_index_submissions(self, cache_dir, n):
+        index_submissions(self.sub_dir)
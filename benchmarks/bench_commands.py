@@ -0,0 +1,88 @@
+""" Benchmarks for student initialization and reporting
+"""
+
+import os
+import sys
+from io import StringIO
+from contextlib import redirect_stdout
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from gradools import report
+from gradools.mconfig import Config
+from gradools.stinit import get_init, Roster
+
+from .synth import make_marking_log, write_roster, make_logins
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def _write_project(n_students):
+    """ Write config, marking log and roster for `n_students` to cwd
+    """
+    with open('gdconfig.toml', 'wt') as fobj:
+        fobj.write('year = "2018"\nassignment = "Assignment (123456)"\n')
+    with open('marking_log.md', 'wt') as fobj:
+        fobj.write(make_marking_log(n_students))
+    write_roster('students_2018.csv', n_students)
+
+
+class _InProject:
+    """ Run benchmarks in temporary directory with synthetic project
+    """
+
+    params = SIZES
+    param_names = ['n_students']
+    timeout = 600
+
+    def setup(self, n):
+        self._old_dir = os.getcwd()
+        self._tmp_dir = mkdtemp()
+        os.chdir(self._tmp_dir)
+        _write_project(n)
+        self.config = Config()
+
+    def teardown(self, n):
+        os.chdir(self._old_dir)
+        rmtree(self._tmp_dir)
+
+
+class TimeStinit(_InProject):
+
+    def setup(self, n):
+        super().setup(n)
+        self.logins = make_logins(n)[-10:]
+        self.roster = Roster(self.config.get_students())
+
+    def time_get_init(self, n):
+        # Loads roster for each student.
+        for login in self.logins:
+            get_init(login, self.config)
+
+    def time_get_init_roster(self, n):
+        for login in self.logins:
+            get_init(login, self.config, self.roster)
+
+    def time_build_roster(self, n):
+        Roster(self.config.get_students())
+
+
+class TimeReport(_InProject):
+
+    def setup(self, n):
+        super().setup(n)
+        self._old_argv = sys.argv
+        sys.argv = ['gdo-report']
+
+    def teardown(self, n):
+        sys.argv = self._old_argv
+        super().teardown(n)
+
+    def time_report_main(self, n):
+        self.config.reload()
+        with redirect_stdout(StringIO()):
+            report.main(self.config)
+
+    def time_get_current(self, n):
+        self.config.reload()
+        report.get_current(self.config)
@@ -0,0 +1,100 @@
+""" Benchmarks for parsing the marking log
+"""
+
+import os
+from os.path import join as pjoin
+from io import StringIO
+
+from gradools.check import get_lists, checked_totals
+from gradools.mconfig import get_scores, Config
+from gradools.mkfb import get_parts
+from gradools.marklog import parse_log, read_log, cache_fname_for
+from gradools.scores import ScoreMatrix
+
+from .synth import make_marking_log, make_maxima
+
+SIZES = [10, 100, 1000, 10000, 100000]
+
+
+class LogConfig(Config):
+    """ Config using given marking log, not reading config file
+    """
+
+    def __init__(self, log_fname):
+        super().__init__(use_cache=False)
+        self._log_fname = log_fname
+
+    @property
+    def marking_logs(self):
+        return [self._log_fname]
+
+
+class TimeMarkingLog:
+    params = SIZES
+    param_names = ['n_students']
+    timeout = 300
+
+    def setup_cache(self):
+        # Write logs once; asv runs this in a fresh directory.
+        for n in SIZES:
+            with open(f'log_{n}.md', 'wt') as fobj:
+                fobj.write(make_marking_log(n))
+        return os.getcwd()
+
+    def setup(self, cache_dir, n):
+        self.log_fname = pjoin(cache_dir, f'log_{n}.md')
+        with open(self.log_fname, 'rt') as fobj:
+            self.contents = fobj.read()
+        o_scores, e_scores = make_maxima()
+        self.required, self.optional = list(o_scores), list(e_scores)
+        self.config = LogConfig(self.log_fname)
+        self.cached_config = LogConfig(self.log_fname)
+        self.cached_config.use_cache = True
+        # Prime on-disk parse cache.  Old modification time means the cache
+        # trusts modification time and size.
+        os.utime(self.log_fname, ns=(0, 0))
+        self.log = read_log(self.log_fname)
+        self.matrix = ScoreMatrix.from_log(self.log)
+
+    def time_get_lists(self, cache_dir, n):
+        get_lists(self.contents, self.required, self.optional)
+
+    def time_get_scores(self, cache_dir, n):
+        get_scores(StringIO(self.contents))
+
+    def time_parse_log(self, cache_dir, n):
+        parse_log(self.log_fname)
+
+    def time_read_log_cached(self, cache_dir, n):
+        read_log(self.log_fname)
+
+    def time_read_log_cold(self, cache_dir, n):
+        # Parse, and write cache.
+        os.unlink(cache_fname_for(self.log_fname))
+        read_log(self.log_fname)
+
+    def track_cache_size(self, cache_dir, n):
+        return os.path.getsize(cache_fname_for(self.log_fname)) / 1e6
+
+    track_cache_size.unit = 'MB'
+
+    def time_get_parts_cached(self, cache_dir, n):
+        # Uses section index, not parse cache.
+        self.cached_config.reload()
+        get_parts(self.cached_config)
+
+    def time_get_parts(self, cache_dir, n):
+        self.config.reload()
+        get_parts(self.config)
+
+    def time_checked_totals(self, cache_dir, n):
+        checked_totals(self.log)
+
+    def time_score_matrix(self, cache_dir, n):
+        ScoreMatrix.from_log(self.log)
+
+    def time_question_stats(self, cache_dir, n):
+        self.matrix.question_stats()
+
+    def peakmem_parse_log(self, cache_dir, n):
+        parse_log(self.log_fname)
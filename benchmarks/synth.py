@@ -0,0 +1,146 @@
+""" Generate synthetic marking logs, rosters, gradebooks and submission names
+"""
+
+import csv
+import random
+
+SECTION = 'A Module Title'
+
+
+def make_logins(n_students):
+    """ Return `n_students` logins of form used in marking logs
+    """
+    return [f'stu{i:06d}' for i in range(n_students)]
+
+
+def make_names(n_students, seed=0):
+    """ Return `n_students` (family, given) name pairs
+    """
+    rng = random.Random(seed)
+    families = ['brett', 'rodriguez', 'cholmondley-warner', 'smith', 'lee',
+                'okafor', 'nguyen', 'müller', 'hoffman', 'garcia']
+    givens = ['matthew', 'valia', 'james', 'philip seymour', 'ada', 'chen',
+              'ngozi', 'fatima', 'olga', 'sam']
+    return [(rng.choice(families), rng.choice(givens))
+            for i in range(n_students)]
+
+
+def make_maxima(n_questions=10, n_extra=2):
+    """ Return ordinary and extra maxima dictionaries
+    """
+    o_scores = {f'question_{i}': 10. for i in range(n_questions)}
+    e_scores = {f'extra_{i}': 5. for i in range(n_extra)}
+    return o_scores, e_scores
+
+
+def make_marking_log(n_students, n_questions=10, n_extra=2, seed=0):
+    """ Return text of marking log with consistent marks and totals
+
+    Parameters
+    ----------
+    n_students : int
+        Number of student sections.
+    n_questions : int, optional
+        Number of ordinary maxima (questions).
+    n_extra : int, optional
+        Number of extra maxima.  About half the students get marks for
+        each extra question.
+    seed : int, optional
+        Seed for random number generator.
+
+    Returns
+    -------
+    text : str
+        Marking log text.
+    """
+    rng = random.Random(seed)
+    o_scores, e_scores = make_maxima(n_questions, n_extra)
+    lines = ['# Synthetic marking log', '', 'Ordinary maxima:', '']
+    lines += [f'* {k}: {v}' for k, v in o_scores.items()]
+    lines += ['', 'Extra maxima:', '']
+    lines += [f'* {k}: {v}' for k, v in e_scores.items()]
+    lines += ['', f'Total: {sum(o_scores.values())}', '']
+    names = make_names(n_students, seed)
+    for login, (family, given) in zip(make_logins(n_students), names):
+        marks = {k: rng.randint(0, 20) / 2 for k in o_scores}
+        marks.update({k: rng.randint(0, 10) / 2 for k in e_scores
+                      if rng.random() < 0.5})
+        lines += [f'## {login}', '']
+        lines += [f'* {k}: {v}' for k, v in marks.items()]
+        lines += ['', f'Total: {sum(marks.values())}', '',
+                  f'{given.title()} {family.title()}', '',
+                  'You did a good job generally.  Some comments on the '
+                  'specifics of your answers follow.', '',
+                  '### Question 1', '',
+                  'Consider using a function here.', '']
+    return '\n'.join(lines) + '\n'
+
+
+def make_roster(n_students, seed=0):
+    """ Return rows for roster matching :func:`make_marking_log`
+
+    Rows are dictionaries with keys ``Student``, ``SIS User ID``, ``SIS Login
+    ID``, ``Section``.
+    """
+    names = make_names(n_students, seed)
+    return [{'Student': f'{given.title()} {family.title()}',
+             'SIS User ID': 1000000 + i,
+             'SIS Login ID': login,
+             'Section': SECTION}
+            for i, (login, (family, given))
+            in enumerate(zip(make_logins(n_students), names))]
+
+
+def write_roster(fname, n_students, seed=0):
+    """ Write roster CSV, as from ``gdo-mkstable``, to `fname`
+    """
+    rows = make_roster(n_students, seed)
+    with open(fname, 'wt', newline='') as fobj:
+        writer = csv.DictWriter(fobj, list(rows[0]) if rows else
+                                ['Student', 'SIS User ID', 'SIS Login ID',
+                                 'Section'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_gradebook(fname, n_students, n_assignments=200, seed=0):
+    """ Write Canvas full gradebook CSV to `fname`
+
+    Gradebook has the "Points Possible" row after the header, and a "Test
+    Student" row without SIS User ID at the end, as Canvas does.
+    """
+    rng = random.Random(seed)
+    assignments = [f'Assignment {i} ({100000 + i})'
+                   for i in range(n_assignments)]
+    header = (['Student', 'ID', 'SIS User ID', 'SIS Login ID',
+               'Root Account', 'Section'] + assignments +
+              ['Current Points', 'Final Points', 'Current Score',
+               'Final Score'])
+    n_tail = 4
+    with open(fname, 'wt', newline='') as fobj:
+        writer = csv.writer(fobj)
+        writer.writerow(header)
+        writer.writerow(['    Points Possible', '', '', '', '', ''] +
+                        ['100.00'] * n_assignments +
+                        ['(read only)'] * n_tail)
+        for i, row in enumerate(make_roster(n_students, seed)):
+            marks = [f'{rng.randint(0, 100)}.00'
+                     for j in range(n_assignments)]
+            writer.writerow([row['Student'], 20000 + i, row['SIS User ID'],
+                             row['SIS Login ID'], 'canvas.example.ac.uk',
+                             row['Section']] + marks + [''] * n_tail)
+        writer.writerow(['Student, Test', 99999, '', '', '', SECTION] +
+                        ['0.00'] * n_assignments + [''] * n_tail)
+
+
+def make_submission_names(n_students, late_fraction=0.1, seed=0):
+    """ Return Canvas submission filenames, one per student
+    """
+    rng = random.Random(seed)
+    fnames = []
+    for i, (family, given) in enumerate(make_names(n_students, seed)):
+        name = family + given.replace(' ', '')
+        late = 'LATE_' if rng.random() < late_fraction else ''
+        fnames.append(f'{name}_{late}{200000 + i}_{4000000 + i}_'
+                      f'an_exercise.Rmd')
+    return fnames
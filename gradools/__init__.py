@@ -3,11 +3,21 @@
 Some grading tools.
 """
 
+from importlib import import_module
+
 __version__ = '0.1a2'
 
-from . import check
-from . import mconfig
-from . import mkstable
-from . import stinit
-from . import mkfb
-from . import report
+# Submodules are imported on first use, so command line tools only pay for
+# the modules (and dependencies, such as pandas) they need.
+_SUBMODULES = ('canvastools', 'check', 'marklog', 'mconfig', 'mkstable',
+               'stinit', 'mkfb', 'report', 'scores', 'daemon')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return import_module('.' + name, __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES))
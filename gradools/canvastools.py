@@ -1,7 +1,9 @@
 """ Tools for working with Canvas outputs
 """
 
-from os.path import split as psplit
+import os
+from os.path import split as psplit, isdir
+import zipfile
 import regex
 
 import numpy as np
@@ -13,7 +15,7 @@ import pandas as pd
 _FNAME_RE = regex.compile(
     r'''
     (?P<name>[\p{Ll}\u0308\-_]+)
-    (?:LATE_)?
+    (?P<late>LATE_)?
     (?P<id_no>\d+)_
     ''',
     flags=regex.VERBOSE)
@@ -28,6 +30,7 @@ REQUIRED_COLS = {'Student': None,
 
 # Primary key for student in tables.
 CANVAS_ID_COL = 'SIS User ID'
+CANVAS_LOGIN_COL = 'SIS Login ID'
 
 # For back compatibility
 REQUIRED_COL_NAMES = tuple(REQUIRED_COLS)
@@ -39,7 +42,7 @@ class CanvasError(ValueError):
     """
 
 
-def to_minimal_df(full_gradebook, fields=None, dtypes=None):
+def to_minimal_df(full_gradebook, fields=None, dtypes=None, chunksize=None):
     """ Return template dataframe from full gradebook
 
     Parameters
@@ -54,6 +57,9 @@ def to_minimal_df(full_gradebook, fields=None, dtypes=None):
     dtypes : None or dict, optional
         Dictionary of field: dtype key: value or None (default).  None gives
         the default mappings from the ``REQUIRED_COLS`` dictionary.
+    chunksize : None or int, optional
+        If not None, and `full_gradebook` is a filename, read this many rows
+        at a time, dropping invalid rows from each chunk as it arrives.
 
     Returns
     -------
@@ -65,6 +71,14 @@ def to_minimal_df(full_gradebook, fields=None, dtypes=None):
     ------
     ValueError
         If `dtypes` contains field names not in `fields`.
+    KeyError
+        If `fields` contains names not in `full_gradebook`.
+
+    Notes
+    -----
+    When reading from a filename, we only parse the columns we need.  We
+    apply `dtypes` to each chunk after dropping invalid rows, because these
+    rows can have values such as "(read only)".
     """
     fields = tuple(REQUIRED_COLS) if fields is None else fields
     dts = {n: d for n, d in REQUIRED_COLS.items() if d and (n in fields)}
@@ -74,37 +88,81 @@ def to_minimal_df(full_gradebook, fields=None, dtypes=None):
             raise ValueError('Odd names "{}" in dtypes {}'.format(
                 ', '.join(bad_cols), dtypes))
         dts.update({n: np.dtype(d) for n, d in dtypes.items()})
-    df = (full_gradebook if hasattr(full_gradebook, 'columns') else
-          pd.read_csv(full_gradebook))
-    # Some strange unicode characters in 'Student' with a default read, at some
-    # point.  No longer seems to be true.  Pandas version?
-    assert df.columns[0].endswith('Student')
-    df = df.rename(columns={df.columns[0]: 'Student'})
+    if hasattr(full_gradebook, 'columns'):
+        df = full_gradebook
+        # Some strange unicode characters in 'Student' with a default read, at
+        # some point.  No longer seems to be true.  Pandas version?
+        assert df.columns[0].endswith('Student')
+        chunks = [df.rename(columns={df.columns[0]: 'Student'})]
+    else:
+        chunks = _read_columns(full_gradebook, fields, chunksize)
+    df = pd.concat([_prune_chunk(c, fields, dts) for c in chunks])
+    # Reset to default integer index.
+    return df.reset_index(drop=True)
+
+
+def _read_columns(fname, fields, chunksize):
+    """ Read only columns for `fields` (and ID column) from gradebook `fname`
+    """
+    columns = pd.read_csv(fname, nrows=0).columns
+    # See comment on odd characters in to_minimal_df.
+    assert columns[0].endswith('Student')
+    names = ['Student'] + list(columns[1:])
+    missing = set(fields).difference(names)
+    if missing:
+        raise KeyError(f'Fields {", ".join(sorted(missing))} not in '
+                       f'{fname}')
+    wanted = set(fields).union([CANVAS_ID_COL])
+    usecols = [i for i, name in enumerate(names) if name in wanted]
+    reader = pd.read_csv(fname, usecols=usecols, chunksize=chunksize)
+    for chunk in [reader] if chunksize is None else reader:
+        yield chunk.rename(columns={columns[0]: 'Student'})
+
+
+def _prune_chunk(df, fields, dtypes):
     # Drop invalid rows, with NA for SIS User ID.  These include first one or
     # two rows, and Test Student at end.  Restrict to requested columns.
     df = df.loc[~pd.isna(df[CANVAS_ID_COL]), list(fields)]
     # Set dtypes
-    for col, dt in dts.items():
+    for col, dt in dtypes.items():
         df[col] = df[col].astype(dt)
-    # Reset to default integer index.
-    return df.reset_index(drop=True)
+    return df
 
 
 def fname2key(fname):
     """ Return tuple key from Canvas output filename
     """
     path, name = psplit(fname)
+    return _parse_name(name)[:3]
+
+
+def key2fname(key, suffix):
+    """ Return Canvas-style filename for tuple `key`, ending in `suffix`
+
+    The inverse of :func:`fname2key`, in that ``fname2key(key2fname(key,
+    suffix)) == key`` for keys with family and given names.
+    """
+    family, given, id_no = key
+    # As Canvas does, "family_given" runs straight into the ID; a single name
+    # has an underscore before the ID.
+    names = f'{family}_{given}'.lower().replace(' ', '_')
+    return f'{names}{id_no}_{suffix}'
+
+
+def _parse_name(name):
+    """ Return family, given names, ID, late flag from Canvas filename `name`
+    """
     match = _FNAME_RE.match(name)
     if match is None:
         raise CanvasError(
             f'Filename "{name}" should be of form name, optional "LATE_", '
             'followed by the student ID number, e.g '
             '"brettmatthew_LATE_124_something_else.zip"')
-    names, number = match.groups()
+    names, late, number = match.groups()
     names = [_capitalize(n) for n in names.split('_')]
     if len(names) == 1:
         raise CanvasError('Should be names separated by -', name)
-    return (names[0], ' '.join(names[1:]), number)
+    return (names[0], ' '.join(names[1:]), number, late is not None)
 
 
 def _capitalize(name):
@@ -115,12 +173,105 @@ def _capitalize(name):
 
 def check_unique_stid(filenames):
     """ Raise CanvasError unless `filenames` have unique student IDs
+
+    The error message lists all duplicates.
     """
     found_ids = {}
+    msgs = []
     for fname in filenames:
         name, _, stid = fname2key(fname)
         if stid in found_ids:
-            raise CanvasError(
-                f'{fname} has same student ID {stid} as '
-                f'{found_ids[stid]}')
+            msgs.append(f'{fname} has same student ID {stid} as '
+                        f'{found_ids[stid]}')
+            continue
         found_ids[stid] = fname
+    if msgs:
+        raise CanvasError('\n'.join(msgs))
+
+
+# Columns in table from index_submissions.
+SUBMISSION_COLS = ('family', 'given', 'id_no', 'late', 'path')
+
+
+def _list_submissions(path):
+    """ Return filenames, paths for files in directory or zip file `path`
+    """
+    if isdir(path):
+        with os.scandir(path) as it:
+            return [(e.name, e.path) for e in it if e.is_file()]
+    with zipfile.ZipFile(path) as zf:
+        return [(psplit(info.filename)[1], info.filename)
+                for info in zf.infolist() if not info.is_dir()]
+
+
+def index_submissions(path, check=True):
+    """ Return table of submissions in Canvas download directory or zip file
+
+    Parameters
+    ----------
+    path : str
+        Directory containing files downloaded from Canvas submissions page, or
+        the bulk download zip file.
+    check : {True, False}, optional
+        If True, raise a CanvasError listing all filenames we cannot parse,
+        and all files with the same student ID as another file.  If False,
+        omit filenames we cannot parse from the table.
+
+    Returns
+    -------
+    submissions : DataFrame
+        Table with one row per submission file, and columns ``family`` and
+        ``given`` (capitalized names), ``id_no`` (student ID as string),
+        ``late`` (boolean) and ``path`` (file path, or member name in zip
+        file).
+    """
+    rows = []
+    bad = []
+    for name, fpath in _list_submissions(path):
+        try:
+            rows.append(_parse_name(name) + (fpath,))
+        except CanvasError:
+            bad.append(fpath)
+    df = pd.DataFrame(rows, columns=list(SUBMISSION_COLS))
+    if not check:
+        return df
+    msgs = [f'Cannot parse filename {fpath}' for fpath in bad]
+    dupes = df[df['id_no'].duplicated(keep=False)]
+    for id_no, group in dupes.groupby('id_no', sort=False):
+        msgs.append(f'Student ID {id_no} for all of: ' +
+                    ', '.join(group['path']))
+    if msgs:
+        raise CanvasError('\n'.join(msgs))
+    return df
+
+
+def login_keys(path, students, id_col=CANVAS_ID_COL):
+    """ Return dictionary with login: submission key for submissions in `path`
+
+    Parameters
+    ----------
+    path : str
+        Directory containing files downloaded from Canvas submissions page, or
+        the bulk download zip file.
+    students : DataFrame
+        Student roster, with login column ``SIS Login ID``, and `id_col`.
+    id_col : str, optional
+        Column in `students` giving the student ID in submission filenames.
+
+    Returns
+    -------
+    keys : dict
+        Dictionary with login: key pairs, where key is the ``(family, given,
+        id_no)`` tuple from :func:`fname2key`, for students with a submission
+        in `path`.
+    """
+    submissions = index_submissions(path, check=False)
+    by_id = {id_no: (family, given, id_no) for family, given, id_no in
+             zip(submissions['family'], submissions['given'],
+                 submissions['id_no'])}
+    keys = {}
+    for login, id_no in zip(students[CANVAS_LOGIN_COL], students[id_col]):
+        key = by_id.get(str(id_no))
+        if key is not None:
+            keys[login] = key
+    return keys
@@ -2,16 +2,21 @@
 """
 
 import sys
-import re
-
+import json
+import time
+from io import StringIO
+from argparse import ArgumentParser
 from collections import OrderedDict
 
-from .mconfig import CONFIG, proc_line
+from .mconfig import CONFIG, file_state
+from .marklog import (parse_log, read_logs, reparse_log,
+                      merge_logs, read_sections, iter_log, MarkingLogError)
+from .profiling import profiled
 
 
-def check_totals(fname):
+def check_totals(log):
     out = []
-    totals, msg = checked_totals(fname)
+    totals, msg = checked_totals(log)
     if msg:
         out.append(msg)
     for name, total in totals.items():
@@ -19,70 +24,247 @@ def check_totals(fname):
     return '\n'.join(out)
 
 
-def checked_totals(fname, config=CONFIG):
-    with open(fname, 'rt') as fobj:
-        contents = fobj.read()
-    required, optional = CONFIG.scores
-    lists, msg = get_lists(contents, list(required), list(optional))
-    totals = OrderedDict()
-    for name, marks in lists.items():
-        totals[name] = sum(marks.values())
-    return totals, msg
-
-
-def _check_total(line, name, marks, required_fields, msg_lines):
-    missing = set(required_fields).difference(marks)
-    if len(missing):
-        msg_lines.append("Required field{} {} not present".format(
-            's' if len(missing) > 1 else '',
-            ', '.join(sorted(missing))))
-    actual_total = sum(marks.values())
-    if not line.lower().startswith('total'):
-        msg_lines.append("Expecting total {} for {}".format(
-            actual_total, name))
-        return
-    total_text = line.split(':')[1].strip()
-    total = float(total_text) if total_text else 0.
-    if not total == sum(marks.values()):
-        msg_lines.append("Expected {} for {}, got {}".format(
-            actual_total, name, total))
+def checked_totals(log, config=CONFIG):
+    """ Return totals per student, and message with any problems
 
+    Parameters
+    ----------
+    log : str or MarkingLog
+        Filename of marking log, or parsed marking log.
+    config : Config, optional
+        Configuration.
 
-def get_lists(contents, required_fields, optional_fields):
-    lists = {}
-    state = 'before'
+    Returns
+    -------
+    totals : dict
+        Dictionary with student: total key: value pairs.
+    msg : str
+        Problems found, one per line.
+    """
+    matrix, msg = checked_matrix(log, config)
+    return OrderedDict(zip(matrix.students, matrix.totals.tolist())), msg
+
+
+def checked_matrix(log, config=CONFIG):
+    """ Return score matrix for all students, and message with any problems
+
+    Parameters
+    ----------
+    log : str or MarkingLog
+        Filename of marking log, or parsed marking log.
+    config : Config, optional
+        Configuration.
+
+    Returns
+    -------
+    matrix : ScoreMatrix
+        Marks for all students.
+    msg : str
+        Problems found, one per line.
+    """
+    # Import here; numpy is slow to import, and gdo-stinit, gdo-check
+    # --format ndjson and forwarding to gdo-daemon do not need it.
+    from .scores import ScoreMatrix
+    if not hasattr(log, 'sections'):
+        log = read_logs([log], config.use_cache)
+    matrix = ScoreMatrix.from_log(log)
+    required, optional = list(log.o_scores), list(log.e_scores)
     msg_lines = []
-    all_fields = required_fields + optional_fields
-    for line in contents.splitlines():
-        if line.strip() == '':
-            continue
-        if state == 'before':
-            if re.match('##[^#]', line):
-                state = 'in-list'
-                name = line.split()[1]
-                mark_list = {}
-            continue
-        if state == 'in-list':
-            if line.startswith('* '):
-                key, value = proc_line(line)
-                if not key in all_fields:
-                    msg_lines.append(
-                        "Did not expect key: '{}' here".format(key))
-                mark_list[key] = float(value)
+    # Find problems with arrays; only format messages for students with
+    # problems.
+    for row in matrix.problem_rows(required, optional):
+        msg_lines += log.sections[row].check(required, optional)
+    return matrix, '\n'.join(msg_lines)
+
+
+def section_record(section, required_fields, optional_fields):
+    """ Return dictionary with marks, totals and problems for `section`
+    """
+    marks = section.marks
+    return OrderedDict(
+        id=section.name,
+        marks=marks,
+        stated_total=section.total,
+        total=sum(marks.values()),
+        problems=section.check(required_fields, optional_fields))
+
+
+def iter_records(fnames, use_cache=True):
+    """ Iterate over record for each section in logs `fnames`, as parsed
+
+    Gives record from :func:`section_record` for each section, checking
+    against the maxima from the logs.  Does not check for students with
+    sections in more than one log.
+    """
+    # Read maxima from preamble of each log.
+    o_scores, e_scores = read_sections(fnames, [], use_cache).scores
+    for fname in fnames:
+        for scores, section in iter_log(fname):
+            yield section_record(section, o_scores, e_scores)
+
+
+def write_ndjson(records, fobj=None):
+    """ Write each record in `records` as line of JSON, as soon as we have it
+    """
+    fobj = sys.stdout if fobj is None else fobj
+    for record in records:
+        fobj.write(json.dumps(record) + '\n')
+        fobj.flush()
+
+
+def get_lists(contents, required_fields, optional_fields):
+    return parse_log(StringIO(contents)).check(required_fields,
+                                               optional_fields)
+
+
+def iter_updates(fnames, interval=0.2):
+    """ Yield log from `fnames` at start, and each time a file changes
+
+    Only re-parses the sections of a changed file that have changed.
+
+    Parameters
+    ----------
+    fnames : sequence
+        Filenames of marking logs.
+    interval : float, optional
+        Time in seconds between checks for changed files.
+
+    Yields
+    ------
+    log : None or MarkingLog
+        Merged log from `fnames`, or None if there was an error.
+    error : None or str
+        Error from reading, parsing or merging logs, or None if no error.
+    """
+    states = {}
+    logs = OrderedDict((fname, None) for fname in fnames)
+    # Error for each file that failed, until it reads cleanly again.
+    errors = OrderedDict()
+    while True:
+        changed = False
+        for fname, log in logs.items():
+            state = file_state(fname)
+            if state == states.get(fname):
                 continue
-            lists[name] = mark_list
-            state = 'total'
-        if state == 'total':
-            _check_total(line, name, lists[name], required_fields, msg_lines)
-            state = 'before'
-    # Clean up incomplete list, missing total
-    if state in ('in-list', 'total'):
-        lists[name] = mark_list
-        # Maybe still need to check the total, for list at end of file.
-        _check_total('', name, lists[name], required_fields, msg_lines)
-    return lists, '\n'.join(msg_lines)
+            states[fname] = state
+            changed = True
+            try:
+                with open(fname, 'rb') as fobj:
+                    contents = fobj.read()
+                logs[fname] = reparse_log(contents, log, fname)
+            except (OSError, ValueError) as err:
+                errors[fname] = f'{fname}: {err}'
+            else:
+                errors.pop(fname, None)
+        if changed and errors:
+            yield None, '\n'.join(errors.values())
+        elif changed:
+            try:
+                merged = merge_logs(logs.values())
+            except MarkingLogError as err:
+                yield None, str(err)
+            else:
+                yield merged, None
+        time.sleep(interval)
+
+
+class SectionChecks:
+    """ Checks and totals for marking logs, reusing those for old sections
 
+    For a new version of a log, only check the sections with changed marks or
+    total, such as those that :func:`reparse_log` parsed again.
+    """
 
+    def __init__(self):
+        self._scores = None
+        self._results = {}
+
+    def check_totals(self, log):
+        """ Return same output as :func:`check_totals` for `log`
+        """
+        if log.scores != self._scores:  # Maxima changed; check everything.
+            self._scores = log.scores
+            self._results = {}
+        required, optional = list(log.o_scores), list(log.e_scores)
+        old_results = self._results
+        results = {}
+        problems = []
+        lines = []
+        for section in log.sections:
+            # Everything that checks and totals depend on, given maxima.
+            # reparse_log shares the marks list between old and new versions
+            # of an unchanged section, so the list id identifies the marks.
+            key = (section.name, id(section.mark_items), section.total_line)
+            result = old_results.get(key)
+            if result is None:
+                # Keep marks list, so its id stays unique while we have the
+                # key.  float for no marks, as for ScoreMatrix.totals.
+                result = (section.mark_items,
+                          '{:<10} : {}'.format(section.name,
+                                               float(section.mark_sum)),
+                          section.check(required, optional))
+            # Forget sections no longer in log.
+            results[key] = result
+            mark_items, line, section_problems = result
+            problems += section_problems
+            lines.append(line)
+        self._results = results
+        return '\n'.join(problems + lines)
+
+
+def watch(fnames, interval=0.2):
+    """ Print checks and totals for logs `fnames` each time they change
+    """
+    checks = SectionChecks()
+    try:
+        for log, error in iter_updates(fnames, interval):
+            print(f'--- {time.strftime("%H:%M:%S")} ---')
+            print(checks.check_totals(log) if error is None else error,
+                  flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+@profiled
 def main():
-    log = sys.argv[1] if len(sys.argv) > 1 else CONFIG.marking_log
+    parser = ArgumentParser()
+    parser.add_argument('logs', nargs='*',
+                        help='Marking log(s) (default from config file)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use or update marking log parse cache')
+    parser.add_argument('-s', '--student', action='append',
+                        help='Only check section for this student; can be '
+                        'given more than once')
+    parser.add_argument('--watch', action='store_true',
+                        help='Check again each time the log(s) change; '
+                        'always parses the logs, without the parse cache')
+    parser.add_argument('--format', choices=('text', 'ndjson'),
+                        default='text',
+                        help='Output format; "ndjson" gives one JSON record '
+                        'per student, as each section is parsed')
+    args = parser.parse_args()
+    if args.watch and args.student:
+        parser.error('--watch checks all students; cannot use --student')
+    if args.watch and args.format != 'text':
+        parser.error('--watch only gives text output')
+    fnames = args.logs if args.logs else CONFIG.marking_logs
+    if args.watch:
+        watch(fnames)
+        return
+    CONFIG.use_cache = not args.no_cache
+    if args.format == 'ndjson' and not args.student:
+        write_ndjson(iter_records(fnames, CONFIG.use_cache))
+        return
+    if args.student:
+        log = read_sections(fnames, args.student, CONFIG.use_cache)
+        missing = set(args.student).difference(log.lists)
+        if missing:
+            sys.exit('No section for ' + ', '.join(sorted(missing)))
+    else:
+        log = (read_logs(args.logs, CONFIG.use_cache) if args.logs
+               else CONFIG.log)
+    if args.format == 'ndjson':
+        write_ndjson(section_record(section, *log.scores)
+                     for section in log.sections)
+        return
     print(check_totals(log))
@@ -0,0 +1,357 @@
+""" Optional server keeping config, roster and marking log in memory
+
+Run ``gdo-daemon`` in a marking directory to start a server listening on a
+Unix socket in that directory.  While it runs, the ``gdo-*`` commands, run in
+the same directory, send their command line to the server, and the server
+runs the command.  The server has already imported the modules the commands
+need, and keeps the config, roster and parsed marking log in memory, reading
+them again only when the files change (see :class:`gradools.mconfig.Config`).
+
+Commands run as usual, without the server, if:
+
+* there is no server running in the current directory;
+* the ``GRADOOLS_NO_DAEMON`` environment variable is set;
+* the command reads from standard input (``-`` in the arguments), or runs
+  until interrupted (``--watch``).
+
+Stop the server with Control-C, or ``gdo-daemon --stop``.
+
+The ``gdo-*`` entry points are the launchers in this module, such as
+:func:`gdo_check`, which send the command line to the server before importing
+the module running the command, so forwarded commands do not pay for
+importing it, or its dependencies.
+
+Only the user running the server can connect to it.  The server runs each
+command with the default settings (such as ``CONFIG.use_cache``), and sends
+back all output from the command, including output from subprocesses.
+"""
+
+import io
+import os
+import sys
+import json
+import socket
+import struct
+import traceback
+from tempfile import TemporaryFile
+from importlib import import_module
+from contextlib import contextmanager
+from argparse import ArgumentParser
+
+from .profiling import ENV_VAR as PROFILE_ENV_VAR
+
+# Relative to current directory; the server serves the directory in which it
+# started.
+SOCKET_FNAME = '.gdo-daemon.sock'
+NO_DAEMON_VAR = 'GRADOOLS_NO_DAEMON'
+
+# Functions the server will run, as "module:function".
+ENTRY_POINTS = ('gradools.check:main',
+                'gradools.mconfig:print_year',
+                'gradools.mkstable:main',
+                'gradools.stinit:main',
+                'gradools.mkfb:main',
+                'gradools.report:main')
+
+# Arguments for which we run the command here, rather than in the server.
+LOCAL_ARGS = ('-', '--watch')
+
+
+class DaemonError(RuntimeError):
+    """ Server accepted command, but sent back no reply
+    """
+
+
+def should_forward(argv, environ):
+    """ True if we should try sending command line `argv` to server
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+    if environ.get(NO_DAEMON_VAR, '').strip() not in ('', '0'):
+        return False
+    return not any(arg in LOCAL_ARGS for arg in argv[1:])
+
+
+def _connect(sock_fname=SOCKET_FNAME):
+    """ Return socket connected to server, or None if no server running
+    """
+    if not os.path.exists(sock_fname):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(sock_fname)
+    except OSError:  # Server not running; stale socket file.
+        sock.close()
+        return None
+    return sock
+
+
+def _request(sock, request):
+    """ Send `request` over connected `sock`, return reply
+    """
+    with sock, sock.makefile('rwb') as fobj:
+        fobj.write(json.dumps(request).encode('utf8') + b'\n')
+        fobj.flush()
+        sock.shutdown(socket.SHUT_WR)
+        line = fobj.readline()
+    return json.loads(line.decode('utf8')) if line else None
+
+
+def forward(entry, argv, environ, sock_fname=SOCKET_FNAME):
+    """ Run `entry` with command line `argv` in server
+
+    Parameters
+    ----------
+    entry : str
+        Function to run, as "module:function"; one of ``ENTRY_POINTS``.
+    argv : sequence
+        Command line, as for ``sys.argv``.
+    environ : mapping
+        Environment variables.
+    sock_fname : str, optional
+        Filename of server socket.
+
+    Returns
+    -------
+    reply : None or dict
+        None if no server running.  Otherwise, dictionary with keys
+        ``stdout``, ``stderr`` (output from command) and ``code`` (exit
+        code).
+
+    Raises
+    ------
+    DaemonError
+        If we connected to the server, but it sent no reply.  The server
+        may have run the command, so we must not run it again here.
+    """
+    sock = _connect(sock_fname)
+    if sock is None:
+        return None
+    env = {PROFILE_ENV_VAR: environ[PROFILE_ENV_VAR]} if (
+        PROFILE_ENV_VAR in environ) else {}
+    try:
+        reply = _request(sock,
+                         dict(entry=entry, argv=list(argv), environ=env))
+    except (OSError, ValueError) as err:  # ValueError for partial reply.
+        raise DaemonError(f'Lost connection to server: {err}')
+    if reply is None:
+        raise DaemonError('Server sent no reply')
+    return reply
+
+
+def _run_forwarded(entry):
+    """ Run `entry` with command line ``sys.argv`` in server, if running
+
+    Returns False if we did not send the command to the server.
+    """
+    if not should_forward(sys.argv, os.environ):
+        return False
+    try:
+        reply = forward(entry, sys.argv, os.environ)
+    except DaemonError as err:
+        sys.exit(f'{err}; command may or may not have run.  '
+                 f'Set {NO_DAEMON_VAR}=1 to run without the server.')
+    if reply is None:
+        return False
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    if reply['code']:
+        sys.exit(reply['code'])
+    return True
+
+
+def launcher(entry):
+    """ Return command line entry point for `entry`, run in server if running
+
+    Only imports the module of `entry` if there is no server to run the
+    command.
+    """
+
+    def launch():
+        if _run_forwarded(entry):
+            return
+        module_name, func_name = entry.split(':')
+        return getattr(import_module(module_name), func_name)()
+
+    launch.__doc__ = f'Run {entry}, in server if running'
+    return launch
+
+
+gdo_check = launcher('gradools.check:main')
+gdo_year = launcher('gradools.mconfig:print_year')
+gdo_mkstable = launcher('gradools.mkstable:main')
+gdo_stinit = launcher('gradools.stinit:main')
+gdo_mkfb = launcher('gradools.mkfb:main')
+gdo_report = launcher('gradools.report:main')
+
+
+@contextmanager
+def _captured():
+    """ Capture output to stdout and stderr, including from subprocesses
+
+    Yields dictionary, that has keys ``stdout`` and ``stderr``, with the
+    captured output, on exit.
+    """
+    output = {}
+    streams = sys.stdout, sys.stderr
+    for stream in streams:
+        stream.flush()
+    with TemporaryFile() as out, TemporaryFile() as err:
+        saved = [os.dup(1), os.dup(2)]
+        # Unbuffered, to keep order of output from Python and subprocesses.
+        sys.stdout, sys.stderr = [
+            io.TextIOWrapper(io.FileIO(fd, 'w', closefd=False), 'utf8',
+                             write_through=True) for fd in (1, 2)]
+        os.dup2(out.fileno(), 1)
+        os.dup2(err.fileno(), 2)
+        try:
+            yield output
+        finally:
+            sys.stdout, sys.stderr = streams
+            for fd, saved_fd in zip((1, 2), saved):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+            for key, fobj in (('stdout', out), ('stderr', err)):
+                fobj.seek(0)
+                output[key] = fobj.read().decode('utf8', 'replace')
+
+
+def run_entry(entry, argv, environ=None):
+    """ Run `entry` with command line `argv`, return output and exit code
+
+    Parameters
+    ----------
+    entry : str
+        Function to run, as "module:function"; one of ``ENTRY_POINTS``.
+    argv : sequence
+        Command line, as for ``sys.argv``.
+    environ : None or dict, optional
+        Environment variables to set while running.
+
+    Returns
+    -------
+    reply : dict
+        Dictionary with keys ``stdout``, ``stderr`` and ``code``.
+    """
+    if entry not in ENTRY_POINTS:
+        return dict(stdout='', stderr=f'Cannot run {entry}\n', code=1)
+    module_name, func_name = entry.split(':')
+    func = getattr(import_module(module_name), func_name)
+    # Import here; mconfig imports this module.
+    from .mconfig import CONFIG
+    environ = {} if environ is None else environ
+    old_argv = sys.argv
+    old_environ = {key: os.environ.get(key) for key in environ}
+    code = 0
+    sys.argv = list(argv)
+    os.environ.update(environ)
+    # Options from earlier commands must not carry over.
+    CONFIG.use_cache = True
+    try:
+        with _captured() as output:
+            try:
+                func()
+            except SystemExit as err:
+                if isinstance(err.code, str):
+                    print(err.code, file=sys.stderr)
+                    code = 1
+                else:
+                    code = err.code or 0
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    finally:
+        sys.argv = old_argv
+        CONFIG.use_cache = True
+        for key, value in old_environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return dict(output, code=code)
+
+
+def _peer_uid(conn):
+    """ Return user id of process at other end of `conn`, None if unknown
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):  # Not Linux.
+        return None
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+    return uid
+
+
+def serve(sock_fname=SOCKET_FNAME):
+    """ Run commands sent to socket `sock_fname`, until asked to stop
+    """
+    sock = _connect(sock_fname)
+    if sock is not None:
+        sock.close()
+        raise RuntimeError(f'Server already running on {sock_fname}')
+    if os.path.exists(sock_fname):  # Stale socket file.
+        os.unlink(sock_fname)
+    # Import modules, and their dependencies, once.
+    for entry in ENTRY_POINTS:
+        import_module(entry.split(':')[0])
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Anyone who can connect can run commands as us; make socket
+        # readable and writable by us only, even in a shared directory.
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(sock_fname)
+        finally:
+            os.umask(old_umask)
+        os.chmod(sock_fname, 0o600)
+        server.listen()
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('rwb') as fobj:
+                if _peer_uid(conn) not in (None, os.getuid()):
+                    continue
+                try:
+                    request = json.loads(fobj.readline().decode('utf8'))
+                    if request.get('stop'):
+                        break
+                    reply = run_entry(request['entry'], request['argv'],
+                                      request.get('environ'))
+                except (ValueError, KeyError, AttributeError):
+                    reply = dict(stdout='', stderr='Bad request\n', code=1)
+                except OSError:  # Client went away.
+                    continue
+                try:
+                    fobj.write(json.dumps(reply).encode('utf8') + b'\n')
+                except OSError:
+                    continue
+    finally:
+        server.close()
+        if os.path.exists(sock_fname):
+            os.unlink(sock_fname)
+
+
+def stop(sock_fname=SOCKET_FNAME):
+    """ Ask server on `sock_fname` to stop; return False if not running
+    """
+    sock = _connect(sock_fname)
+    if sock is None:
+        return False
+    _request(sock, dict(stop=True))
+    return True
+
+
+def main():
+    parser = ArgumentParser(
+        description='Serve gdo-* commands run in this directory')
+    parser.add_argument('--stop', action='store_true',
+                        help='Stop server running in this directory')
+    args = parser.parse_args()
+    if args.stop:
+        if not stop():
+            sys.exit('No server running here')
+        return
+    print(f'Serving on {SOCKET_FNAME}; Control-C to stop')
+    try:
+        serve()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,937 @@
+""" Parse marking log into structured document
+
+The marking log is a Markdown file with a preamble giving the maxima for each
+score, followed by one second-level heading per student.  We read the file
+once, split it at the section headings, and parse each section, to collect
+everything the commands need: the maxima, and for each student section, the
+byte offsets of the section, the marks, the stated total and the public
+feedback text.
+"""
+
+import os
+from os.path import split as psplit, join as pjoin
+import re
+import time
+import mmap
+import json
+from contextlib import contextmanager
+from hashlib import sha256
+from io import BytesIO
+from collections import OrderedDict
+from itertools import chain, islice, repeat
+from operator import attrgetter, itemgetter
+
+from . import __version__
+from .profiling import phase
+
+# Find section headings, and student names, in file contents as bytes.
+HEADING_STARTS = re.compile(rb'^##[ \t]+(\S+)', re.M)
+TOTAL_FINDER = re.compile(r'^Total\s*:\s*[0-9.]+')
+# Headings after the start of the file; much faster to search than
+# HEADING_STARTS.
+LATER_HEADINGS = re.compile(rb'\n##[ \t]+(\S+)')
+# In text of section after heading, where each line starts with a newline:
+# list of marks, with blank lines,
+LIST_FINDER = re.compile(r'(?:\n(?:\* [^\n]*|[^\S\n]*(?=\n|\Z)))*')
+# items of list of marks, as for proc_line (we get ValueError for anything
+# but one colon),
+ITEM_FINDER = re.compile(r'\n\* ([^\n:]*):?([^\n]*)')
+# and line with numeric total, as for TOTAL_FINDER.
+TOTAL_LINE_FINDER = re.compile(r'\nTotal[^\S\n]*:[^\S\n]*[0-9.]+')
+# Carriage returns at line ends.
+LINE_CRS = re.compile(r'\r+$', re.M)
+STID_FINDER = re.compile(r'^\w\w\w\d+')
+
+# Change when format of cached data changes.
+CACHE_VERSION = [4, __version__]
+# Don't trust unchanged modification time for files this recently modified
+# when cache written, as file system times have limited resolution.
+RACY_NS = 2 * 10 ** 9
+
+
+def proc_line(line):
+    if not line.startswith('*'):
+        raise ValueError('Invalid list element')
+    return [v.strip() for v in line[1:].split(':')]
+
+
+def parse_maxima(lines):
+    """ Return ordinary and extra maxima from iterable of text `lines`
+    """
+    state = 'searching'
+    o_scores = OrderedDict()
+    e_scores = OrderedDict()
+    for line in lines:
+        line = line.strip()
+        if line == '':
+            continue
+        if state == 'searching':
+            if line == 'Ordinary maxima:':
+                state = 'ordinary-scores'
+        elif state == 'ordinary-scores':
+            if line == 'Extra maxima:':
+                state = 'extra-scores'
+                continue
+            elif line.startswith('Total'):
+                break
+            key, value = proc_line(line)
+            o_scores[key] = float(value)
+        elif state == 'extra-scores':
+            if line.startswith('Total'):
+                break
+            key, value = proc_line(line)
+            e_scores[key] = float(value)
+    return o_scores, e_scores
+
+
+class Section:
+    """ Section of marking log for one student
+
+    Parameters
+    ----------
+    name : str
+        Student identifier from section heading.
+    start : int
+        Byte offset of section heading in marking log.
+    end : int, optional
+        Byte offset of end of section.
+    mark_items : sequence, optional
+        Sequence of (key, value) pairs from list of marks.
+    total_line : None or str, optional
+        First line after the list of marks, that should give the total.  None
+        if there is no such line.
+    feedback_lines : None or sequence, optional
+        Lines after the line giving the (numeric) total.  None if we have not
+        read the feedback, as for sections from the parse cache.
+    source : None or str, optional
+        Filename of marking log containing section, if known.
+
+    Attributes
+    ----------
+    mark_sum : float
+        Sum of :attr:`marks`, adding in log order.
+    stated_total : None or float
+        Stated total, as for :attr:`total`, but None if the total is not a
+        number.
+    """
+
+    def __init__(self, name, start, end=None, mark_items=(),
+                 total_line=None, feedback_lines=(), source=None):
+        self.name = name
+        self.source = source
+        self.start = start
+        self.end = start if end is None else end
+        self.mark_items = list(mark_items)
+        self.total_line = total_line
+        self.feedback_lines = (None if feedback_lines is None
+                               else list(feedback_lines))
+        # Work out sums and totals once, when parsing, so ScoreMatrix does
+        # not have to visit each section.
+        self.mark_sum = sum(dict(self.mark_items).values())
+        try:
+            self.stated_total = self.total
+        except ValueError:
+            self.stated_total = None
+
+    def moved(self, start, source=None):
+        """ Return copy of section starting at byte offset `start` in `source`
+
+        The copy shares the marks and feedback lists with this section.
+        """
+        attrs = self.__dict__.copy()
+        attrs['start'] = start
+        attrs['end'] = start + self.end - self.start
+        attrs['source'] = source
+        section = object.__new__(Section)
+        section.__dict__ = attrs
+        return section
+
+    @property
+    def marks(self):
+        return OrderedDict(self.mark_items)
+
+    @property
+    def total(self):
+        """ Stated total, or None if no total given
+        """
+        line = self.total_line
+        if line is None or not line.lower().startswith('total'):
+            return None
+        total_text = line.partition(':')[2].strip()
+        return float(total_text) if total_text else 0.
+
+    @property
+    def feedback(self):
+        if self.feedback_lines is None:
+            raise MarkingLogError(f'Did not read feedback for {self.name}; '
+                                  'use read_feedback')
+        return '\n'.join(self.feedback_lines)
+
+    def check(self, required_fields, optional_fields):
+        """ Return list of problems with marks in section
+        """
+        msg_lines = []
+        all_fields = set(required_fields).union(optional_fields)
+        for key, value in self.mark_items:
+            if not key in all_fields:
+                msg_lines.append("Did not expect key: '{}' here".format(key))
+        marks = dict(self.mark_items)
+        missing = set(required_fields).difference(marks)
+        if len(missing):
+            msg_lines.append("Required field{} {} not present".format(
+                's' if len(missing) > 1 else '',
+                ', '.join(sorted(missing))))
+        actual_total = sum(marks.values())
+        total = self.total
+        if total is None:
+            msg_lines.append("Expecting total {} for {}".format(
+                actual_total, self.name))
+        elif not total == actual_total:
+            msg_lines.append("Expected {} for {}, got {}".format(
+                actual_total, self.name, total))
+        return msg_lines
+
+
+class MarkingLogError(ValueError):
+    """ Exception for inconsistent marking logs
+    """
+
+
+class MarkingLog:
+    """ Parsed marking log
+
+    Parameters
+    ----------
+    o_scores : dict
+        Ordinary maxima, with score name: maximum key: value pairs.
+    e_scores : dict
+        Extra maxima, with score name: maximum key: value pairs.
+    sections : sequence
+        Sequence of :class:`Section` instances, one per student, in file
+        order.
+    """
+
+    def __init__(self, o_scores, e_scores, sections):
+        self.o_scores = o_scores
+        self.e_scores = e_scores
+        self.sections = list(sections)
+        # Filled by reparse_log, for reuse in next call.
+        self._preamble = None
+        self._chunks = {}
+
+    @property
+    def scores(self):
+        return self.o_scores, self.e_scores
+
+    @property
+    def lists(self):
+        """ Dictionary with student: marks dictionary key: value pairs
+        """
+        return OrderedDict((s.name, s.marks) for s in self.sections)
+
+    def check(self, required_fields=None, optional_fields=None):
+        """ Return marks for each student, and message with any problems
+
+        Parameters
+        ----------
+        required_fields : None or sequence, optional
+            Score names that must be present.  None means use names from
+            ordinary maxima.
+        optional_fields : None or sequence, optional
+            Score names that may be present.  None means use names from extra
+            maxima.
+
+        Returns
+        -------
+        lists : dict
+            Dictionary with student: marks dictionary key: value pairs.
+        msg : str
+            Problems found, one per line.
+        """
+        required = (list(self.o_scores) if required_fields is None
+                    else list(required_fields))
+        optional = (list(self.e_scores) if optional_fields is None
+                    else list(optional_fields))
+        msg_lines = []
+        for section in self.sections:
+            msg_lines += section.check(required, optional)
+        return self.lists, '\n'.join(msg_lines)
+
+    def feedback_parts(self):
+        """ Dictionary with student id: public feedback text key: value pairs
+        """
+        public_parts = {}
+        for section in self.sections:
+            match = STID_FINDER.match(section.name)
+            if match is None:
+                continue
+            public_parts[match.group()] = section.feedback
+        return public_parts
+
+
+class LogParser:
+    """ Parse marking log, fed one line at a time
+
+    We collect the lines for each section, and parse the whole section (see
+    :func:`_parse_section`) when we reach the next heading, or on
+    :meth:`close`.
+
+    Parameters
+    ----------
+    offset : int, optional
+        Byte offset of the first line to be fed.
+    """
+
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.preamble = []
+        self.sections = []
+        self._start = None
+        self._lines = None
+
+    def feed(self, line):
+        """ Process `line` as bytes, including line ending
+        """
+        if line.startswith(b'##') and HEADING_STARTS.match(line):
+            self._flush()
+            self._start = self.offset
+            self._lines = [line]
+        elif self._lines is None:
+            self.preamble.append(line.decode('utf8').rstrip('\r\n'))
+        else:
+            self._lines.append(line)
+        self.offset += len(line)
+
+    def _flush(self):
+        if self._lines is not None:
+            self.sections.append(
+                _parse_section(b''.join(self._lines), self._start))
+        self._lines = None
+
+    def close(self):
+        """ Return :class:`MarkingLog` from lines fed so far
+        """
+        self._flush()
+        return MarkingLog(*parse_maxima(self.preamble), self.sections)
+
+
+def iter_lines(fileish):
+    """ Iterate over lines in `fileish` as bytes, including line endings
+    """
+    if not hasattr(fileish, 'read'):
+        with open(fileish, 'rb') as fobj:
+            yield from fobj
+        return
+    for line in fileish:
+        yield line.encode('utf8') if isinstance(line, str) else line
+
+
+def read_contents(fileish):
+    """ Return contents of filename or file-like object `fileish` as bytes
+    """
+    if not hasattr(fileish, 'read'):
+        with open(fileish, 'rb') as fobj:
+            return fobj.read()
+    contents = fileish.read()
+    return contents.encode('utf8') if isinstance(contents, str) else contents
+
+
+def parse_log(fileish):
+    """ Parse marking log from filename or file-like object `fileish`
+
+    Returns
+    -------
+    log : MarkingLog
+    """
+    with phase('parse-log'):
+        contents = read_contents(fileish)
+        preamble, ranges = _split_log(contents)
+        return MarkingLog(*parse_maxima(preamble.decode('utf8').split('\n')),
+                          [_parse_section(contents[start:end], start)
+                           for start, end in ranges])
+
+
+def read_maxima(fileish):
+    """ Return ordinary and extra maxima from preamble of log `fileish`
+
+    Reads only as far as the first section heading, so does not parse, or
+    check, any student sections.
+
+    Parameters
+    ----------
+    fileish : str or file-like
+        Filename of marking log, or file-like object.
+
+    Returns
+    -------
+    o_scores : OrderedDict
+        Ordinary maxima.
+    e_scores : OrderedDict
+        Extra maxima.
+    """
+    preamble = []
+    for line in iter_lines(fileish):
+        if HEADING_STARTS.match(line):
+            break
+        preamble.append(line.decode('utf8'))
+    return parse_maxima(preamble)
+
+
+def iter_log(fileish):
+    """ Iterate over sections of marking log `fileish` as they are parsed
+
+    Parameters
+    ----------
+    fileish : str or file-like
+        Filename of marking log, or file-like object.
+
+    Yields
+    ------
+    scores : tuple
+        Tuple of ordinary maxima, extra maxima dictionaries from preamble.
+        The same for every section.
+    section : Section
+        Each section, as soon as we reach the end of the section.
+    """
+    parser = LogParser()
+    sections = parser.sections
+    scores = None
+    n_done = 0
+    for line in iter_lines(fileish):
+        if scores is None and parser._lines is not None:
+            scores = parse_maxima(parser.preamble)
+        # Parser parses previous section when it gets the next heading.
+        parser.feed(line)
+        for section in sections[n_done:]:
+            yield scores, section
+        n_done = len(sections)
+    parser.close()
+    if scores is None:
+        scores = parse_maxima(parser.preamble)
+    for section in sections[n_done:]:
+        yield scores, section
+
+
+def merge_logs(logs):
+    """ Merge sequence of :class:`MarkingLog` from several log files (shards)
+
+    Shards may leave out the maxima; those that have maxima must all have the
+    same maxima.  Each student must only have one section, in one shard.
+
+    Raises
+    ------
+    MarkingLogError
+        If shards have different maxima, or a student appears in more than
+        one shard, or has more than one section in a shard.
+    """
+    logs = list(logs)
+    maxima = [log.scores for log in logs if log.o_scores or log.e_scores]
+    if any(m != maxima[0] for m in maxima[1:]):
+        raise MarkingLogError('Marking logs have different maxima')
+    o_scores, e_scores = maxima[0] if maxima else ({}, {})
+    sections = list(chain.from_iterable(log.sections for log in logs))
+    names = list(map(attrgetter('name'), sections))
+    if len(set(names)) == len(names):  # No repeats; nothing to report.
+        return MarkingLog(o_scores, e_scores, sections)
+    shards = OrderedDict()
+    repeats = OrderedDict()
+    for i, log in enumerate(logs):
+        for section in log.sections:
+            sources = shards.setdefault(section.name, OrderedDict())
+            if i in sources:
+                repeats[f'{section.name} in {section.source}'] = None
+            sources[i] = section.source
+    dupes = [f'{name} in ' + ', '.join(str(s) for s in sources.values())
+             for name, sources in shards.items() if len(sources) > 1]
+    msgs = []
+    if dupes:
+        msgs.append('Students marked in more than one log:\n' +
+                    '\n'.join(dupes))
+    if repeats:
+        msgs.append('Students with more than one section in a log:\n' +
+                    '\n'.join(repeats))
+    raise MarkingLogError('\n'.join(msgs))
+
+
+def _split_log(contents):
+    """ Return preamble, and (start, end) offsets of sections, in `contents`
+    """
+    starts, names = _find_headings(contents)
+    ends = starts[1:] + [len(contents)]
+    preamble = contents[:starts[0]] if starts else contents
+    return preamble, list(zip(starts, ends))
+
+
+def _find_headings(contents):
+    """ Return byte offsets, and names as bytes, of headings in `contents`
+    """
+    starts = []
+    names = []
+    match = HEADING_STARTS.match(contents)
+    if match:
+        starts.append(0)
+        names.append(match.group(1))
+    for match in LATER_HEADINGS.finditer(contents):
+        starts.append(match.start() + 1)
+        names.append(match.group(1))
+    return starts, names
+
+
+def _parse_section(chunk, start, source=None):
+    """ Parse bytes `chunk` of one section, starting at byte offset `start`
+
+    `chunk` starts with the section heading, and runs to the next heading, or
+    the end of the log.
+    """
+    name, body = _section_body(chunk)
+    list_text = LIST_FINDER.match(body).group()
+    # First line after list should give the total.
+    rest = body[len(list_text):]
+    total_line = rest[1:].partition('\n')[0] if rest else None
+    mark_items = [(key.strip(), float(value))
+                  for key, value in ITEM_FINDER.findall(list_text)]
+    return Section(name, start, start + len(chunk), mark_items, total_line,
+                   _feedback_lines(body), source)
+
+
+def _section_body(chunk):
+    """ Return name, and text after heading, from bytes `chunk` of section
+
+    Each line of the text starts with a newline.
+    """
+    name = HEADING_STARTS.match(chunk).group(1).decode('utf8')
+    text = chunk.decode('utf8')
+    if '\r' in text:
+        text = LINE_CRS.sub('', text)
+    return name, text[len(text.partition('\n')[0]):]
+
+
+def _feedback_lines(body):
+    """ Return feedback lines from text `body` of section, after heading
+    """
+    # Line with numeric total starts feedback.
+    match = TOTAL_LINE_FINDER.search(body)
+    line_end = -1 if match is None else body.find('\n', match.end())
+    feedback_text = '' if line_end == -1 else body[line_end + 1:]
+    feedback_lines = feedback_text.split('\n') if feedback_text else []
+    if feedback_lines and feedback_lines[-1] == '':  # Final line ending.
+        feedback_lines.pop()
+    return feedback_lines
+
+
+def _parse_feedback(chunk, start, source=None):
+    """ Parse feedback only from bytes `chunk` of one section
+
+    As for :func:`_parse_section`, but giving section without marks.
+    """
+    name, body = _section_body(chunk)
+    return Section(name, start, start + len(chunk),
+                   feedback_lines=_feedback_lines(body), source=source)
+
+
+def reparse_log(contents, previous=None, source=None):
+    """ Parse bytes `contents`, reusing unchanged sections from `previous`
+
+    Gives the same result as :func:`parse_log`, but only parses the sections
+    (and preamble) that are not byte-for-byte the same as a section in
+    `previous`.  Use for parsing a log repeatedly as it changes.
+
+    Parameters
+    ----------
+    contents : bytes
+        Contents of marking log.
+    previous : None or MarkingLog, optional
+        Log returned from previous call to this function.
+    source : None or str, optional
+        Filename of log, to set as ``source`` for sections.
+
+    Returns
+    -------
+    log : MarkingLog
+    """
+    old_chunks = {} if previous is None else previous._chunks
+    preamble, ranges = _split_log(contents)
+    if previous is not None and previous._preamble == preamble:
+        maxima = previous.scores
+    else:
+        maxima = parse_maxima(preamble.decode('utf8').split('\n'))
+    chunks = {}
+    sections = []
+    for start, end in ranges:
+        chunk = contents[start:end]
+        old = old_chunks.get(chunk)
+        if old is None:
+            section = _parse_section(chunk, start, source)
+        elif (old.start, old.source) == (start, source):
+            section = old  # Same section in same place.
+        else:
+            section = old.moved(start, source)
+        chunks[chunk] = section
+        sections.append(section)
+    log = MarkingLog(*maxima, sections)
+    log._preamble = preamble
+    log._chunks = chunks
+    return log
+
+
+def cache_fname_for(fname):
+    """ Return filename of parse cache for marking log `fname`
+    """
+    path, name = psplit(fname)
+    return pjoin(path, f'.{name}.gdcache')
+
+
+def index_fname_for(fname):
+    """ Return filename of section index for marking log `fname`
+    """
+    path, name = psplit(fname)
+    return pjoin(path, f'.{name}.gdindex')
+
+
+def build_index(contents):
+    """ Return index of sections in marking log bytes `contents`
+
+    Parameters
+    ----------
+    contents : bytes-like
+        Contents of marking log, for example as memory map.
+
+    Returns
+    -------
+    index : dict
+        Dictionary with keys ``preamble``, giving (start, end) byte offsets of
+        preamble, ``sections``, giving dictionary with student name: (start,
+        end) key: value pairs, in file order, and ``repeated``, giving
+        dictionary with student name: list of (start, end) key: value pairs,
+        for students with more than one section.  For these students,
+        ``sections`` has the last section, as for parsing the whole log.
+    """
+    sections = OrderedDict()
+    repeated = OrderedDict()
+    starts, names = _find_headings(contents)
+    names = [name.decode('utf8') for name in names]
+    ends = starts[1:] + [len(contents)]
+    for name, start, end in zip(names, starts, ends):
+        if name in sections:
+            repeated.setdefault(name, [sections[name]]).append((start, end))
+        sections[name] = (start, end)
+    return dict(preamble=(0, starts[0] if starts else len(contents)),
+                sections=sections, repeated=repeated)
+
+
+@contextmanager
+def _mapped(fname):
+    """ Context manager giving contents of `fname` as read-only memory map
+    """
+    with open(fname, 'rb') as fobj:
+        if os.fstat(fobj.fileno()).st_size == 0:  # Cannot map empty file.
+            yield b''
+            return
+        with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+            yield contents
+
+
+def read_index(fname, use_cache=True):
+    """ Return index of sections in marking log `fname`
+
+    We keep the index in a file next to `fname` (see
+    :func:`index_fname_for`), and build it again, in one pass over the
+    memory-mapped log, when `fname` changes.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of marking log.
+    use_cache : {True, False}, optional
+        If False, ignore any saved index, and build from scratch.
+
+    Returns
+    -------
+    index : dict
+        See :func:`build_index`.
+    """
+    with phase('read-index'):
+        stat = os.stat(fname)
+        index_fname = index_fname_for(fname)
+        if use_cache:
+            cached = _load_cache(index_fname)
+            if _is_fresh(cached, stat):
+                return _data_to_index(cached['data'])
+        with _mapped(fname) as contents:
+            index = build_index(contents)
+        if use_cache:
+            _save_cache(index_fname, stat, None, index)
+        return index
+
+
+def read_sections(fnames, names, use_cache=True):
+    """ Read maxima, and sections for students `names`, from logs `fnames`
+
+    Uses the section index for each log (see :func:`read_index`) to read only
+    the preamble, and the sections for `names`, from each log.
+
+    Parameters
+    ----------
+    fnames : sequence
+        Filenames of marking logs.
+    names : sequence
+        Student names, as in section headings.
+    use_cache : {True, False}, optional
+        If False, ignore any saved indices.
+
+    Returns
+    -------
+    log : MarkingLog
+        Merged log (see :func:`merge_logs`), with sections only for students
+        in `names` that have sections.
+
+    Raises
+    ------
+    MarkingLogError
+        As for :func:`merge_logs`, for the students in `names`.
+    """
+    return _read_indexed(fnames, names, _parse_section, use_cache)
+
+
+def read_feedback(fnames, names=None, use_cache=True):
+    """ Read public feedback for students `names` from logs `fnames`
+
+    As for :func:`read_sections`, but only reading the feedback, not the
+    marks, from each section.  The parse cache does not store feedback, so
+    use this function, rather than :func:`read_logs`, to get feedback.
+
+    Parameters
+    ----------
+    fnames : sequence
+        Filenames of marking logs.
+    names : None or sequence, optional
+        Student names, as in section headings.  None means all students.
+    use_cache : {True, False}, optional
+        If False, ignore any saved indices.
+
+    Returns
+    -------
+    parts : dict
+        Dictionary with student id: public feedback text key: value pairs,
+        as for :meth:`MarkingLog.feedback_parts`.
+
+    Raises
+    ------
+    MarkingLogError
+        As for :func:`merge_logs`.
+    """
+    return _read_indexed(fnames, names, _parse_feedback,
+                         use_cache).feedback_parts()
+
+
+def _read_indexed(fnames, names, parser, use_cache):
+    """ Merged log from logs `fnames` with sections for `names`
+
+    Parse sections with ``parser(chunk, start, fname)``.  `names` of None
+    means all sections.
+    """
+    logs = []
+    for fname in fnames:
+        index = read_index(fname, use_cache)
+        ranges = []
+        # Read all sections for repeated students, so merge_logs can
+        # report them, as for reading the whole log.
+        for name in index['sections'] if names is None else names:
+            if name in index['repeated']:
+                ranges += index['repeated'][name]
+            elif name in index['sections']:
+                ranges.append(index['sections'][name])
+        start, end = index['preamble']
+        with _mapped(fname) as contents:
+            preamble = contents[start:end].decode('utf8')
+            sections = [parser(contents[start:end], start, fname)
+                        for start, end in ranges]
+        logs.append(MarkingLog(*parse_maxima(preamble.splitlines()),
+                               sections))
+    return merge_logs(logs)
+
+
+def _log_to_data(log):
+    """ Return compact, JSON-ready data for `log`, without feedback
+
+    Data has one list per attribute, with an entry per section, and lists
+    of mark names and values for all sections, to make a small file that is
+    quick to load.
+    """
+    sections = log.sections
+    item_lists = list(map(attrgetter('mark_items'), sections))
+    items = list(chain.from_iterable(item_lists))
+    key_ids = {}
+    for key, value in items:
+        key_ids.setdefault(key, len(key_ids))
+    return dict(o_scores=list(log.o_scores.items()),
+                e_scores=list(log.e_scores.items()),
+                names=list(map(attrgetter('name'), sections)),
+                starts=list(map(attrgetter('start'), sections)),
+                ends=list(map(attrgetter('end'), sections)),
+                total_lines=list(map(attrgetter('total_line'), sections)),
+                n_marks=list(map(len, item_lists)),
+                keys=list(key_ids),
+                key_ids=[key_ids[key] for key, value in items],
+                values=list(map(itemgetter(1), items)))
+
+
+def _data_to_log(data):
+    keys = list(map(data['keys'].__getitem__, data['key_ids']))
+    items = iter(zip(keys, data['values']))
+    item_lists = [list(islice(items, n)) for n in data['n_marks']]
+    # Feedback not stored; None feedback_lines mark it as not read.
+    return MarkingLog(OrderedDict(data['o_scores']),
+                      OrderedDict(data['e_scores']),
+                      list(map(Section, data['names'], data['starts'],
+                               data['ends'], item_lists, data['total_lines'],
+                               repeat(None))))
+
+
+def _data_to_index(data):
+    # JSON gives lists for tuples.
+    return dict(preamble=tuple(data['preamble']),
+                sections=OrderedDict(
+                    (name, tuple(r)) for name, r in data['sections'].items()),
+                repeated=OrderedDict(
+                    (name, [tuple(r) for r in ranges])
+                    for name, ranges in data['repeated'].items()))
+
+
+def _load_cache(cache_fname):
+    # Cache files are JSON, not pickle, because loading a pickle can run
+    # code, and anyone who can write to a shared marking directory could
+    # write the cache file.
+    try:
+        with open(cache_fname, 'rt', encoding='utf8') as fobj:
+            cached = json.load(fobj)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('version') != CACHE_VERSION:
+        return None
+    return cached
+
+
+def _save_cache(cache_fname, stat, digest, data):
+    cached = dict(version=CACHE_VERSION,
+                  written_ns=time.time_ns(),
+                  mtime_ns=stat.st_mtime_ns,
+                  size=stat.st_size,
+                  digest=digest,
+                  data=data)
+    # Compact JSON, in one write.
+    contents = json.dumps(cached, separators=(',', ':'))
+    try:
+        with open(cache_fname, 'wt', encoding='utf8') as fobj:
+            fobj.write(contents)
+    except OSError:  # Read-only directory, perhaps.
+        pass
+
+
+def _is_fresh(cached, stat):
+    """ True if file modification time and size match `cached`
+    """
+    return (cached is not None and
+            (cached['mtime_ns'], cached['size']) ==
+            (stat.st_mtime_ns, stat.st_size) and
+            stat.st_mtime_ns < cached['written_ns'] - RACY_NS)
+
+
+def _fresh_cached_log(fname):
+    """ Return log from cache for `fname` if modification time, size match
+    """
+    cached = _load_cache(cache_fname_for(fname))
+    if _is_fresh(cached, os.stat(fname)):
+        return _data_to_log(cached['data'])
+
+
+def read_log(fname, use_cache=True):
+    """ Parse marking log `fname`, using on-disk cache if valid
+
+    The cache is a file next to `fname` (see :func:`cache_fname_for`).  We
+    reuse it if `fname` has the same modification time and size as when we
+    wrote the cache, or, failing that, the same content hash.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of marking log.
+    use_cache : {True, False}, optional
+        If False, ignore any cache, and parse from scratch.
+
+    Returns
+    -------
+    log : MarkingLog
+        Log without feedback (``feedback_lines`` of None for each section),
+        whether from the cache or not; the cache does not store feedback.
+        Use :func:`read_feedback` to read feedback.
+    """
+    log = _read_log(fname, use_cache)
+    for section in log.sections:
+        section.source = fname
+        section.feedback_lines = None
+    return log
+
+
+def _read_log(fname, use_cache):
+    if not use_cache:
+        return parse_log(fname)
+    with phase('read-log-cache'):
+        cache_fname = cache_fname_for(fname)
+        stat = os.stat(fname)
+        cached = _load_cache(cache_fname)
+        if _is_fresh(cached, stat):
+            return _data_to_log(cached['data'])
+    with open(fname, 'rb') as fobj:
+        contents = fobj.read()
+    digest = sha256(contents).hexdigest()
+    if cached is not None and cached['digest'] == digest:
+        data = cached['data']
+        log = _data_to_log(data)
+    else:
+        log = parse_log(BytesIO(contents))
+        data = _log_to_data(log)
+    _save_cache(cache_fname, stat, digest, data)
+    return log
+
+
+def read_logs(fnames, use_cache=True, jobs=None):
+    """ Read, merge marking logs `fnames`, parsing in parallel where needed
+
+    Parameters
+    ----------
+    fnames : sequence
+        Filenames of marking logs, one per marker, say.
+    use_cache : {True, False}, optional
+        If False, ignore any on-disk parse cache.
+    jobs : None or int, optional
+        Maximum number of processes for parsing logs not in cache.  None means
+        use the number of CPUs.
+
+    Returns
+    -------
+    log : MarkingLog
+        Merged log; see :func:`merge_logs`.
+    """
+    fnames = list(fnames)
+    if len(fnames) == 1:
+        return merge_logs([read_log(fnames[0], use_cache)])
+    logs = OrderedDict((fname, None) for fname in fnames)
+    if use_cache:
+        with phase('read-log-cache'):
+            for fname in fnames:
+                log = _fresh_cached_log(fname)
+                if log is not None:
+                    for section in log.sections:
+                        section.source = fname
+                logs[fname] = log
+    to_read = [fname for fname, log in logs.items() if log is None]
+    jobs = os.cpu_count() if jobs is None else jobs
+    if len(to_read) > 1 and jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(jobs, len(to_read))) as executor:
+            logs.update(zip(to_read, executor.map(
+                read_log, to_read, [use_cache] * len(to_read))))
+    else:
+        logs.update((fname, read_log(fname, use_cache)) for fname in to_read)
+    return merge_logs(logs.values())
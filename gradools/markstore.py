@@ -0,0 +1,93 @@
+""" Store of final marks, one partition per year
+
+The store is a directory (default ``marks_store``) with one file per year,
+named ``year=<year>.npz``.  Each file has two columns (arrays): ``login``,
+with the student logins, and ``mark``, with the final marks.  Writing a year
+replaces the partition for that year only.
+"""
+
+import os
+import re
+from os.path import join as pjoin, isdir
+from collections import OrderedDict
+
+import numpy as np
+
+STORE_DIR = 'marks_store'
+PARTITION_FINDER = re.compile(r'^year=(\d+)\.npz$')
+
+
+def partition_fname(year, store_dir=STORE_DIR):
+    """ Return filename of partition for `year` in `store_dir`
+    """
+    return pjoin(store_dir, f'year={int(year)}.npz')
+
+
+def stored_years(store_dir=STORE_DIR):
+    """ Return sorted list of years in store `store_dir`
+    """
+    if not isdir(store_dir):
+        return []
+    matches = [PARTITION_FINDER.match(name) for name in os.listdir(store_dir)]
+    return sorted(int(m.group(1)) for m in matches if m)
+
+
+def write_year(marks, year, store_dir=STORE_DIR):
+    """ Write `marks` as partition for `year` in `store_dir`
+
+    Parameters
+    ----------
+    marks : dict
+        Dictionary with login: mark key: value pairs.
+    year : int or str
+        Year for marks.
+    store_dir : str, optional
+        Directory of store.  We make the directory if it does not exist.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    fname = partition_fname(year, store_dir)
+    # Write whole partition, then move into place, so readers never see part
+    # of a partition.
+    tmp_fname = fname + '.tmp.npz'
+    np.savez(tmp_fname,
+             login=np.array([str(login) for login in marks], dtype=str),
+             mark=np.array(list(marks.values()), dtype=float))
+    os.replace(tmp_fname, fname)
+
+
+def read_years(years=None, store_dir=STORE_DIR):
+    """ Read logins and marks for `years` from store `store_dir`
+
+    Parameters
+    ----------
+    years : None or sequence, optional
+        Years to read.  None means all years in store.
+    store_dir : str, optional
+        Directory of store.
+
+    Returns
+    -------
+    columns : dict
+        Dictionary with year: (logins, marks) key: value pairs, for each year
+        in `years` that is in the store, in order of `years`.  `logins` and
+        `marks` are arrays.
+    """
+    stored = stored_years(store_dir)
+    years = stored if years is None else [int(y) for y in years]
+    columns = OrderedDict()
+    for year in years:
+        if year not in stored:
+            continue
+        with np.load(partition_fname(year, store_dir)) as partition:
+            columns[year] = (partition['login'], partition['mark'])
+    return columns
+
+
+def read_year(year, store_dir=STORE_DIR):
+    """ Return dictionary of login: mark for `year`, or None if not stored
+    """
+    columns = read_years([year], store_dir)
+    if not columns:
+        return None
+    logins, marks = columns[int(year)]
+    return OrderedDict(zip(logins.tolist(), marks.tolist()))
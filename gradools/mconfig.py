@@ -1,26 +1,65 @@
 """ Tools for grading
 """
 
-from os.path import exists, join as pjoin
-from collections import OrderedDict
+import os
+from os.path import exists, join as pjoin, abspath
+from glob import glob
 
 import pytoml as toml
 
-import pandas as pd
+from .marklog import read_logs, read_maxima, read_sections, proc_line
+from .profiling import phase, profiled
 
 
 class ConfigError(RuntimeError):
     pass
 
 
+def file_state(fname):
+    """ Return tuple that changes when file `fname` changes, None if missing
+    """
+    try:
+        st = os.stat(fname)
+    except FileNotFoundError:
+        return None
+    return (abspath(fname), st.st_ino, st.st_mtime_ns, st.st_size)
+
+
 class Config:
+    """ Configuration, roster and marking log for current directory
+
+    Values read from files are cached, and read again when the file changes.
+    Use :meth:`reload` to clear the cache.
+    """
 
     config_fname = 'gdconfig.toml'
     required_fields = ('year',)
     default_log = 'marking_log.md'
 
-    def __init__(self):
-        self._params = None
+    def __init__(self, use_cache=True):
+        self._cache = {}
+        self.use_cache = use_cache
+
+    def reload(self):
+        """ Clear cached config, roster and marking log
+        """
+        self._cache.clear()
+
+    def _cached(self, name, fnames, loader):
+        """ Return cached value `name`, reloading if files `fnames` change
+
+        `fnames` is a filename or sequence of filenames.
+        """
+        if isinstance(fnames, str):
+            fnames = [fnames]
+        state = tuple(file_state(fname) for fname in fnames)
+        if name in self._cache:
+            old_state, value = self._cache[name]
+            if old_state == state:
+                return value
+        value = loader()
+        self._cache[name] = (state, value)
+        return value
 
     def __getitem__(self, key):
         return self.params[key]
@@ -33,28 +72,52 @@ class Config:
 
     @property
     def params(self):
-        if self._params is None:
-            self._params = self._read_config()
-        return self._params
+        return self._cached('params', self.config_fname, self._read_config)
 
     def _read_config(self):
         fname = self.config_fname
         if not exists(fname):
             raise ConfigError(
                 f'Should be {fname} in current directory')
-        with open(fname, 'rb') as fobj:
+        with phase('read-config'), open(fname, 'rb') as fobj:
             config = toml.load(fobj)
         for field in self.required_fields:
             if not field in config:
                 raise ConfigError(f'{fname} should have "{field}" field')
         return config
 
+    @property
+    def marking_logs(self):
+        """ List of marking log filenames
+
+        The ``log`` field in the config file can be a filename, a glob
+        pattern such as ``"logs/*.md"``, or a list of these, for example one
+        log per marker.
+        """
+        entries = self.get('log', self.default_log)
+        if isinstance(entries, str):
+            entries = [entries]
+        fnames = []
+        for entry in entries:
+            if any(c in entry for c in '*?['):
+                matches = sorted(glob(entry))
+                if not matches:
+                    raise ConfigError(f'No logs match {entry}')
+                fnames += matches
+                continue
+            if not exists(entry):
+                raise ConfigError(f'Log {entry} does not exist')
+            fnames.append(entry)
+        return fnames
+
     @property
     def marking_log(self):
-        fn = self.get('log', self.default_log)
-        if not exists(fn):
-            raise ConfigError(f'Log {fn} does not exist')
-        return fn
+        """ Filename of marking log, if there is only one
+        """
+        fnames = self.marking_logs
+        if len(fnames) > 1:
+            raise ConfigError('More than one marking log; use marking_logs')
+        return fnames[0]
 
     @property
     def year(self):
@@ -76,63 +139,59 @@ class Config:
         return pjoin(*template.split('/'))
 
     def get_students(self):
-        if not exists(self.student_fname):
+        fname = self.student_fname
+        if not exists(fname):
             raise ConfigError('Run gdo-mkstable here')
-        return pd.read_csv(self.student_fname)
+        # Copy, because callers may modify the returned table.
+        return self._cached('students', fname,
+                            lambda: _read_csv(fname)).copy()
+
+    @property
+    def log(self):
+        """ Parsed marking log, merged from all marking logs
+
+        Use on-disk parse cache unless ``use_cache`` attribute is False.
+        """
+        fnames = self.marking_logs
+        return self._cached('log', fnames,
+                            lambda: read_logs(fnames, self.use_cache))
 
     @property
     def scores(self):
-        return get_scores(self.marking_log)
+        """ Ordinary and extra maxima, from preambles of marking logs
+
+        Reads only the preambles (see :func:`read_sections`), so does not
+        parse or check the student sections.
+        """
+        fnames = self.marking_logs
+        return self._cached(
+            'scores', fnames,
+            lambda: read_sections(fnames, [], self.use_cache).scores)
 
     @property
     def score_lines(self):
-        return get_score_lines(*self.scores)
+        return self._cached('score_lines', self.marking_logs,
+                            lambda: get_score_lines(*self.scores))
 
 
 CONFIG = Config()
 
 
+def _read_csv(fname):
+    with phase('load-roster'):
+        # Import pandas here; it is slow to import, and many commands do not
+        # need it.
+        import pandas as pd
+        return pd.read_csv(fname)
+
+
+@profiled
 def print_year():
     print(CONFIG['year'])
 
 
 def get_scores(fileish):
-    if hasattr(fileish, 'read'):
-        contents = fileish.read()
-    else:
-        with open(fileish, 'rt') as fobj:
-            contents = fobj.read()
-    lines = contents.splitlines()
-    state = 'searching'
-    o_scores = OrderedDict()
-    e_scores = OrderedDict()
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if line == '':
-            continue
-        if state == 'searching':
-            if line == 'Ordinary maxima:':
-                state = 'ordinary-scores'
-        elif state == 'ordinary-scores':
-            if line == 'Extra maxima:':
-                state = 'extra-scores'
-                continue
-            elif line.startswith('Total'):
-                break
-            key, value = proc_line(line)
-            o_scores[key] = float(value)
-        elif state == 'extra-scores':
-            if line.startswith('Total'):
-                break
-            key, value = proc_line(line)
-            e_scores[key] = float(value)
-    return o_scores, e_scores
-
-
-def proc_line(line):
-    if not line.startswith('*'):
-        raise ValueError('Invalid list element')
-    return [v.strip() for v in line[1:].split(':')]
+    return read_maxima(fileish)
 
 
 def get_score_lines(o_scores, e_scores):
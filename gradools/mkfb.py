@@ -2,18 +2,62 @@
 """
 
 import os
-from os.path import join as pjoin, isdir
+import io
+import sys
+import csv
+import zipfile
+from os.path import join as pjoin, isdir, exists, basename, abspath
 from shutil import rmtree
 import re
-from subprocess import Popen, PIPE, check_call
+import json
+import threading
+from hashlib import sha256
+from tempfile import TemporaryDirectory
+from subprocess import (Popen, PIPE, DEVNULL, check_call, check_output,
+                        CalledProcessError)
+from concurrent.futures import ThreadPoolExecutor
+from argparse import ArgumentParser
 
+from . import __version__
 from .mconfig import CONFIG
+from .marklog import STID_FINDER, TOTAL_FINDER, read_feedback
+from .profiling import phase, profiled
 
 
-STUDENT_SPLITTER = re.compile(r'^##\s+', re.M)
-STID_FINDER = re.compile(r'^\w\w\w\d+')
-TOTAL_FINDER = re.compile(r'^Total\s*:\s*[0-9.]+')
 FEEDBACK_DIR = 'feedback'
+MANIFEST_FNAME = 'manifest.json'
+# Students built so far in current run, one JSON line per student.
+JOURNAL_FNAME = 'journal.jsonl'
+# Errors from last run, one line per student.
+ERRORS_FNAME = 'errors.txt'
+# Listing of entries in feedback bundle zip file.
+BUNDLE_MANIFEST_FNAME = 'manifest.csv'
+
+# Paragraph marking student boundaries in batch markdown, followed by number.
+SPLIT_MARK = 'GDOSPLITMARK'
+SPLIT_FINDER = re.compile(rf'^{SPLIT_MARK}(\d+)$', re.M)
+
+# LaTeX header for batch document.  Each student writes their page count to
+# ``<jobname>.pages``.
+BATCH_HEADER = r"""\newwrite\gdopages
+\AtBeginDocument{\immediate\openout\gdopages=\jobname.pages}
+"""
+
+# nbconvert PDF exporter for this process; see _get_pdf_exporter.
+_EXPORTER = {}
+
+
+class RenderError(RuntimeError):
+    """ Exception for failure to render one or more students
+
+    Attribute ``errors`` is a dictionary with student id: exception key:
+    value pairs.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('Rendering failed for:\n' + '\n'.join(
+            f'{stid}: {exc}' for stid, exc in errors.items()))
 
 
 def prune_part(part):
@@ -27,32 +71,274 @@ def prune_part(part):
     return '\n'.join(lines)
 
 
-def get_parts(config=CONFIG):
-    with open(config.marking_log, 'rt') as fobj:
-        text = fobj.read()
-    parts = STUDENT_SPLITTER.split(text)
-    public_parts = {}
-    for part in parts:
-        match = STID_FINDER.match(part)
-        if match is None:
-            continue
-        public_parts[match.group()] = prune_part(part)
-    return public_parts
-
-
-def write_parts(parts, out_dir=FEEDBACK_DIR, has_notebook=False):
-    for stid, text in parts.items():
-        out_root = pjoin(out_dir, stid)
-        proc = Popen(['pandoc', '-f' 'gfm', '-t', 'latex', '-o',
-                      out_root + '_notes.pdf'],
-                     stdin=PIPE, stderr=PIPE)
-        out, err = proc.communicate(text.encode('utf8'))
-        if err:
-            raise RuntimeError(err)
-        if not has_notebook:
-            continue
-        check_call(['jupyter', 'nbconvert', stid + '.ipynb',
-                    '--to', 'pdf', '--output', out_root + '_nb'])
+def get_parts(config=CONFIG, stids=None):
+    """ Public feedback for students `stids` (None for all students)
+    """
+    return read_feedback(config.marking_logs, stids, config.use_cache)
+
+
+def write_part(stid, text, out_dir=FEEDBACK_DIR, has_notebook=False,
+               cwd=None, in_process=True):
+    """ Build feedback PDF(s) for student `stid` from markdown `text`
+
+    `cwd` is the directory containing the notebooks, and any files the
+    feedback refers to; default is the current directory.  Relative `out_dir`
+    is relative to `cwd`.  See :func:`write_notebook` for `in_process`.
+    """
+    with phase('render-student'):
+        _write_part(stid, text, out_dir, has_notebook, cwd, in_process)
+
+
+def _write_part(stid, text, out_dir, has_notebook, cwd=None,
+                in_process=True):
+    # Use absolute paths, and pass working directory to subprocesses, because
+    # an in-process notebook export changes the working directory; see
+    # write_notebook.
+    cwd = os.getcwd() if cwd is None else cwd
+    out_root = pjoin(cwd, out_dir, stid)
+    proc = Popen(['pandoc', '-f' 'gfm', '-t', 'latex', '-o',
+                  out_root + '_notes.pdf'],
+                 stdin=PIPE, stderr=PIPE, cwd=cwd)
+    out, err = proc.communicate(text.encode('utf8'))
+    # Pandoc may write warnings to stderr; only fail for error return code.
+    if proc.returncode:
+        raise RuntimeError(err.decode('utf8', 'replace').strip() or
+                           f'pandoc returned {proc.returncode}')
+    if has_notebook:
+        _write_notebook(stid, out_dir, cwd, in_process)
+
+
+def write_notebook(stid, out_dir=FEEDBACK_DIR, cwd=None, in_process=True):
+    """ Build PDF for notebook ``<stid>.ipynb`` in directory `cwd`
+
+    If `in_process` is True, and nbconvert is installed, convert with
+    nbconvert in this process, otherwise run ``jupyter nbconvert``.
+    nbconvert changes the working directory of the whole process while it
+    exports, so only convert in this process when no other thread is
+    rendering.
+    """
+    with phase('render-notebook'):
+        _write_notebook(stid, out_dir, cwd, in_process)
+
+
+def _write_notebook(stid, out_dir, cwd=None, in_process=True):
+    cwd = os.getcwd() if cwd is None else cwd
+    nb_fname = pjoin(cwd, stid + '.ipynb')
+    out_root = pjoin(cwd, out_dir, stid) + '_nb'
+    exporter = _get_pdf_exporter() if in_process else None
+    if exporter is None:
+        check_call(['jupyter', 'nbconvert', nb_fname,
+                    '--to', 'pdf', '--output', out_root], cwd=cwd)
+        return
+    pdf, resources = exporter.from_filename(nb_fname)
+    with open(out_root + '.pdf', 'wb') as fobj:
+        fobj.write(pdf)
+
+
+def _get_pdf_exporter():
+    """ Return nbconvert PDF exporter, None if no nbconvert
+
+    We make one exporter, and reuse it for all notebooks, to pay for
+    importing nbconvert and setting up the exporter once, rather than once
+    per student.
+    """
+    if 'pdf' not in _EXPORTER:
+        try:
+            from nbconvert import PDFExporter
+        except ImportError:
+            _EXPORTER['pdf'] = None
+        else:
+            _EXPORTER['pdf'] = PDFExporter()
+    return _EXPORTER['pdf']
+
+
+def batch_markdown(parts):
+    """ Return markdown for all `parts`, with numbered marks between students
+    """
+    chunks = []
+    for i, text in enumerate(parts.values()):
+        chunks += [f'{SPLIT_MARK}{i}', text]
+    chunks.append(f'{SPLIT_MARK}{len(parts)}')
+    return '\n\n'.join(chunks) + '\n'
+
+
+def mark_pages(latex, n_parts):
+    """ Replace marks in `latex` with new pages, and commands to count pages
+
+    Each student starts on a new page, numbered 1.  At the end of each
+    student, LaTeX writes the number of their last page to the ``.pages``
+    file; see ``BATCH_HEADER``.
+
+    Raises
+    ------
+    ValueError
+        If we cannot find a mark for every student boundary, for example
+        because an unclosed code block in the feedback swallowed a mark.
+    """
+    if SPLIT_FINDER.findall(latex) != [str(i) for i in range(n_parts + 1)]:
+        raise ValueError('Cannot find all student boundaries in LaTeX')
+
+    def to_commands(match):
+        i = int(match.group(1))
+        commands = [r'\write\gdopages{\thepage}'] if i else []
+        if i < n_parts:
+            # \null makes sure the student has a page, even without text.
+            commands += [r'\clearpage', r'\setcounter{page}{1}', r'\null']
+        return '\n'.join(commands)
+
+    return SPLIT_FINDER.sub(to_commands, latex)
+
+
+def _get_pypdf():
+    # pypdf is optional; we only need it for batch rendering.
+    try:
+        import pypdf
+    except ImportError:
+        pypdf = None
+    return pypdf
+
+
+def split_pdf(fname, counts, out_fnames):
+    """ Split PDF `fname` into PDFs `out_fnames` with `counts` pages each
+    """
+    pypdf = _get_pypdf()
+    reader = pypdf.PdfReader(fname)
+    if len(counts) != len(out_fnames) or sum(counts) != len(reader.pages):
+        raise ValueError(f'Page counts do not match pages in {fname}')
+    start = 0
+    for count, out_fname in zip(counts, out_fnames):
+        writer = pypdf.PdfWriter()
+        for page in reader.pages[start:start + count]:
+            writer.add_page(page)
+        with open(out_fname, 'wb') as fobj:
+            writer.write(fobj)
+        start += count
+
+
+def write_notes_batch(parts, out_dir=FEEDBACK_DIR):
+    """ Build notes PDFs for all `parts` with one pandoc and one LaTeX run
+
+    Pandoc converts the markdown for all students to one LaTeX document, with
+    each student starting on a new page.  We run LaTeX once on this document,
+    and split the resulting PDF into one PDF per student.  Needs the pypdf
+    package.
+
+    Parameters
+    ----------
+    parts : dict
+        Dictionary with student id: markdown text key: value pairs.
+    out_dir : str, optional
+        Directory to which to write PDFs.
+    """
+    with TemporaryDirectory() as tmpdir:
+        header = pjoin(tmpdir, 'header.tex')
+        with open(header, 'wt') as fobj:
+            fobj.write(BATCH_HEADER)
+        latex = check_output(
+            ['pandoc', '-f', 'gfm', '-t', 'latex', '-s', '-H', header],
+            input=batch_markdown(parts).encode('utf8'), stderr=PIPE)
+        tex_fname = pjoin(tmpdir, 'batch.tex')
+        with open(tex_fname, 'wt') as fobj:
+            fobj.write(mark_pages(latex.decode('utf8'), len(parts)))
+        # Run in current directory, in case feedback refers to images.
+        check_call(['pdflatex', '-interaction=nonstopmode', '-halt-on-error',
+                    '-output-directory', tmpdir, tex_fname],
+                   stdout=DEVNULL)
+        with open(pjoin(tmpdir, 'batch.pages'), 'rt') as fobj:
+            counts = [int(line) for line in fobj]
+        split_pdf(pjoin(tmpdir, 'batch.pdf'), counts,
+                  [pjoin(out_dir, stid + '_notes.pdf') for stid in parts])
+
+
+def _try_notes_batch(parts, out_dir):
+    """ Build notes PDFs with :func:`write_notes_batch`, return True if built
+    """
+    if _get_pypdf() is None:
+        return False
+    try:
+        with phase('render-batch'):
+            write_notes_batch(parts, out_dir)
+    except (OSError, CalledProcessError, ValueError):
+        # Caller builds each student separately, to find those that fail.
+        return False
+    return True
+
+
+def _retried(func, retries):
+    """ Return function calling `func`, retrying up to `retries` times
+    """
+
+    def retrying(*args):
+        for attempt in range(retries + 1):
+            try:
+                return func(*args)
+            except Exception:
+                if attempt == retries:
+                    raise
+
+    return retrying
+
+
+def write_parts(parts, out_dir=FEEDBACK_DIR, has_notebook=False, jobs=1,
+                batch=False, retries=0, on_done=None):
+    """ Build feedback PDFs for all students in `parts`
+
+    Parameters
+    ----------
+    parts : dict
+        Dictionary with student id: markdown text key: value pairs.
+    out_dir : str, optional
+        Directory to which to write PDFs.
+    has_notebook : {False, True}, optional
+        If True, also convert ``<stid>.ipynb`` notebook to PDF.
+    jobs : None or int, optional
+        Number of students to render at the same time.  None means use the
+        number of CPUs.
+    batch : {False, True}, optional
+        If True, build notes PDFs for all students with
+        :func:`write_notes_batch`.  Falls back to building each student
+        separately if pypdf is not installed, or the batch build fails.
+    retries : int, optional
+        Number of times to try again to render a student that failed.
+    on_done : None or callable, optional
+        If not None, call as ``on_done(stid)`` as soon as we have rendered
+        each student.  If `on_done` raises an error, the student failed.
+
+    Raises
+    ------
+    RenderError
+        If rendering failed for any student.  Rendering continues for the
+        other students; the error message lists all failures.
+    """
+    on_done = (lambda stid: None) if on_done is None else on_done
+    notes_built = batch and parts and _try_notes_batch(parts, out_dir)
+    render_nb = _retried(write_notebook, retries)
+    render = _retried(write_part, retries)
+    # Threads must not use the working directory; see write_notebook.
+    cwd = os.getcwd()
+    jobs = os.cpu_count() if jobs is None else jobs
+    # Exporting notebooks in this process changes the working directory,
+    # and so can only run in one thread at a time.  For more than one job,
+    # run notebook conversions as subprocesses, in parallel.
+    in_process = jobs <= 1
+
+    def render_student(stid, text):
+        if not notes_built:
+            render(stid, text, out_dir, has_notebook, cwd, in_process)
+        elif has_notebook:
+            render_nb(stid, out_dir, cwd, in_process)
+        on_done(stid)
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [(stid, executor.submit(render_student, stid, text))
+                   for stid, text in parts.items()]
+    errors = {}
+    for stid, future in futures:
+        exc = future.exception()
+        if exc is not None:
+            errors[stid] = exc
+    if errors:
+        raise RenderError(errors)
 
 
 def write_stids(stids, out_dir=FEEDBACK_DIR):
@@ -60,13 +346,385 @@ def write_stids(stids, out_dir=FEEDBACK_DIR):
         fobj.write('\n'.join(stids))
 
 
+def out_fnames(stid, out_dir=FEEDBACK_DIR, has_notebook=False):
+    """ Return output PDF filenames for student `stid`
+    """
+    out_root = pjoin(out_dir, stid)
+    suffixes = ('_notes', '_nb') if has_notebook else ('_notes',)
+    return [out_root + suffix + '.pdf' for suffix in suffixes]
+
+
+def remove_outputs(stid, out_dir=FEEDBACK_DIR):
+    for fname in out_fnames(stid, out_dir, has_notebook=True):
+        if exists(fname):
+            os.unlink(fname)
+
+
+def _tool_version(cmd):
+    try:
+        out = check_output(cmd + ['--version'], stderr=PIPE)
+    except (OSError, CalledProcessError):
+        return 'unavailable'
+    return out.decode('utf8', 'replace').strip()
+
+
+def _nbconvert_version():
+    # As for _get_pdf_exporter, use nbconvert in this environment if present.
+    try:
+        import nbconvert
+    except ImportError:
+        return _tool_version(['jupyter', 'nbconvert'])
+    return f'nbconvert {nbconvert.__version__}'
+
+
+def tool_signature(has_notebook=False):
+    """ Return string identifying the tools used for rendering
+    """
+    versions = [f'gradools {__version__}', _tool_version(['pandoc'])]
+    if has_notebook:
+        versions.append(_nbconvert_version())
+    return '\n'.join(versions)
+
+
+def part_key(stid, text, has_notebook=False, signature=''):
+    """ Return hash of everything that determines output for student `stid`
+    """
+    hasher = sha256(signature.encode('utf8'))
+    hasher.update(b'\0' + text.encode('utf8'))
+    nb_fname = stid + '.ipynb'
+    if has_notebook and exists(nb_fname):
+        with open(nb_fname, 'rb') as fobj:
+            hasher.update(b'\0' + fobj.read())
+    return hasher.hexdigest()
+
+
+def read_manifest(out_dir=FEEDBACK_DIR):
+    fname = pjoin(out_dir, MANIFEST_FNAME)
+    if not exists(fname):
+        return {}
+    with open(fname, 'rt') as fobj:
+        return json.load(fobj)
+
+
+def write_manifest(manifest, out_dir=FEEDBACK_DIR):
+    with open(pjoin(out_dir, MANIFEST_FNAME), 'wt') as fobj:
+        json.dump(manifest, fobj, indent=0, sort_keys=True)
+
+
+def read_journal(out_dir=FEEDBACK_DIR):
+    """ Return student id: key dictionary from journal of unfinished run
+    """
+    fname = pjoin(out_dir, JOURNAL_FNAME)
+    if not exists(fname):
+        return {}
+    journal = {}
+    with open(fname, 'rt') as fobj:
+        for line in fobj:
+            try:
+                stid, key = json.loads(line)
+            except ValueError:  # Line cut short by interruption.
+                continue
+            journal[stid] = key
+    return journal
+
+
+class Journal:
+    """ Record each student as built, so an interrupted run can resume
+
+    Parameters
+    ----------
+    keys : dict
+        Dictionary with student id: key key: value pairs, giving keys to
+        record for built students.
+    out_dir : str, optional
+        Directory containing journal.
+    """
+
+    def __init__(self, keys, out_dir=FEEDBACK_DIR):
+        self.keys = keys
+        # Absolute, as we record from rendering threads; see write_notebook.
+        self.fname = abspath(pjoin(out_dir, JOURNAL_FNAME))
+        self._lock = threading.Lock()
+
+    def record(self, stid):
+        line = json.dumps([stid, self.keys[stid]]) + '\n'
+        with self._lock, open(self.fname, 'at') as fobj:
+            fobj.write(line)
+
+    def remove(self):
+        if exists(self.fname):
+            os.unlink(self.fname)
+
+
+class Bundle:
+    """ Zip file of feedback PDFs, adding each student as they finish
+
+    Entries for students with a submission key (see
+    :func:`gradools.canvastools.fname2key`) have Canvas-style names made
+    from the key, such as ``brett_matthew124954_notes.pdf``; entries for
+    other students start with the student id.  Closing the bundle writes a
+    manifest, ``manifest.csv``, listing the entries for each student.
+
+    Parameters
+    ----------
+    fname : str
+        Filename of zip file to write.
+    keys : None or dict, optional
+        Dictionary with student id: submission key key: value pairs.
+    out_dir : str, optional
+        Directory containing PDFs.
+    has_notebook : {False, True}, optional
+        If True, students also have notebook PDFs.
+    """
+
+    def __init__(self, fname, keys=None, out_dir=FEEDBACK_DIR,
+                 has_notebook=False):
+        self.keys = {} if keys is None else keys
+        # Absolute, as we add from rendering threads; see write_notebook.
+        self.out_dir = abspath(out_dir)
+        self.has_notebook = has_notebook
+        # PDFs are already compressed; store them as they are.
+        self._zip = zipfile.ZipFile(fname, 'w', zipfile.ZIP_STORED)
+        self._rows = []
+        self._added = set()
+        self._lock = threading.Lock()
+
+    def entry_name(self, stid, fname):
+        """ Return name in zip file for student `stid` PDF `fname`
+        """
+        suffix = basename(fname)[len(stid) + 1:]
+        if stid not in self.keys:
+            return f'{stid}_{suffix}'
+        from .canvastools import key2fname
+        return key2fname(self.keys[stid], suffix)
+
+    def add(self, stid):
+        """ Add PDFs for student `stid`, if built and not already added
+        """
+        fnames = out_fnames(stid, self.out_dir, self.has_notebook)
+        with self._lock:
+            if stid in self._added or not all(exists(f) for f in fnames):
+                return
+            family, given, id_no = self.keys.get(stid, ('', '', ''))
+            for fname in fnames:
+                # Copies from file to zip file a chunk at a time.
+                entry = self.entry_name(stid, fname)
+                self._zip.write(fname, entry)
+                self._rows.append((stid, family, given, id_no, entry))
+            self._added.add(stid)
+
+    def close(self):
+        with self._lock, self._zip.open(BUNDLE_MANIFEST_FNAME, 'w') as fobj:
+            with io.TextIOWrapper(fobj, 'utf8', newline='') as text:
+                writer = csv.writer(text)
+                writer.writerow(('stid', 'family', 'given', 'id_no',
+                                 'entry'))
+                writer.writerows(self._rows)
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_errors(errors, out_dir=FEEDBACK_DIR):
+    """ Write error report for student id: exception dictionary `errors`
+
+    Removes any old report if `errors` is empty.
+    """
+    fname = pjoin(out_dir, ERRORS_FNAME)
+    if not errors:
+        if exists(fname):
+            os.unlink(fname)
+        return
+    with open(fname, 'wt') as fobj:
+        for stid, exc in sorted(errors.items()):
+            fobj.write(f'{stid}: {exc}\n')
+
+
+def stale_parts(parts, keys, manifest, out_dir=FEEDBACK_DIR,
+                has_notebook=False):
+    """ Return parts with changed key in `manifest`, or missing outputs
+    """
+    return {stid: text for stid, text in parts.items()
+            if manifest.get(stid) != keys[stid] or not
+            all(exists(f) for f in out_fnames(stid, out_dir, has_notebook))}
+
+
+def update_parts(parts, out_dir=FEEDBACK_DIR, has_notebook=False, jobs=1,
+                 batch=False, prune=True, retries=0, resume=False,
+                 on_done=None):
+    """ Build PDFs for new or changed students, remove those for old students
+
+    Parameters
+    ----------
+    parts : dict
+        Dictionary with student id: markdown text key: value pairs.
+    out_dir : str, optional
+        Directory to which to write PDFs, and containing build manifest.
+    has_notebook : {False, True}, optional
+        If True, also convert ``<stid>.ipynb`` notebook to PDF.
+    jobs : None or int, optional
+        Number of students to render at the same time.  None means use the
+        number of CPUs.
+    batch : {False, True}, optional
+        If True, build notes PDFs in one batch; see :func:`write_parts`.
+    prune : {True, False}, optional
+        If True, remove PDFs for students in the manifest but not in `parts`.
+        Use False when `parts` has only some of the students.
+    retries : int, optional
+        Number of times to try again to render a student that failed.
+    resume : {False, True}, optional
+        If True, reuse PDFs built by an earlier run that did not finish, as
+        recorded in the journal (see :class:`Journal`).  Otherwise, build
+        these students again.
+    on_done : None or callable, optional
+        If not None, call as ``on_done(stid)`` as soon as we have rendered
+        each student.
+
+    Returns
+    -------
+    built : list
+        Student ids for which we rebuilt the PDFs.
+
+    Raises
+    ------
+    RenderError
+        If rendering failed for any student.  The manifest records all
+        students that did render, and the error report file in `out_dir`
+        lists the failures.
+    """
+    manifest = read_manifest(out_dir)
+    if resume:
+        manifest.update(read_journal(out_dir))
+    signature = tool_signature(has_notebook)
+    keys = {stid: part_key(stid, text, has_notebook, signature)
+            for stid, text in parts.items()}
+    journal = Journal(keys, out_dir)
+    journal.remove()
+    for stid in set(manifest).difference(parts) if prune else ():
+        remove_outputs(stid, out_dir)
+        del manifest[stid]
+    to_build = stale_parts(parts, keys, manifest, out_dir, has_notebook)
+    for stid in to_build:
+        remove_outputs(stid, out_dir)
+        manifest.pop(stid, None)
+    # Make sure manifest does not list students we are about to build.
+    write_manifest(manifest, out_dir)
+
+    def done(stid):
+        journal.record(stid)
+        if on_done is not None:
+            on_done(stid)
+
+    try:
+        write_parts(to_build, out_dir, has_notebook, jobs, batch, retries,
+                    on_done=done)
+    except RenderError as err:
+        _record_built(manifest, keys, set(to_build).difference(err.errors),
+                      out_dir, journal)
+        write_errors(err.errors, out_dir)
+        raise
+    _record_built(manifest, keys, to_build, out_dir, journal)
+    write_errors({}, out_dir)
+    return list(to_build)
+
+
+def _record_built(manifest, keys, stids, out_dir, journal):
+    manifest.update({stid: keys[stid] for stid in stids})
+    write_manifest(manifest, out_dir)
+    journal.remove()
+
+
+def open_bundle(fname, parts, submissions=None, has_notebook=False):
+    """ Return :class:`Bundle` writing to `fname` for students in `parts`
+
+    If `submissions` is not None, it is the Canvas submissions directory or
+    zip file, from which we get the submission keys to name the entries.
+    """
+    if submissions is None:
+        return Bundle(fname, None, FEEDBACK_DIR, has_notebook)
+    # Import here; canvastools needs pandas, which is slow to import.
+    from .canvastools import login_keys
+    keys = login_keys(submissions, CONFIG.get_students())
+    missing = sorted(set(parts).difference(keys))
+    if missing:
+        print('No submission for ' + ', '.join(missing), file=sys.stderr)
+    return Bundle(fname, keys, FEEDBACK_DIR, has_notebook)
+
+
+@profiled
 def main():
-    if isdir(FEEDBACK_DIR):
+    parser = ArgumentParser()
+    parser.add_argument('stids', nargs='*',
+                        help='Only build PDFs for these students (default is '
+                        'all students)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of students to render in parallel '
+                        '(default is number of CPUs)')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Delete all previous outputs and rebuild all '
+                        'students')
+    parser.add_argument('--batch', action='store_true',
+                        help='Build notes for all students with one pandoc '
+                        'and one LaTeX run (needs pypdf)')
+    parser.add_argument('--retries', type=int, default=1,
+                        help='Number of times to try again to render a '
+                        'student that failed (default 1)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Reuse PDFs built by an interrupted run')
+    parser.add_argument('--bundle', metavar='ZIPFILE',
+                        help='Also write PDFs to this zip file, adding each '
+                        'student as they finish')
+    parser.add_argument('--submissions', metavar='PATH',
+                        help='Canvas submissions directory or zip file; name '
+                        'entries in bundle to match submission filenames')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use or update marking log parse cache')
+    args = parser.parse_args()
+    if args.submissions and not args.bundle:
+        parser.error('--submissions needs --bundle')
+    CONFIG.use_cache = not args.no_cache
+    if args.rebuild and args.stids:
+        for stid in args.stids:
+            remove_outputs(stid)
+    elif args.rebuild and isdir(FEEDBACK_DIR):
         rmtree(FEEDBACK_DIR)
-    os.makedirs(FEEDBACK_DIR)
-    parts = get_parts()
-    write_parts(parts, has_notebook='notebooks' in CONFIG)
-    write_stids(parts)
+    os.makedirs(FEEDBACK_DIR, exist_ok=True)
+    if args.stids:
+        parts = get_parts(stids=args.stids)
+        missing = set(args.stids).difference(parts)
+        if missing:
+            sys.exit('No feedback for ' + ', '.join(sorted(missing)))
+    else:
+        parts = get_parts()
+    if not args.resume and read_journal(FEEDBACK_DIR):
+        print('Rebuilding students from interrupted run; use --resume to '
+              'reuse them', file=sys.stderr)
+    has_notebook = 'notebooks' in CONFIG
+    bundle = (open_bundle(args.bundle, parts, args.submissions, has_notebook)
+              if args.bundle else None)
+    try:
+        built = update_parts(parts, has_notebook=has_notebook,
+                             jobs=args.jobs, batch=args.batch,
+                             prune=not args.stids, retries=args.retries,
+                             resume=args.resume,
+                             on_done=None if bundle is None else bundle.add)
+    except RenderError as err:
+        n_failed = len(err.errors)
+        sys.exit(f'Rendering failed for {n_failed} of {len(parts)} students; '
+                 f'see {pjoin(FEEDBACK_DIR, ERRORS_FNAME)}')
+    finally:
+        if bundle is not None:
+            # Add students that were already up to date.
+            for stid in parts:
+                bundle.add(stid)
+            bundle.close()
+    if not args.stids:
+        write_stids(parts)
+    print(f'Built {len(built)} of {len(parts)} students')
 
 
 if __name__ == '__main__':
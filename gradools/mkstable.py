@@ -4,7 +4,10 @@
 from argparse import ArgumentParser
 
 from .canvastools import to_minimal_df
+from .profiling import phase, profiled
 
+
+@profiled
 def main():
     parser = ArgumentParser()
     parser.add_argument(
@@ -15,4 +18,7 @@ def main():
     if args.output is None:
         from .mconfig import CONFIG
         args.output = args.output if args.output else CONFIG.student_fname
-    to_minimal_df(args.full_gradebook).to_csv(args.output, index=False)
+    with phase('load-gradebook'):
+        df = to_minimal_df(args.full_gradebook)
+    with phase('write-csv'):
+        df.to_csv(args.output, index=False)
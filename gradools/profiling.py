@@ -0,0 +1,208 @@
+""" Optional timing and memory instrumentation for command line tools
+
+Switch on profiling for any ``gdo-*`` command with the ``--profile`` option,
+or by setting the ``GRADOOLS_PROFILE`` environment variable.  ``--profile`` or
+``GRADOOLS_PROFILE=1`` prints a summary per phase to stderr at exit;
+``--profile=trace.json`` or ``GRADOOLS_PROFILE=trace.json`` writes a JSON
+trace to ``trace.json``.
+
+Code marks phases with::
+
+    with phase('parse-log'):
+        ...
+
+When profiling is off, :func:`phase` returns a shared do-nothing context
+manager.
+
+Peak memory for each phase is the peak of memory allocated by Python (and
+by numpy, which reports its arrays to Python), as traced by
+:mod:`tracemalloc`, while the phase ran.  Tracing slows allocations, and so
+inflates wall and CPU times for code that allocates many objects.  Memory
+peaks need Python 3.9 or later.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+
+ENV_VAR = 'GRADOOLS_PROFILE'
+OPTION = '--profile'
+
+_NULL_CONTEXT = nullcontext()
+
+# Current Profiler instance, or None if profiling is off.
+_PROFILER = None
+# True if start_profiling started tracemalloc.
+_STARTED_TRACING = False
+
+
+# tracemalloc.reset_peak is new in Python 3.9.
+_CAN_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+
+def _cpu_time():
+    """ CPU time for this process and its finished subprocesses
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + \
+        times.children_system
+
+
+class Profiler:
+    """ Collect wall time, CPU time and peak memory for named phases
+
+    Phases can nest, and can run at the same time in different threads.
+    There is only one traced peak for the process, so, before resetting it
+    at the start or end of a phase, we fold it into the peaks of all running
+    phases.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        # Peak so far, in bytes, for each running phase.
+        self._peaks = {}
+
+    def _fold_peak(self):
+        """ Fold traced peak into running phases, then reset it
+
+        Call with ``self._lock`` held.
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        for key, value in self._peaks.items():
+            if peak > value:
+                self._peaks[key] = peak
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name):
+        tracing = _CAN_PEAK and tracemalloc.is_tracing()
+        key = object()
+        if tracing:
+            with self._lock:
+                self._fold_peak()
+                self._peaks[key] = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        cpu_start = _cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = _cpu_time() - cpu_start
+            peak_mb = None
+            with self._lock:
+                if tracing:
+                    self._fold_peak()
+                    peak_mb = self._peaks.pop(key) / 2 ** 20
+                self.events.append(OrderedDict(
+                    name=name,
+                    start=start - self._t0,
+                    wall=wall,
+                    cpu=cpu,
+                    peak_mb=peak_mb))
+
+    def summary(self):
+        """ Return dictionary of phase name: totals key: value pairs
+        """
+        phases = OrderedDict()
+        for event in sorted(self.events, key=lambda e: e['start']):
+            totals = phases.setdefault(event['name'], OrderedDict(
+                count=0, wall=0., cpu=0., peak_mb=None))
+            totals['count'] += 1
+            totals['wall'] += event['wall']
+            totals['cpu'] += event['cpu']
+            if event['peak_mb'] is not None:
+                totals['peak_mb'] = max(totals['peak_mb'] or 0,
+                                        event['peak_mb'])
+        return phases
+
+    def format_summary(self):
+        lines = ['{:<20} {:>7} {:>10} {:>10} {:>13}'.format(
+            'Phase', 'Count', 'Wall (s)', 'CPU (s)', 'Peak (MB)')]
+        for name, totals in self.summary().items():
+            peak = totals['peak_mb']
+            lines.append('{:<20} {:>7} {:>10.3f} {:>10.3f} {:>13}'.format(
+                name, totals['count'], totals['wall'], totals['cpu'],
+                '-' if peak is None else f'{peak:.1f}'))
+        return '\n'.join(lines)
+
+    def write_trace(self, fname):
+        with open(fname, 'wt') as fobj:
+            json.dump(dict(argv=sys.argv,
+                           events=self.events,
+                           summary=self.summary()), fobj, indent=1)
+
+
+def phase(name):
+    """ Return context manager recording phase `name` if profiling is on
+    """
+    if _PROFILER is None:
+        return _NULL_CONTEXT
+    return _PROFILER.phase(name)
+
+
+def start_profiling():
+    global _PROFILER, _STARTED_TRACING
+    if _CAN_PEAK and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _STARTED_TRACING = True
+    _PROFILER = Profiler()
+    return _PROFILER
+
+
+def stop_profiling():
+    global _PROFILER, _STARTED_TRACING
+    profiler, _PROFILER = _PROFILER, None
+    if _STARTED_TRACING:  # Leave tracing started by others.
+        tracemalloc.stop()
+        _STARTED_TRACING = False
+    return profiler
+
+
+def _pop_profile_target(argv, environ):
+    """ Return profile output from `argv` or `environ`, remove from `argv`
+
+    Returns None if profiling is off, 'summary' for summary to stderr, or a
+    filename for a JSON trace.
+    """
+    for i, arg in enumerate(argv[1:], 1):
+        if arg == OPTION:
+            del argv[i]
+            return 'summary'
+        if arg.startswith(OPTION + '='):
+            del argv[i]
+            return arg.split('=', 1)[1]
+    value = environ.get(ENV_VAR, '').strip()
+    if value in ('', '0'):
+        return None
+    return 'summary' if value in ('1', 'summary') else value
+
+
+def profiled(func):
+    """ Decorate command line entry point `func` to allow profiling
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        target = _pop_profile_target(sys.argv, os.environ)
+        if target is None:
+            return func(*args, **kwargs)
+        profiler = start_profiling()
+        try:
+            with profiler.phase('total'):
+                return func(*args, **kwargs)
+        finally:
+            stop_profiling()
+            if target == 'summary':
+                print(profiler.format_summary(), file=sys.stderr)
+            else:
+                profiler.write_trace(target)
+
+    return wrapper
@@ -1,29 +1,69 @@
 """ Report marks
 """
-from os.path import exists
+import re
+import sys
+from glob import glob
+from os.path import exists, join as pjoin, basename
 from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, wait
+from argparse import ArgumentParser
 
 import numpy as np
 import pandas as pd
 
 from .mconfig import CONFIG
-from .check import checked_totals
-
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    plt = None
+from .check import checked_matrix, write_ndjson
+from .markstore import (STORE_DIR, stored_years, read_year, read_years,
+                        write_year)
+from .profiling import phase, profiled
 
 
 def get_current(config=CONFIG):
-    totals, msg = checked_totals(config.marking_log)
+    return current_marks(get_matrix(config), config)
+
+
+def get_matrix(config=CONFIG):
+    """ Return score matrix for marking log, raise error for any problems
+    """
+    matrix, msg = checked_matrix(config.log, config)
     if msg:
         raise RuntimeError(f'Check returns message "{msg}"')
+    return matrix
+
+
+def current_marks(matrix, config=CONFIG):
+    """ Return student: mark dictionary, with fudge for year, max of 100
+    """
     fudge = config.get('fudges', {}).get(config.year, 0)
-    processed = totals.copy()
-    for key, value in totals.items():
-        processed[key] = min([value + fudge, 100])
-    return processed
+    marks = np.minimum(matrix.totals + fudge, 100)
+    return OrderedDict(zip(matrix.students, marks.tolist()))
+
+
+def iter_question_records(matrix):
+    """ Iterate over statistics record for each question in `matrix`
+    """
+    stats = matrix.question_stats()
+    for row in zip(*(values.tolist() for values in stats.values())):
+        record = OrderedDict(type='question')
+        for key, value in zip(stats, row):
+            # JSON has no NaN.
+            record[key] = None if value != value else value
+        yield record
+
+
+def report_questions(matrix):
+    """ Print statistics for each question in score matrix `matrix`
+    """
+    stats = matrix.question_stats()
+    print('Questions')
+    print('---------')
+    print('{:<24} {:>7} {:>5} {:>7} {:>7} {:>7} {:>7}'.format(
+        'Question', 'Max', 'n', 'Mean', 'Stdev', 'Min', 'Max'))
+    for row in zip(*stats.values()):
+        print('{:<24} {:>7.2f} {:>5} {:>7.2f} {:>7.2f} {:>7.2f} {:>7.2f}'
+              .format(*row))
+    print()
 
 
 def read_old_totals(fname):
@@ -39,25 +79,131 @@ def read_old_totals(fname):
     return marks
 
 
-def report_year(marks, year):
+def year_summary(marks, year):
+    """ Return dictionary summarizing `marks` for `year`
+    """
     values = list(marks.values())
+    return OrderedDict(
+        type='summary',
+        year=year,
+        n=len(values),
+        mean=float(np.mean(values)),
+        std=float(np.std(values, ddof=1)),
+        failed=[login for login, mark in marks.items() if mark < 50])
+
+
+def report_year(marks, year):
+    summary = year_summary(marks, year)
     print(f'Marks for {year}')
     print(f'---------------')
-    print(f'n: {len(values)}')
-    print(f'Mean: {np.mean(values):0.2f}')
-    print(f'Stdev: {np.std(values, ddof=1):0.2f}')
-    failed = [login for login, mark in marks.items() if mark < 50]
-    if failed:
+    print(f'n: {summary["n"]}')
+    print(f'Mean: {summary["mean"]:0.2f}')
+    print(f'Stdev: {summary["std"]:0.2f}')
+    if summary['failed']:
         print('Failed:')
-        print('\n'.join(failed))
-    plt.hist(values)
-    plt.savefig(f'mark_histogram_{year}.png')
-    plt.close()
+        print('\n'.join(summary['failed']))
     print()
 
 
-def read_totals(year):
-    root = f'marks_{year}'
+def histogram_bins(values, bins=10):
+    """ Return counts, bin edges for histogram of `values`
+    """
+    return np.histogram(np.asarray(values, dtype=float), bins=bins)
+
+
+def render_histogram(counts, edges, fname_root):
+    """ Write histogram with `counts`, bin `edges` to image file
+
+    Writes PNG with Matplotlib if available, otherwise SVG.
+
+    Returns
+    -------
+    fname : str
+        Filename written; `fname_root` with ``.png`` or ``.svg`` extension.
+    """
+    try:
+        # Matplotlib is optional, and slow to import.
+        from matplotlib.figure import Figure
+    except ImportError:
+        return write_svg_histogram(counts, edges, fname_root + '.svg')
+    # Figure without pyplot draws with the Agg backend.
+    fig = Figure()
+    ax = fig.subplots()
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+    fname = fname_root + '.png'
+    fig.savefig(fname)
+    return fname
+
+
+def write_svg_histogram(counts, edges, fname, width=640, height=480):
+    """ Write histogram with `counts`, bin `edges` as SVG file `fname`
+    """
+    margin = 40
+    plot_w, plot_h = width - 2 * margin, height - 2 * margin
+    x_lo, x_hi = edges[0], edges[-1]
+    x_scale = plot_w / (x_hi - x_lo) if x_hi > x_lo else 0
+    y_scale = plot_h / max(counts.max() if len(counts) else 0, 1)
+    lines = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+             f'height="{height}">']
+    for count, left, right in zip(counts, edges[:-1], edges[1:]):
+        bar_h = count * y_scale
+        lines.append(
+            f'<rect x="{margin + (left - x_lo) * x_scale:.2f}" '
+            f'y="{height - margin - bar_h:.2f}" '
+            f'width="{(right - left) * x_scale:.2f}" '
+            f'height="{bar_h:.2f}" fill="steelblue" stroke="white"/>')
+    base = height - margin
+    lines += [
+        f'<line x1="{margin}" y1="{base}" x2="{width - margin}" '
+        f'y2="{base}" stroke="black"/>',
+        f'<text x="{margin}" y="{base + 20}">{x_lo:g}</text>',
+        f'<text x="{width - margin}" y="{base + 20}" '
+        f'text-anchor="end">{x_hi:g}</text>',
+        f'<text x="{margin}" y="{margin - 10}">'
+        f'max count {counts.max() if len(counts) else 0}</text>',
+        '</svg>']
+    with open(fname, 'wt') as fobj:
+        fobj.write('\n'.join(lines) + '\n')
+    return fname
+
+
+def start_plot(plotter, marks, year):
+    """ Start rendering histogram of `marks` for `year` in `plotter`
+
+    Parameters
+    ----------
+    plotter : None or Executor
+        Executor in which to render.  None means do not render.
+    marks : dict
+        Dictionary with login: mark key: value pairs.
+    year : int
+        Year of marks.
+
+    Returns
+    -------
+    future : None or Future
+        Future for filename written, None if `plotter` is None.
+    """
+    if plotter is None:
+        return None
+    with phase('histogram-bins'):
+        counts, edges = histogram_bins(list(marks.values()))
+    return plotter.submit(render_histogram, counts, edges,
+                          f'mark_histogram_{year}')
+
+
+def iter_year_records(marks, year):
+    """ Iterate over record for each student in `marks`, then summary
+    """
+    for login, mark in marks.items():
+        yield OrderedDict(type='mark', year=year, id=login, mark=mark)
+    yield year_summary(marks, year)
+
+
+def read_totals(year, directory='.'):
+    """ Read marks for `year` from old ``marks_<year>.txt|csv`` files
+    """
+    root = pjoin(directory, f'marks_{year}')
     if exists(root + '.txt'):
         return read_old_totals(root + '.txt')
     if not exists(root + '.csv'):
@@ -66,28 +212,301 @@ def read_totals(year):
     return OrderedDict(zip(df['SIS Login ID'], df.iloc[:, -1]))
 
 
+def get_totals(year, store_dir=STORE_DIR):
+    """ Return marks for `year` from marks store, or old marks files
+
+    Returns None if there are no marks for `year`.
+    """
+    marks = read_year(year, store_dir)
+    return read_totals(year) if marks is None else marks
+
+
+OLD_FNAME_FINDER = re.compile(r'^marks_(\d+)\.(txt|csv)$')
+
+
+def import_old_totals(directory='.', store_dir=STORE_DIR):
+    """ Copy marks from old ``marks_<year>.txt|csv`` files into marks store
+
+    Does not replace years already in the store.
+
+    Returns
+    -------
+    years : list
+        Years copied into store.
+    """
+    stored = stored_years(store_dir)
+    years = set()
+    for fname in glob(pjoin(directory, 'marks_*')):
+        match = OLD_FNAME_FINDER.match(basename(fname))
+        if match and int(match.group(1)) not in stored:
+            years.add(match.group(1))
+    for year in sorted(years):
+        write_year(read_totals(year, directory), year, store_dir)
+    return [int(year) for year in sorted(years)]
+
+
+def parse_years(spec):
+    """ Return list of years from `spec` such as ``2015:2026`` or ``2020``
+
+    The range includes both ends.
+    """
+    first, sep, last = spec.partition(':')
+    try:
+        first = int(first)
+        last = int(last) if sep else first
+    except ValueError:
+        raise ValueError(f'Years should be like 2015:2026, not {spec}')
+    return list(range(first, last + 1))
+
+
+def load_years(years, store_dir=STORE_DIR):
+    """ Load logins and marks for `years` from store, or old marks files
+
+    Returns
+    -------
+    columns : dict
+        Dictionary with year: (logins, marks) key: value pairs, for years with
+        marks, in order of `years`.  `logins` and `marks` are arrays.
+    """
+    stored = read_years(years, store_dir)
+    columns = OrderedDict()
+    for year in years:
+        if year in stored:
+            columns[year] = stored[year]
+            continue
+        marks = read_totals(year)
+        if marks is not None:
+            columns[year] = (np.array(list(marks), dtype=str),
+                             np.array(list(marks.values()), dtype=float))
+    return columns
+
+
+def ks_statistic(first, second):
+    """ Two-sample Kolmogorov-Smirnov statistic for arrays `first`, `second`
+
+    The largest difference between the empirical distribution functions.
+    """
+    first, second = np.sort(first), np.sort(second)
+    if len(first) == 0 or len(second) == 0:
+        return np.nan
+    values = np.concatenate([first, second])
+    cdf1 = np.searchsorted(first, values, side='right') / len(first)
+    cdf2 = np.searchsorted(second, values, side='right') / len(second)
+    return np.max(np.abs(cdf1 - cdf2))
+
+
+def multi_year_stats(columns, pass_mark=50):
+    """ Return table of statistics for each year in `columns`
+
+    Parameters
+    ----------
+    columns : dict
+        Dictionary with year: (logins, marks) key: value pairs, as from
+        :func:`load_years`.
+    pass_mark : float, optional
+        Marks below this fail.
+
+    Returns
+    -------
+    stats : DataFrame
+        Table with one row per year.  Columns are number of students,
+        mean, standard deviation, minimum, quartiles, maximum, proportion
+        failing, change in mean and median from the previous year, and
+        Kolmogorov-Smirnov statistic comparing the marks to the previous
+        year.  Statistics are NaN for years without marks.
+    """
+    years = list(columns)
+    marks = [np.asarray(m, dtype=float) for logins, m in columns.values()]
+    df = pd.DataFrame({
+        'year': np.repeat(years, [len(m) for m in marks]).astype(int),
+        'mark': np.concatenate(marks) if marks else np.array([])})
+    df['failed'] = df['mark'] < pass_mark
+    grouped = df.groupby('year')
+    stats = grouped['mark'].agg(['count', 'mean', 'std', 'min'])
+    quartiles = grouped['mark'].quantile([0.25, 0.5, 0.75]).unstack().reindex(
+        columns=[0.25, 0.5, 0.75])
+    stats['q25'], stats['median'], stats['q75'] = (
+        quartiles[0.25], quartiles[0.5], quartiles[0.75])
+    stats['max'] = grouped['mark'].max()
+    stats['fail_rate'] = grouped['failed'].mean()
+    stats = stats.rename(columns={'count': 'n'}).reindex(years)
+    # Years without marks have no group; give n of 0, and NaN statistics.
+    stats['n'] = stats['n'].fillna(0).astype(int)
+    stats['mean_delta'] = stats['mean'].diff()
+    stats['median_delta'] = stats['median'].diff()
+    stats['ks_prev'] = [np.nan] + [ks_statistic(a, b)
+                                   for a, b in zip(marks[:-1], marks[1:])]
+    return stats
+
+
+def report_years(stats):
+    """ Print table of statistics `stats` from :func:`multi_year_stats`
+    """
+    print(stats.to_string(float_format=lambda v: f'{v:0.2f}'))
+
+
+def iter_years_records(stats):
+    """ Iterate over record for each year in `stats`
+    """
+    for year, row in stats.iterrows():
+        record = OrderedDict(type='year-stats', year=int(year))
+        for key, value in row.items():
+            # JSON has no NaN.
+            record[key] = None if value != value else float(value)
+        record['n'] = int(row['n'])
+        yield record
+
+
+# Problems found by merge_marks.
+MERGE_PROBLEMS = {
+    'mismatched': 'Marks differ from log for',
+    'not-in-roster': 'Marked logins not in roster',
+    'unmarked': 'Roster students without marks',
+}
+
+
+def merge_marks(students, marks, assignment):
+    """ Merge `marks` into roster `students`, as new column `assignment`
+
+    Parameters
+    ----------
+    students : DataFrame
+        Roster, with ``SIS Login ID`` column.
+    marks : dict
+        Dictionary with login: mark key: value pairs.
+    assignment : str
+        Name for column containing marks.
+
+    Returns
+    -------
+    marked : DataFrame
+        Copy of `students` with rows for students that have marks, and added
+        `assignment` column giving the marks.
+    problems : dict
+        Dictionary with problem kind: list of logins key: value pairs, for
+        any problems.  Kinds are keys in ``MERGE_PROBLEMS``.
+    """
+    marks = pd.Series(marks, dtype=float)
+    logins = students['SIS Login ID']
+    merged = students.assign(**{assignment: logins.map(marks)})
+    has_mark = merged[assignment].notna()
+    marked = merged[has_mark]
+    # Check every mark made it to the right row.
+    expected = marks.reindex(marked['SIS Login ID']).to_numpy()
+    mismatched = marked['SIS Login ID'][
+        marked[assignment].to_numpy() != expected]
+    candidates = (
+        ('mismatched', mismatched),
+        ('not-in-roster', marks.index[~marks.index.isin(logins)]),
+        ('unmarked', logins[~has_mark]))
+    problems = {kind: [str(login) for login in found]
+                for kind, found in candidates if len(found)}
+    return marked, problems
+
+
+@profiled
 def main(config=CONFIG):
+    parser = ArgumentParser()
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use or update marking log parse cache')
+    parser.add_argument('--format', choices=('text', 'ndjson'),
+                        default='text',
+                        help='Output format; "ndjson" gives one JSON record '
+                        'per line')
+    parser.add_argument('--years',
+                        help='Only print statistics for each year in range '
+                        'such as 2015:2026, from marks store or old marks '
+                        'files')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='Do not write histogram of marks for each year')
+    parser.add_argument('--import-old', action='store_true',
+                        help='Copy marks from marks_<year>.txt and '
+                        'marks_<year>.csv files into marks store, and exit')
+    args = parser.parse_args()
+    if args.import_old:
+        years = import_old_totals()
+        print('Imported ' + (', '.join(str(y) for y in years) if years
+                             else 'nothing'))
+        return
+    ndjson = args.format == 'ndjson'
+    if args.years:
+        try:
+            years = parse_years(args.years)
+        except ValueError as err:
+            parser.error(str(err))
+        with phase('load-years'):
+            columns = load_years(years)
+        if not columns:
+            sys.exit(f'No marks for years {args.years}')
+        stats = multi_year_stats(columns)
+        if ndjson:
+            write_ndjson(iter_years_records(stats))
+        else:
+            report_years(stats)
+        return
+    config.use_cache = not args.no_cache
+    # Render histograms in background processes, while we do the report.
+    with (nullcontext() if args.no_plots else
+          ProcessPoolExecutor(max_workers=2)) as plotter:
+        futures = report_marks(config, ndjson, plotter)
+        with phase('wait-plots'):
+            wait([f for f in futures if f is not None])
+    for future in futures:
+        if future is not None and future.exception() is not None:
+            print(f'Could not render histogram: {future.exception()}',
+                  file=sys.stderr)
+
+
+def report_marks(config=CONFIG, ndjson=False, plotter=None):
+    """ Report marks for this year and last, and write marks for this year
+
+    Parameters
+    ----------
+    config : Config, optional
+        Configuration.
+    ndjson : {False, True}, optional
+        If True, print JSON records rather than text.
+    plotter : None or Executor, optional
+        Executor in which to render histograms.  None means no histograms.
+
+    Returns
+    -------
+    futures : list
+        Futures for histograms, from :func:`start_plot`.
+    """
     year = config.year
     iyear = int(year)
     iym1 = iyear - 1
-    this_year = get_current()
-    report_year(this_year, iyear)
-    last_year = read_totals(str(iym1))
+    matrix = get_matrix(config)
+    this_year = current_marks(matrix, config)
+    futures = [start_plot(plotter, this_year, iyear)]
+    if ndjson:
+        write_ndjson(iter_year_records(this_year, iyear))
+        write_ndjson(iter_question_records(matrix))
+    else:
+        report_year(this_year, iyear)
+        report_questions(matrix)
+    last_year = get_totals(iym1)
     if last_year is None:
-        print(f'No data for {iym1}')
+        if not ndjson:
+            print(f'No data for {iym1}')
     else:
-        report_year(last_year, iym1)
+        futures.append(start_plot(plotter, last_year, iym1))
+        if ndjson:
+            write_ndjson(iter_year_records(last_year, iym1))
+        else:
+            report_year(last_year, iym1)
     students = config.get_students()
-    assignment = config['assignment']
-    students[assignment] = np.nan
-
-    for login, mark in this_year.items():
-        students.at[students['SIS Login ID'] == login, assignment] = mark
-    students = students.dropna()
-
-    # Check
-    for login, mark in this_year.items():
-        row = students[students['SIS Login ID'] == login]
-        assert row[assignment].values == mark
-
-    students.to_csv(config.marks_fname, index=False)
+    students, problems = merge_marks(students, this_year, config['assignment'])
+    for kind, logins in problems.items():
+        if ndjson:
+            write_ndjson([OrderedDict(type='problem', kind=kind,
+                                      ids=logins)])
+        else:
+            print(f'{MERGE_PROBLEMS[kind]}: ' + ', '.join(logins))
+    if set(problems).difference(['unmarked']):
+        raise RuntimeError('Marks do not match roster')
+    with phase('write-csv'):
+        students.to_csv(config.marks_fname, index=False)
+        write_year(this_year, iyear)
+    return futures
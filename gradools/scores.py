@@ -0,0 +1,144 @@
+""" Marks for whole cohort as array of students by questions
+"""
+
+from itertools import chain
+from operator import attrgetter, itemgetter
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ScoreMatrix:
+    """ Marks for all students, as array of students by questions
+
+    Parameters
+    ----------
+    students : sequence
+        Student names, one per row of `values`.
+    questions : sequence
+        Question (score) names, one per column of `values`.
+    values : array
+        Array of marks, shape (len(students), len(questions)).  Missing marks
+        are 0.
+    missing : array
+        Boolean array, same shape as `values`, True where student has no mark
+        for question.
+    stated : array, optional
+        Total stated in log for each student, NaN where log does not give
+        total.  Default is NaN for every student.
+    maxima : array, optional
+        Maximum for each question, NaN if not known.  Default is NaN for
+        every question.
+    totals : array, optional
+        Sum of marks for each student.  Default sums each row of `values`.
+        Pass sums in the order of the marks in the log, to get the same
+        floating point totals as :attr:`Section.marks`.
+    """
+
+    def __init__(self, students, questions, values, missing, stated=None,
+                 maxima=None, totals=None):
+        self.students = list(students)
+        self.questions = list(questions)
+        self.values = np.asarray(values, dtype=float)
+        self.missing = np.asarray(missing, dtype=bool)
+        n_students, n_questions = self.values.shape
+        self.stated = (np.full(n_students, np.nan) if stated is None
+                       else np.asarray(stated, dtype=float))
+        self.maxima = (np.full(n_questions, np.nan) if maxima is None
+                       else np.asarray(maxima, dtype=float))
+        self.totals = (self.values.sum(axis=1) if totals is None
+                       else np.asarray(totals, dtype=float))
+        self._columns = {q: i for i, q in enumerate(self.questions)}
+
+    @classmethod
+    def from_log(cls, log):
+        """ Make matrix from :class:`MarkingLog` `log`
+
+        Questions are in order of ordinary maxima, then extra maxima, then any
+        other scores, in the order they first appear in the log.  There is one
+        row for each section in the log.  Totals add marks in log order, as
+        for checking each section.
+        """
+        questions = list(log.o_scores)
+        questions += [q for q in log.e_scores if q not in log.o_scores]
+        columns = {q: i for i, q in enumerate(questions)}
+        sections = log.sections
+        # Sections have sums and totals from parsing; collect without Python
+        # loops over sections.
+        item_lists = list(map(attrgetter('mark_items'), sections))
+        items = list(chain.from_iterable(item_lists))
+        keys = list(map(itemgetter(0), items))
+        marks = list(map(itemgetter(1), items))
+        # New keys get the next column.
+        for key in dict.fromkeys(keys):
+            columns.setdefault(key, len(columns))
+        cols = list(map(columns.__getitem__, keys))
+        rows = np.repeat(np.arange(len(sections)),
+                         list(map(len, item_lists)))
+        # None converts to NaN.
+        stated = np.array(list(map(attrgetter('stated_total'), sections)),
+                          dtype=float)
+        questions = list(columns)
+        shape = (len(sections), len(questions))
+        values = np.zeros(shape)
+        missing = np.ones(shape, dtype=bool)
+        # For repeated keys in a section, the last value wins, as for
+        # Section.marks.
+        values[rows, cols] = marks
+        missing[rows, cols] = False
+        maxima = dict(log.o_scores, **log.e_scores)
+        # Floating point sums depend on order; use sums in log order.
+        totals = list(map(attrgetter('mark_sum'), sections))
+        return cls(list(map(attrgetter('name'), sections)), questions,
+                   values, missing, stated,
+                   [maxima.get(q, np.nan) for q in questions], totals)
+
+    def columns(self, questions):
+        """ Return column indices for `questions` that are in matrix
+        """
+        return [self._columns[q] for q in questions if q in self._columns]
+
+    def problem_rows(self, required_fields, optional_fields):
+        """ Return indices of students with problems in marks or totals
+
+        Problems are marks for questions not in `required_fields` or
+        `optional_fields`, missing marks for `required_fields`, and stated
+        totals that are missing or do not match the sum of the marks.
+        """
+        expected = np.zeros(len(self.questions), dtype=bool)
+        expected[self.columns(list(required_fields) +
+                              list(optional_fields))] = True
+        bad = (~self.missing[:, ~expected]).any(axis=1)
+        bad |= self.missing[:, self.columns(required_fields)].any(axis=1)
+        if set(required_fields).difference(self.questions):
+            bad[:] = True
+        bad |= ~(self.stated == self.totals)
+        return np.flatnonzero(bad)
+
+    def question_stats(self):
+        """ Return statistics for each question, over students with marks
+
+        Returns
+        -------
+        stats : dict
+            Dictionary with keys ``question``, ``maximum``, ``n``, ``mean``,
+            ``std``, ``min``, ``max``, each an array with one value per
+            question.  Statistics are NaN for questions without marks, and
+            ``std`` is NaN for questions with fewer than two marks.
+        """
+        present = ~self.missing
+        n = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.values.sum(axis=0) / n
+            sq_dev = np.where(present, self.values - mean, 0) ** 2
+            std = np.sqrt(sq_dev.sum(axis=0) / (n - 1))
+        std[n < 2] = np.nan
+        lo = np.where(present, self.values, np.inf).min(axis=0,
+                                                        initial=np.inf)
+        hi = np.where(present, self.values, -np.inf).max(axis=0,
+                                                         initial=-np.inf)
+        lo[n == 0] = np.nan
+        hi[n == 0] = np.nan
+        return OrderedDict(question=np.array(self.questions, dtype=object),
+                           maximum=self.maxima, n=n, mean=mean, std=std,
+                           min=lo, max=hi)
@@ -2,33 +2,100 @@
 """ Generate initial marking scheme, maybe notebook for student
 """
 
+import sys
 from os.path import exists
 from argparse import ArgumentParser
 
-from .mconfig import CONFIG
+from .mconfig import CONFIG, ConfigError
+from .marklog import read_index
+from .profiling import profiled
 
+# Fields to search for student, in order.
+KEY_FIELDS = ('SIS Login ID', 'SIS User ID', 'Student')
 
-def get_init(student_id, config=CONFIG):
-    students = config.get_students()
-    # Try login ID, then User ID, then name
-    for field in ('SIS Login ID', 'SIS User ID', 'Student'):
-        # Coerce to matching dtype
-        try:
-            st_id = students[field].dtype.type(student_id)
-        except ValueError:
-            continue
-        these = students.loc[students[field] == st_id]
-        if len(these) == 1:
-            break
-        elif len(these) > 1:
-            raise RuntimeError(f"More than one match for {student_id}")
-    else:
-        raise RuntimeError(f"Cannot find student {student_id}")
-    name, login = these[['Student', 'SIS Login ID']].iloc[0]
+
+class Roster:
+    """ Look up students in roster by login, user ID or name
+
+    Parameters
+    ----------
+    students : DataFrame
+        Roster, as returned by ``Config.get_students``.
+    """
+
+    def __init__(self, students):
+        self.names = list(students['Student'])
+        self.logins = list(students['SIS Login ID'])
+        self._dtypes = {}
+        self._indexes = {}
+        for field in KEY_FIELDS:
+            column = students[field]
+            self._dtypes[field] = column.dtype.type
+            index = {}
+            for row, value in enumerate(column):
+                index.setdefault(value, []).append(row)
+            self._indexes[field] = index
+
+    def find(self, student_id):
+        """ Return name, login for `student_id`
+
+        Try login ID, then User ID, then name.
+
+        Raises
+        ------
+        RuntimeError
+            If no student, or more than one student, matches `student_id`.
+        """
+        for field in KEY_FIELDS:
+            # Coerce to matching dtype
+            try:
+                st_id = self._dtypes[field](student_id)
+            except ValueError:
+                continue
+            rows = self._indexes[field].get(st_id, [])
+            if len(rows) == 1:
+                break
+            elif len(rows) > 1:
+                raise RuntimeError(f"More than one match for {student_id}")
+        else:
+            raise RuntimeError(f"Cannot find student {student_id}")
+        return self.names[rows[0]], self.logins[rows[0]]
+
+
+def get_init(student_id, config=CONFIG, roster=None):
+    """ Return initial marking log section for `student_id`
+
+    Parameters
+    ----------
+    student_id : str
+        Login, user ID or name of student.
+    config : Config, optional
+        Configuration.
+    roster : None or Roster, optional
+        Roster in which to look up students.  None means build one from
+        `config`.  Pass a roster to avoid loading the students table for
+        each call.
+    """
+    if roster is None:
+        roster = Roster(config.get_students())
+    name, login = roster.find(student_id)
     lines = config.score_lines
     return f'## {login}\n\n{lines}\n\nTotal: \n\n{name}\n\n'
 
 
+def logged_students(config=CONFIG):
+    """ Return set of names of students with sections in marking logs
+
+    Uses the section index for each log, so we do not need to parse the logs.
+    """
+    try:
+        fnames = config.marking_logs
+    except ConfigError:  # No logs yet.
+        return set()
+    return {name for fname in fnames
+            for name in read_index(fname, config.use_cache)['sections']}
+
+
 def write_notebook(login, nb_fname, nb_template):
     with open(nb_template, 'rt') as fobj:
         template = fobj.read()
@@ -37,14 +104,51 @@ def write_notebook(login, nb_fname, nb_template):
         fobj.write(nb)
 
 
+def read_logins(fileish):
+    """ Return logins from file-like or filename, one per line
+    """
+    if not hasattr(fileish, 'read'):
+        with open(fileish, 'rt') as fobj:
+            return read_logins(fobj)
+    return [line.strip() for line in fileish if line.strip()]
+
+
+@profiled
 def main():
     parser = ArgumentParser()
-    parser.add_argument('login', help='login name of submitting student')
+    parser.add_argument('logins', nargs='*',
+                        help='login name(s) of submitting student(s)')
+    parser.add_argument('-f', '--logins-file',
+                        help='File with logins, one per line; "-" for stdin')
     parser.add_argument('--clobber', action='store_true',
                         help='If specified, overwrite existing notebook')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use or update marking log parse cache')
     args = parser.parse_args()
-    nb_fname = args.login + '.Rmd'
+    CONFIG.use_cache = not args.no_cache
+    logins = list(args.logins)
+    if args.logins_file:
+        logins += read_logins(sys.stdin if args.logins_file == '-'
+                              else args.logins_file)
+    if not logins:
+        parser.error('Specify at least one login')
     nb_template = CONFIG.nb_template
-    if nb_template and (not exists(nb_fname) or args.clobber):
-        write_notebook(args.login, nb_fname, nb_template)
-    print(get_init(args.login))
+    roster = Roster(CONFIG.get_students())
+    logged = logged_students(CONFIG)
+    failed = []
+    for login in logins:
+        try:
+            init = get_init(login, CONFIG, roster)
+        except RuntimeError as err:
+            print(err, file=sys.stderr)
+            failed.append(login)
+            continue
+        if roster.find(login)[1] in logged:
+            print(f'Warning: {login} already has a section in the marking '
+                  'log', file=sys.stderr)
+        nb_fname = login + '.Rmd'
+        if nb_template and (not exists(nb_fname) or args.clobber):
+            write_notebook(login, nb_fname, nb_template)
+        print(init)
+    if failed:
+        sys.exit(f'Could not initialize: {", ".join(failed)}')
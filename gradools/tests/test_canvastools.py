@@ -1,13 +1,17 @@
 """ Test canvastools module
 """
 
+import os
 from os.path import join as pjoin, dirname, abspath
 from collections import OrderedDict
+import zipfile
 
 import numpy as np
 import pandas as pd
 
-from gradools.canvastools import to_minimal_df, fname2key, CanvasError
+from gradools.canvastools import (to_minimal_df, fname2key, CanvasError,
+                                  check_unique_stid, index_submissions,
+                                  key2fname, login_keys)
 
 import pytest
 
@@ -64,6 +68,21 @@ def test_to_minimal_df():
     assert np.all(df_3 == pd.DataFrame(data))
     assert df_3.dtypes.equals(pd.Series(
         {'SIS User ID': ndt(object), 'ID': ndt(int), 'Student': ndt(object)}))
+    # Reading from file, possibly in chunks, gives the same results.
+    for chunksize in (None, 1, 2, 10):
+        df = to_minimal_df(csv_path, chunksize=chunksize)
+        assert np.all(df == exp_df)
+        assert df.dtypes.equals(exp_df.dtypes)
+        df_3f = to_minimal_df(csv_path, ('SIS User ID', 'ID', 'Student'),
+                              {'SIS User ID': object, 'ID': np.dtype(int)},
+                              chunksize=chunksize)
+        assert np.all(df_3f == df_3)
+        assert df_3f.dtypes.equals(df_3.dtypes)
+        df_less2f = to_minimal_df(csv_path, ('Section', 'SIS Login ID'),
+                                  chunksize=chunksize)
+        assert np.all(df_less2f == df_less2)
+    with pytest.raises(KeyError):
+        to_minimal_df(csv_path, ('SIS User ID', 'Foo'))
     # field for dtype not in fields - error.
     with pytest.raises(ValueError):
         to_minimal_df(full_df, ('SIS User ID', 'ID', 'Student'),
@@ -101,3 +120,83 @@ def test_fname2key():
     # LATE also allowed.
     fname = 'brettmatthew_LATE_238123_45695381_an_exercise.ipynb'
     assert (fname2key(fname) == ('Brettmatthew', '', '238123'))
+
+
+def test_check_unique_stid():
+    check_unique_stid(['last_first139727_a.Rmd', 'last_first139728_a.Rmd'])
+    with pytest.raises(CanvasError) as excinfo:
+        check_unique_stid(['last_first139727_a.Rmd',
+                           'last_first139727_b.Rmd',
+                           'last_other139728_a.Rmd',
+                           'last_other139728_b.Rmd'])
+    assert len(str(excinfo.value).splitlines()) == 2
+
+
+def test_index_submissions(tmpdir):
+    sub_dir = pjoin(str(tmpdir), 'submissions')
+    os.mkdir(sub_dir)
+    os.mkdir(pjoin(sub_dir, 'a_directory'))
+    names = ['brett_matthew124954_question_815185_4781127_an_exercise.Rmd',
+             'brettmatthew_LATE_238123_45695381_an_exercise.ipynb',
+             'çakajmikey_157269_1832553_other_stuff.Rmd']
+    for name in names:
+        with open(pjoin(sub_dir, name), 'wt') as fobj:
+            fobj.write(name)
+    zip_fname = pjoin(str(tmpdir), 'submissions.zip')
+    with zipfile.ZipFile(zip_fname, 'w') as zf:
+        for name in names:
+            zf.write(pjoin(sub_dir, name), name)
+    for path, root in ((sub_dir, sub_dir), (zip_fname, '')):
+        df = index_submissions(path).sort_values('id_no')
+        assert list(df.columns) == ['family', 'given', 'id_no', 'late',
+                                    'path']
+        assert list(df['id_no']) == ['124954', '157269', '238123']
+        assert list(df['family']) == ['Brett', 'Çakajmikey', 'Brettmatthew']
+        assert list(df['given']) == ['Matthew', '', '']
+        assert list(df['late']) == [False, False, True]
+        assert list(df['path']) == [
+            pjoin(root, n) if root else n for n in
+            (names[0], names[2], names[1])]
+    # All problems reported together.
+    for name in ('brett_matthew124954_another.Rmd', 'rubbish.txt',
+                 'brettmatthew_LATE_238123_again.Rmd', 'more_rubbish.txt'):
+        with open(pjoin(sub_dir, name), 'wt') as fobj:
+            fobj.write(name)
+    with pytest.raises(CanvasError) as excinfo:
+        index_submissions(sub_dir)
+    msg = str(excinfo.value)
+    assert 'rubbish.txt' in msg
+    assert 'more_rubbish.txt' in msg
+    assert 'Student ID 124954' in msg
+    assert 'Student ID 238123' in msg
+    df = index_submissions(sub_dir, check=False)
+    assert len(df) == 5
+
+
+def test_key2fname():
+    for key in (('Brett', 'Matthew', '124954'),
+                ('Brettmatthew', '', '238123'),
+                ('Çakaj', 'Mikey John', '157269'),
+                ('Smith-Jones', 'Ann', '139727')):
+        fname = key2fname(key, 'notes.pdf')
+        assert fname.endswith('_notes.pdf')
+        assert fname2key(fname) == key
+    assert (key2fname(('Brett', 'Matthew', '124954'), 'nb.pdf') ==
+            'brett_matthew124954_nb.pdf')
+
+
+def test_login_keys(tmpdir):
+    sub_dir = str(tmpdir)
+    for name in ('brett_matthew124954_question_815185_an_exercise.Rmd',
+                 'brettmatthew_LATE_238123_45695381_an_exercise.ipynb',
+                 'rubbish.txt'):
+        with open(pjoin(sub_dir, name), 'wt') as fobj:
+            fobj.write(name)
+    students = pd.DataFrame({'SIS Login ID': ['mb312', 'mb1', 'xy999'],
+                             'SIS User ID': [124954, 238123, 111111]})
+    assert login_keys(sub_dir, students) == {
+        'mb312': ('Brett', 'Matthew', '124954'),
+        'mb1': ('Brettmatthew', '', '238123')}
+    students['ID'] = [238123, 0, 0]
+    assert login_keys(sub_dir, students, 'ID') == {
+        'mb312': ('Brettmatthew', '', '238123')}
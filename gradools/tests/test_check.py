@@ -1,7 +1,17 @@
 """ Tests for check module
 """
 
-from gradools.check import get_lists
+import os
+import json
+from io import StringIO
+from os.path import join as pjoin
+
+from gradools import check, marklog
+from gradools.check import (get_lists, iter_updates, check_totals,
+                            checked_totals, iter_records, write_ndjson)
+from gradools.marklog import parse_log, iter_log, MarkingLogError
+
+import pytest
 
 
 def test_get_lists():
@@ -39,3 +49,212 @@ Some text
     assert msg == ("Did not expect key: 'baz' here\n"
                    "Required fields bar, foo not present\n"
                    "Expecting total 13.0 for someone")
+
+
+def test_iter_updates(tmpdir, monkeypatch):
+    monkeypatch.setattr(check.time, 'sleep', lambda interval: None)
+    fname = pjoin(str(tmpdir), 'log.md')
+    contents = """\
+Ordinary maxima:
+
+* foo: 10
+
+## abc001
+
+* foo: 1
+
+Total: 1
+
+## abc002
+
+* foo: 2
+
+Total: 2
+"""
+
+    def write(contents, mtime):
+        with open(fname, 'wt') as fobj:
+            fobj.write(contents)
+        os.utime(fname, ns=(mtime, mtime))
+
+    write(contents, 10)
+    updates = iter_updates([fname])
+    log, error = next(updates)
+    assert error is None
+    assert check_totals(log) == 'abc001     : 1.0\nabc002     : 2.0'
+    # Only the changed section is parsed again.
+    parsed = []
+    monkeypatch.setattr(marklog, '_parse_section',
+                        lambda chunk, *args, parse=marklog._parse_section:
+                        parsed.append(chunk) or parse(chunk, *args))
+    write(contents.replace('foo: 2', 'foo: 3'), 20)
+    log, error = next(updates)
+    assert parsed == [b'## abc002\n\n* foo: 3\n\nTotal: 2\n']
+    assert check_totals(log) == ('Expected 3.0 for abc002, got 2.0\n'
+                                 'abc001     : 1.0\nabc002     : 3.0')
+    # Same as parsing from scratch.
+    fresh = parse_log(fname)
+    assert ([vars(s) for s in fresh.sections] ==
+            [dict(vars(s), source=None) for s in log.sections])
+    write('## abc003\n\n* foo: bar\n', 30)
+    log, error = next(updates)
+    assert log is None
+    assert error.startswith(fname)
+
+
+def test_iter_updates_errors(tmpdir, monkeypatch):
+    monkeypatch.setattr(check.time, 'sleep', lambda interval: None)
+    fnames = [pjoin(str(tmpdir), f'log{i}.md') for i in range(2)]
+
+    def write(fname, contents, mtime):
+        with open(fname, 'wt') as fobj:
+            fobj.write(contents)
+        os.utime(fname, ns=(mtime, mtime))
+
+    write(fnames[0], '## abc001\n\n* foo: 1\n\nTotal: 1\n', 10)
+    write(fnames[1], '## abc002\n\n* foo: 2\n\nTotal: 2\n', 10)
+    updates = iter_updates(fnames)
+    log, error = next(updates)
+    assert [s.name for s in log.sections] == ['abc001', 'abc002']
+    write(fnames[0], '## abc001\n\n* foo: bar\n', 20)
+    log, error = next(updates)
+    assert log is None
+    assert error.startswith(fnames[0])
+    # Shard still failed when another shard changes.
+    write(fnames[1], '## abc002\n\n* foo: 3\n\nTotal: 3\n', 20)
+    log, error = next(updates)
+    assert log is None
+    assert error.startswith(fnames[0])
+    write(fnames[0], '## abc001\n\n* foo: 4\n\nTotal: 4\n', 30)
+    log, error = next(updates)
+    assert error is None
+    assert [s.marks for s in log.sections] == [{'foo': 4.0}, {'foo': 3.0}]
+
+
+def test_section_checks(tmpdir, monkeypatch):
+    monkeypatch.setattr(check.time, 'sleep', lambda interval: None)
+    fname = pjoin(str(tmpdir), 'log.md')
+    contents = """\
+Ordinary maxima:
+
+* foo: 10
+* bar: 5
+
+## abc001
+
+* foo: 1
+* bar: 2
+
+Total: 3
+
+## abc002
+
+* foo: 2
+
+Total: 2
+
+## abc003
+
+Total: 0
+"""
+
+    def write(contents, mtime):
+        with open(fname, 'wt') as fobj:
+            fobj.write(contents)
+        os.utime(fname, ns=(mtime, mtime))
+
+    checked = []
+    monkeypatch.setattr(marklog.Section, 'check',
+                        lambda self, *args, check=marklog.Section.check:
+                        checked.append(self.name) or check(self, *args))
+    checks = check.SectionChecks()
+    write(contents, 10)
+    updates = iter_updates([fname])
+
+    def checks_for_update():
+        log, error = next(updates)
+        expected = check_totals(log)
+        checked[:] = []
+        assert checks.check_totals(log) == expected
+        return list(checked)
+
+    assert checks_for_update() == ['abc001', 'abc002', 'abc003']
+    # Only changed section checked again.
+    write(contents.replace('foo: 2', 'foo: 3'), 20)
+    assert checks_for_update() == ['abc002']
+    # Changed maxima checks everything again.
+    write(contents.replace('bar: 5', 'bar: 6'), 30)
+    assert checks_for_update() == ['abc001', 'abc002', 'abc003']
+
+
+def test_iter_records(tmpdir):
+    fnames = []
+    for name, contents in (
+        ('marker1.md', 'Ordinary maxima:\n\n* foo: 10\n\n'
+         '## abc001\n\n* foo: 1\n\nTotal: 1\n\n## abc002\n\n* bar: 2\n'),
+        ('marker2.md', '## abc003\n\n* foo: 3\n\nTotal: 4\n\nGood.\n')):
+        fnames.append(pjoin(str(tmpdir), name))
+        with open(fnames[-1], 'wt') as fobj:
+            fobj.write(contents)
+    out = StringIO()
+    write_ndjson(iter_records(fnames), out)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert records == [
+        dict(id='abc001', marks={'foo': 1}, stated_total=1, total=1,
+             problems=[]),
+        dict(id='abc002', marks={'bar': 2}, stated_total=None, total=2,
+             problems=["Did not expect key: 'bar' here",
+                       'Required field foo not present',
+                       'Expecting total 2.0 for abc002']),
+        dict(id='abc003', marks={'foo': 3}, stated_total=4, total=3,
+             problems=['Expected 3.0 for abc003, got 4.0'])]
+    # Records come as soon as each section is parsed.
+    fobj = StringIO('## abc001\n* foo: 1\n## abc002\n* foo: 2\n')
+    sections = iter_log(fobj)
+    scores, section = next(sections)
+    assert section.name == 'abc001'
+    assert fobj.readline() == '* foo: 2\n'
+
+
+def test_checked_totals_log_order():
+    log = parse_log(StringIO("""\
+Ordinary maxima:
+
+* a: 1
+* b: 1
+* c: 1
+
+## abc001
+
+* c: 0.3
+* b: 0.2
+* a: 0.1
+
+Total: 0.6
+"""))
+    totals, msg = checked_totals(log)
+    assert msg == ''
+    assert totals == {'abc001': 0.6}
+    assert check_totals(log) == 'abc001     : 0.6'
+
+
+def test_checked_totals_repeated(tmpdir):
+    # Repeated sections in one log are errors, not last-wins.
+    fname = pjoin(str(tmpdir), 'marking_log.md')
+    with open(fname, 'wt') as fobj:
+        fobj.write('Ordinary maxima:\n\n* a: 1\n\n'
+                   '## abc001\n\n* a: 1\n\nTotal: 1\n\n'
+                   '## abc001\n\n* a: 0\n\nTotal: 0\n')
+    with pytest.raises(MarkingLogError, match='abc001 in'):
+        checked_totals(fname)
+
+
+def test_main_watch_options(monkeypatch, capsys):
+    monkeypatch.setenv('GRADOOLS_NO_DAEMON', '1')
+    monkeypatch.setattr(check, 'watch', lambda fnames: None)
+    for opts in (['--student', 'abc001'], ['--format', 'ndjson']):
+        monkeypatch.setattr(check.sys, 'argv',
+                            ['gdo-check', '--watch', 'log.md'] + opts)
+        with pytest.raises(SystemExit):
+            check.main()
+        assert '--watch' in capsys.readouterr().err
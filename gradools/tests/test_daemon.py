@@ -0,0 +1,159 @@
+""" Test daemon module
+"""
+
+import os
+import sys
+import stat
+import time
+import types
+import socket
+from subprocess import check_call
+from threading import Thread
+
+from gradools import daemon
+from gradools.daemon import (should_forward, run_entry, forward, serve, stop,
+                             launcher, DaemonError, SOCKET_FNAME)
+from gradools.mconfig import CONFIG
+
+import pytest
+
+
+def test_should_forward():
+    assert should_forward(['gdo-check'], {})
+    assert should_forward(['gdo-check', 'log.md'], {'GRADOOLS_NO_DAEMON': ''})
+    assert should_forward(['gdo-check'], {'GRADOOLS_NO_DAEMON': '0'})
+    assert not should_forward(['gdo-check'], {'GRADOOLS_NO_DAEMON': '1'})
+    assert not should_forward(['gdo-check', '--watch'], {})
+    assert not should_forward(['gdo-stinit', '-f', '-'], {})
+
+
+def _write_config(year):
+    with open('gdconfig.toml', 'wt') as fobj:
+        fobj.write(f'year = "{year}"\n')
+
+
+def test_run_entry(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    assert run_entry('os:system', ['rm']) == dict(
+        stdout='', stderr='Cannot run os:system\n', code=1)
+    reply = run_entry('gradools.mconfig:print_year', ['gdo-year'])
+    assert reply['code'] == 1
+    assert 'Should be gdconfig.toml' in reply['stderr']
+    _write_config(2020)
+    assert run_entry('gradools.mconfig:print_year', ['gdo-year']) == dict(
+        stdout='2020\n', stderr='', code=0)
+    reply = run_entry('gradools.check:main', ['gdo-check', '--bad-option'])
+    assert reply['code'] == 2
+    assert reply['stderr'].startswith('usage: gdo-check')
+
+
+def subprocess_entry():
+    # Entry point for test_run_entry_state.
+    CONFIG.use_cache = False
+    print('From Python')
+    check_call([sys.executable, '-c', 'print("From subprocess")'])
+    print('Python error', file=sys.stderr)
+
+
+def test_run_entry_state(monkeypatch):
+    entry = 'gradools.tests.test_daemon:subprocess_entry'
+    monkeypatch.setattr(daemon, 'ENTRY_POINTS', daemon.ENTRY_POINTS + (entry,))
+    assert run_entry(entry, ['gdo-test']) == dict(
+        stdout='From Python\nFrom subprocess\n', stderr='Python error\n',
+        code=0)
+    assert CONFIG.use_cache
+
+
+def test_launcher(monkeypatch):
+    imported = []
+
+    def fake_import(name):
+        imported.append(name)
+        return types.SimpleNamespace(main=lambda: 'ran here')
+
+    monkeypatch.setattr(daemon, 'import_module', fake_import)
+    monkeypatch.setattr(daemon, 'forward', lambda entry, argv, environ:
+                        dict(stdout='', stderr='', code=0))
+    monkeypatch.setattr(daemon.sys, 'argv', ['gdo-check'])
+    monkeypatch.delenv('GRADOOLS_NO_DAEMON', raising=False)
+    launch = launcher('gradools.check:main')
+    launch()
+    # Forwarded without importing command module.
+    assert imported == []
+    monkeypatch.setattr(daemon, 'forward', lambda entry, argv, environ: None)
+    assert launch() == 'ran here'
+    assert imported == ['gradools.check']
+
+    # Server took the command, but did not reply; do not run it again.
+    def no_reply(entry, argv, environ):
+        raise DaemonError('Server sent no reply')
+
+    monkeypatch.setattr(daemon, 'forward', no_reply)
+    with pytest.raises(SystemExit) as excinfo:
+        launch()
+    assert 'Server sent no reply' in str(excinfo.value.code)
+    assert imported == ['gradools.check']
+
+
+@pytest.mark.skipif(not hasattr(daemon.socket, 'AF_UNIX'),
+                    reason='Needs Unix sockets')
+def test_forward_no_reply(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with server:
+        server.bind(SOCKET_FNAME)
+        server.listen()
+
+        def hang_up():
+            conn, _ = server.accept()
+            conn.recv(1024)
+            conn.close()
+
+        thread = Thread(target=hang_up)
+        thread.start()
+        with pytest.raises(DaemonError):
+            forward('gradools.mconfig:print_year', ['gdo-year'], {})
+        thread.join()
+
+
+@pytest.mark.skipif(not hasattr(socket, 'SO_PEERCRED'),
+                    reason='Needs SO_PEERCRED')
+def test_peer_uid():
+    left, right = socket.socketpair(socket.AF_UNIX)
+    with left, right:
+        assert daemon._peer_uid(left) == os.getuid()
+
+
+@pytest.mark.skipif(not hasattr(daemon.socket, 'AF_UNIX'),
+                    reason='Needs Unix sockets')
+def test_serve(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    assert forward('gradools.mconfig:print_year', ['gdo-year'], {}) is None
+    assert not stop()
+    _write_config(2020)
+    server = Thread(target=serve)
+    server.start()
+    try:
+        for i in range(100):
+            if os.path.exists(SOCKET_FNAME):
+                break
+            time.sleep(0.05)
+        # Only our user can connect.
+        assert stat.S_IMODE(os.stat(SOCKET_FNAME).st_mode) == 0o600
+        assert forward('gradools.mconfig:print_year', ['gdo-year'],
+                       {}) == dict(stdout='2020\n', stderr='', code=0)
+        # Config read again when changed.
+        _write_config(2021)
+        assert forward('gradools.mconfig:print_year', ['gdo-year'],
+                       {})['stdout'] == '2021\n'
+        # Bad requests get a reply.
+        assert forward('gradools.nosuch:main', ['gdo-year'], {}) == dict(
+            stdout='', stderr='Cannot run gradools.nosuch:main\n', code=1)
+        sock = daemon._connect()
+        assert daemon._request(sock, [1]) == dict(
+            stdout='', stderr='Bad request\n', code=1)
+    finally:
+        assert stop()
+        server.join()
+    assert not os.path.exists(SOCKET_FNAME)
+    assert forward('gradools.mconfig:print_year', ['gdo-year'], {}) is None
@@ -0,0 +1,44 @@
+""" Test command line tools do not import heavy modules they do not need
+"""
+
+import sys
+import json
+from subprocess import check_output
+
+import pytest
+
+# Slow-to-import modules.
+HEAVY = {'pandas', 'numpy', 'matplotlib', 'regex'}
+
+# Module for each command, imported by its launcher in gradools.daemon (see
+# pyproject.toml), and heavy modules it may import at startup.
+ENTRY_BUDGETS = {
+    'gdo-check': ('gradools.check', set()),
+    'gdo-year': ('gradools.mconfig', set()),
+    'gdo-mkstable': ('gradools.mkstable', {'pandas', 'numpy', 'regex'}),
+    'gdo-stinit': ('gradools.stinit', set()),
+    'gdo-mkfb': ('gradools.mkfb', set()),
+    'gdo-report': ('gradools.report', {'pandas', 'numpy'}),
+    'gdo-daemon': ('gradools.daemon', set()),
+}
+
+
+def imported_heavy(module):
+    code = (f'import sys, json; import {module}; '
+            f'heavy = set(sys.modules) & set({sorted(HEAVY)}); '
+            'print(json.dumps(sorted(heavy)))')
+    return set(json.loads(check_output([sys.executable, '-c', code])))
+
+
+@pytest.mark.parametrize('entry_point', sorted(ENTRY_BUDGETS))
+def test_import_budget(entry_point):
+    module, allowed = ENTRY_BUDGETS[entry_point]
+    assert imported_heavy(module).difference(allowed) == set()
+
+
+def test_lazy_submodules():
+    assert imported_heavy('gradools') == set()
+    import gradools
+    assert gradools.mconfig.CONFIG is not None
+    with pytest.raises(AttributeError):
+        gradools.not_a_module
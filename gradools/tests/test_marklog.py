@@ -0,0 +1,295 @@
+""" Test marklog module
+"""
+
+import os
+import json
+import pickle
+from os.path import join as pjoin, dirname, exists
+from io import StringIO, BytesIO
+
+from gradools import marklog
+from gradools.marklog import (parse_log, read_log, read_logs, merge_logs,
+                              cache_fname_for, MarkingLogError, build_index,
+                              read_index, index_fname_for, read_sections,
+                              read_feedback, LogParser)
+from gradools.mkfb import prune_part
+
+import pytest
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+LOG_FNAME = pjoin(DATA_DIR, 'marking_log.md')
+
+# Calls from unpickling Exploit instance.
+EXPLOITED = []
+
+
+def _exploit(arg):
+    EXPLOITED.append(arg)
+
+
+class Exploit:
+
+    def __reduce__(self):
+        return (_exploit, ('unpickled',))
+
+
+def test_parse_log():
+    log = parse_log(LOG_FNAME)
+    o, e = log.scores
+    assert list(o) == ['quality', 'does_task', 'skill_range', 'elegance',
+                       'functions_variables', 'display', 'usable',
+                       'comments_safety']
+    assert sum(o.values()) == 100
+    assert e == {}
+    assert [s.name for s in log.sections] == ['mbr110', 'vrr101']
+    mbr110, vrr101 = log.sections
+    assert mbr110.marks['quality'] == 14
+    assert mbr110.total == 71
+    assert vrr101.total == 55
+    with open(LOG_FNAME, 'rb') as fobj:
+        contents = fobj.read()
+    # Sections cover from heading to start of next heading / end of file.
+    assert contents[mbr110.start:].startswith(b'## mbr110\n')
+    assert mbr110.end == vrr101.start
+    assert vrr101.end == len(contents)
+    # Feedback same as from splitting section text.
+    for section in log.sections:
+        text = contents[section.start:section.end].decode('utf8')
+        assert section.feedback == prune_part(text[3:])
+    assert log.feedback_parts() == {
+        'mbr110': mbr110.feedback, 'vrr101': vrr101.feedback}
+    lists, msg = log.check()
+    assert list(lists) == ['mbr110', 'vrr101']
+    assert msg == 'Expected 31.0 for vrr101, got 55.0'
+    # File objects, text and binary.
+    for fobj in (StringIO(contents.decode('utf8')), BytesIO(contents)):
+        log2 = parse_log(fobj)
+        assert log2.scores == log.scores
+        assert [(s.start, s.end) for s in log2.sections] == [
+            (s.start, s.end) for s in log.sections]
+
+
+def test_section_boundaries():
+    # Heading always starts new section, even when total missing.
+    log = parse_log(StringIO("""\
+## abc123
+* foo: 1
+## def456
+
+* foo: 2
+
+total:
+
+Some feedback
+"""))
+    assert [s.name for s in log.sections] == ['abc123', 'def456']
+    lists, msg = log.check(['foo'], [])
+    assert lists == {'abc123': {'foo': 1}, 'def456': {'foo': 2}}
+    assert msg == ('Expecting total 1.0 for abc123\n'
+                   'Expected 2.0 for def456, got 0.0')
+    # Feedback needs numeric total.
+    assert log.feedback_parts() == {'abc123': '', 'def456': ''}
+    for bad in ('* foo: bar', '* foo', '* foo: 1: 2'):
+        with pytest.raises(ValueError):
+            parse_log(StringIO(f'## abc123\n\n{bad}\n'))
+    # Windows line endings, blank lines with spaces, and no final newline;
+    # the same parsing the file in one go, and line by line.
+    contents = (b'## abc123\r\n  \r\n* foo : 1\r\n*  bar: 2 \r\n'
+                b'\r\nTotal: 3\r\n\r\nGood.')
+    log = parse_log(BytesIO(contents))
+    section, = log.sections
+    assert section.mark_items == [('foo', 1), ('bar', 2)]
+    assert section.total_line == 'Total: 3'
+    assert section.feedback_lines == ['', 'Good.']
+    assert (section.start, section.end) == (0, len(contents))
+    parser = LogParser()
+    for line in BytesIO(contents):
+        parser.feed(line)
+    assert [vars(s) for s in parser.close().sections] == [vars(section)]
+
+
+def test_read_log(tmpdir, monkeypatch):
+    log_fname = pjoin(str(tmpdir), 'log.md')
+    with open(LOG_FNAME, 'rt') as fobj:
+        contents = fobj.read()
+    with open(log_fname, 'wt') as fobj:
+        fobj.write(contents)
+    cache_fname = cache_fname_for(log_fname)
+    assert cache_fname == pjoin(str(tmpdir), '.log.md.gdcache')
+    assert not exists(cache_fname)
+    log = read_log(log_fname)
+    assert exists(cache_fname)
+    assert log.lists == parse_log(LOG_FNAME).lists
+    # Make file look old, so cache trusts modification time.
+    os.utime(log_fname, ns=(0, 0))
+    parsed = []
+    monkeypatch.setattr(marklog, 'parse_log',
+                        lambda f: parsed.append(f) or parse_log(f))
+    log2 = read_log(log_fname)
+    assert parsed == []
+    assert [vars(s) for s in log2.sections] == [
+        vars(s) for s in log.sections]
+    # Cache does not store feedback, so read_log never gives feedback.
+    for section in log.sections + log2.sections:
+        assert section.feedback_lines is None
+        with pytest.raises(MarkingLogError):
+            section.feedback
+    assert (read_feedback([log_fname]) ==
+            parse_log(log_fname).feedback_parts())
+    assert log2.scores == log.scores
+    # Cache used from modification time and size alone.
+    read_log(log_fname)
+    assert parsed == []
+    # Changed contents.
+    new_contents = contents.replace('quality: 14.0', 'quality: 15.0')
+    with open(log_fname, 'wt') as fobj:
+        fobj.write(new_contents)
+    assert read_log(log_fname).lists['mbr110']['quality'] == 15
+    assert len(parsed) == 1
+    # Touched only; hash the same.
+    os.utime(log_fname)
+    read_log(log_fname)
+    assert len(parsed) == 1
+    # Can switch off the cache.
+    read_log(log_fname, use_cache=False)
+    assert len(parsed) == 2
+    # Corrupt cache ignored.
+    with open(cache_fname, 'wb') as fobj:
+        fobj.write(b'rubbish')
+    assert read_log(log_fname).lists['mbr110']['quality'] == 15
+    assert len(parsed) == 3
+    # Cache is not a pickle; loading it cannot run code.
+    with open(cache_fname, 'wb') as fobj:
+        pickle.dump(Exploit(), fobj)
+    assert read_log(log_fname).lists['mbr110']['quality'] == 15
+    assert EXPLOITED == []
+    assert len(parsed) == 4
+    with open(cache_fname, 'rt') as fobj:
+        assert json.load(fobj)['data']['names'][0] == 'mbr110'
+
+
+def _write_shards(path):
+    header = 'Ordinary maxima:\n\n* foo: 10\n\nTotal: 10\n\n'
+    shards = {'marker1.md': header + '## abc001\n\n* foo: 1\n\nTotal: 1\n',
+              'marker2.md': '## abc002\n\n* foo: 2\n\nTotal: 2\n',
+              'marker3.md': header + '## abc003\n\n* foo: 3\n\nTotal: 3\n'}
+    fnames = []
+    for name, contents in shards.items():
+        fnames.append(pjoin(path, name))
+        with open(fnames[-1], 'wt') as fobj:
+            fobj.write(contents)
+    return fnames
+
+
+def test_read_logs(tmpdir):
+    fnames = _write_shards(str(tmpdir))
+    for use_cache in (False, True, True):
+        for jobs in (1, 2):
+            log = read_logs(fnames, use_cache, jobs)
+            assert log.scores == ({'foo': 10}, {})
+            assert [s.name for s in log.sections] == [
+                'abc001', 'abc002', 'abc003']
+            assert [s.source for s in log.sections] == fnames
+            assert log.check()[1] == ''
+    assert read_logs(fnames[:1]).lists == {'abc001': {'foo': 1}}
+    # Student in two shards.
+    with open(fnames[1], 'at') as fobj:
+        fobj.write('\n## abc001\n\n* foo: 1\n\nTotal: 1\n')
+    with pytest.raises(MarkingLogError) as excinfo:
+        read_logs(fnames)
+    assert 'abc001 in {}, {}'.format(*fnames[:2]) in str(excinfo.value)
+    # Student with two sections in one shard.
+    with open(fnames[0], 'at') as fobj:
+        fobj.write('\n## abc001\n\n* foo: 2\n\nTotal: 2\n')
+    for logs in (fnames[:1], fnames[::2]):
+        with pytest.raises(MarkingLogError) as excinfo:
+            read_logs(logs)
+        assert str(excinfo.value) == (
+            'Students with more than one section in a log:\n'
+            f'abc001 in {fnames[0]}')
+    # Different maxima.
+    with open(fnames[2], 'wt') as fobj:
+        fobj.write('Ordinary maxima:\n\n* bar: 10\n\n')
+    with pytest.raises(MarkingLogError):
+        merge_logs([read_log(fnames[0]), read_log(fnames[2])])
+
+
+def test_read_index(tmpdir, monkeypatch):
+    assert build_index(b'') == dict(preamble=(0, 0), sections={},
+                                    repeated={})
+    log_fname = pjoin(str(tmpdir), 'log.md')
+    with open(LOG_FNAME, 'rb') as fobj:
+        contents = fobj.read()
+    with open(log_fname, 'wb') as fobj:
+        fobj.write(contents)
+    log = parse_log(LOG_FNAME)
+    index = read_index(log_fname)
+    assert index == build_index(contents)
+    assert index['preamble'] == (0, log.sections[0].start)
+    assert index['sections'] == {s.name: (s.start, s.end)
+                                 for s in log.sections}
+    assert exists(index_fname_for(log_fname))
+    # Saved index used for unchanged file.
+    os.utime(log_fname, ns=(0, 0))
+    read_index(log_fname)
+    monkeypatch.setattr(marklog, 'build_index', None)
+    assert read_index(log_fname) == index
+    with pytest.raises(TypeError):
+        read_index(log_fname, use_cache=False)
+    monkeypatch.undo()
+    # Changed file.
+    with open(log_fname, 'ab') as fobj:
+        fobj.write(b'\n## abc001\n\n* quality: 1\n')
+    assert list(read_index(log_fname)['sections']) == [
+        'mbr110', 'vrr101', 'abc001']
+
+
+def test_read_sections(tmpdir):
+    log = parse_log(LOG_FNAME)
+    log_fname = pjoin(str(tmpdir), 'log.md')
+    with open(LOG_FNAME, 'rb') as fobj:
+        contents = fobj.read()
+    with open(log_fname, 'wb') as fobj:
+        fobj.write(contents)
+    for use_cache in (False, True, True):
+        part = read_sections([log_fname], ['vrr101', 'nobody'], use_cache)
+        assert part.scores == log.scores
+        section, = part.sections
+        assert vars(section) == dict(vars(log.sections[1]),
+                                     source=log_fname)
+    fnames = _write_shards(str(tmpdir))
+    log = read_sections(fnames, ['abc003', 'abc002'])
+    assert log.scores == ({'foo': 10}, {})
+    assert log.lists == {'abc002': {'foo': 2}, 'abc003': {'foo': 3}}
+    assert [s.source for s in log.sections] == fnames[1:]
+    # Student with more than one section.
+    with open(fnames[1], 'at') as fobj:
+        fobj.write('\n## abc004\n\n* foo: 4\n\nTotal: 4\n'
+                   '\n## abc002\n\n* foo: 5\n\nTotal: 5\n')
+    index = read_index(fnames[1])
+    first, last = index['repeated']['abc002']
+    assert index['sections']['abc002'] == last
+    assert list(index['repeated']) == ['abc002']
+    assert read_sections(fnames, ['abc004']).lists == {'abc004': {'foo': 4}}
+    with pytest.raises(MarkingLogError) as excinfo:
+        read_sections(fnames, ['abc002'])
+    assert str(excinfo.value) == (
+        'Students with more than one section in a log:\n'
+        f'abc002 in {fnames[1]}')
+    with pytest.raises(MarkingLogError):
+        read_feedback(fnames)
+    assert read_feedback(fnames, ['abc004', 'abc001']) == {'abc001': '',
+                                                           'abc004': ''}
+
+
+def test_read_feedback(tmpdir):
+    log_fname = pjoin(str(tmpdir), 'log.md')
+    with open(LOG_FNAME, 'rb') as fobj:
+        contents = fobj.read()
+    with open(log_fname, 'wb') as fobj:
+        fobj.write(contents)
+    parts = parse_log(LOG_FNAME).feedback_parts()
+    for use_cache in (False, True, True):
+        assert read_feedback([log_fname], use_cache=use_cache) == parts
+        assert (read_feedback([log_fname], ['vrr101', 'nobody'], use_cache)
+                == {'vrr101': parts['vrr101']})
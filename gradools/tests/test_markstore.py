@@ -0,0 +1,34 @@
+""" Test markstore module
+"""
+
+from os.path import join as pjoin, exists
+from collections import OrderedDict
+
+from gradools.markstore import (write_year, read_years, read_year,
+                                stored_years, partition_fname)
+
+from numpy.testing import assert_array_equal
+
+
+def test_store(tmpdir):
+    store_dir = pjoin(str(tmpdir), 'store')
+    assert stored_years(store_dir) == []
+    assert read_years(None, store_dir) == {}
+    assert read_year(2019, store_dir) is None
+    marks_2019 = OrderedDict([('mb312', 72.5), ('vr101', 40)])
+    marks_2020 = OrderedDict([('ab123', 61.0)])
+    write_year(marks_2020, '2020', store_dir)
+    write_year(marks_2019, 2019, store_dir)
+    assert exists(partition_fname(2019, store_dir))
+    assert stored_years(store_dir) == [2019, 2020]
+    columns = read_years([2020, 2018, '2019'], store_dir)
+    assert list(columns) == [2020, 2019]
+    logins, marks = columns[2019]
+    assert_array_equal(logins, ['mb312', 'vr101'])
+    assert_array_equal(marks, [72.5, 40])
+    assert list(read_years(None, store_dir)) == [2019, 2020]
+    assert read_year(2019, store_dir) == marks_2019
+    # Writing replaces year.
+    write_year(marks_2020, 2019, store_dir)
+    assert read_year('2019', store_dir) == marks_2020
+    assert stored_years(store_dir) == [2019, 2020]
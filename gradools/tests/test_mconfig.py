@@ -1,10 +1,14 @@
 """ Test mconfig module
 """
 
+import os
 from collections import OrderedDict
 from io import StringIO
 
-from gradools.mconfig import get_scores, get_score_lines
+from gradools import mconfig
+from gradools.mconfig import get_scores, get_score_lines, Config, ConfigError
+
+import pytest
 
 
 def test_get_scores():
@@ -75,3 +79,87 @@ Total:
     assert (get_score_lines(o, e) ==
             '* score_1: 1.0\n* another_score: 2.0\n\n'
             '* score_10: 2.5\n* extra_score: 5.0\n')
+
+
+def _write(fname, contents, mtime_ns):
+    with open(fname, 'wt') as fobj:
+        fobj.write(contents)
+    os.utime(fname, ns=(mtime_ns, mtime_ns))
+
+
+def test_config_cache(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    _write('gdconfig.toml', 'year = "2018"\n', 10)
+    _write('marking_log.md', 'Ordinary maxima:\n\n* foo: 10\n', 10)
+    _write('students_2018.csv', 'Student,SIS Login ID\nMatthew,mb312\n', 10)
+    config = Config()
+    loaded = []
+    for name in ('_read_config', 'read_sections'):
+        obj = Config if name == '_read_config' else mconfig
+        orig = getattr(obj, name)
+
+        def wrapper(*args, _name=name, _orig=orig):
+            loaded.append(_name)
+            return _orig(*args)
+
+        monkeypatch.setattr(obj, name, wrapper)
+    assert config.year == '2018'
+    assert config.scores == ({'foo': 10}, {})
+    assert config.score_lines == '* foo: 10.0\n'
+    students = config.get_students()
+    assert list(students['SIS Login ID']) == ['mb312']
+    students['SIS Login ID'] = 'changed'
+    assert list(config.get_students()['SIS Login ID']) == ['mb312']
+    assert config.scores == ({'foo': 10}, {})
+    assert config.score_lines == '* foo: 10.0\n'
+    assert loaded == ['_read_config', 'read_sections']
+    # Changes to files picked up.
+    _write('gdconfig.toml', 'year = "2019"\n', 20)
+    _write('students_2019.csv', 'Student,SIS Login ID\nMartin,mb110\n', 10)
+    _write('marking_log.md', 'Ordinary maxima:\n\n* bar: 10\n', 20)
+    assert config.year == '2019'
+    assert list(config.get_students()['SIS Login ID']) == ['mb110']
+    assert config.score_lines == '* bar: 10.0\n'
+    assert loaded == ['_read_config', 'read_sections'] * 2
+    config.reload()
+    assert config.score_lines == '* bar: 10.0\n'
+    assert loaded == ['_read_config', 'read_sections'] * 3
+
+
+
+def test_config_scores_preamble(tmpdir, monkeypatch):
+    # Maxima come from the preamble; half-edited sections do not matter.
+    monkeypatch.chdir(tmpdir)
+    _write('gdconfig.toml', 'year = "2018"\n', 10)
+    _write('marking_log.md',
+           'Ordinary maxima:\n\n* foo: 10\n\nTotal: 10\n\n'
+           '## abc123\n\n* foo: \n\nTotal: \n', 10)
+    config = Config()
+    assert config.scores == ({'foo': 10}, {})
+    assert config.score_lines == '* foo: 10.0\n'
+    fobj = StringIO('Ordinary maxima:\n* foo: 10\n\n## abc123\n* foo: \n')
+    assert get_scores(fobj) == ({'foo': 10}, {})
+
+def test_marking_logs(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    os.mkdir('logs')
+    for name in ('b.md', 'a.md'):
+        _write(os.path.join('logs', name), f'## {name[0]}xx001\n', 10)
+    _write('other.md', 'Ordinary maxima:\n\n* foo: 10\n', 10)
+    _write('gdconfig.toml', 'year = "2018"\nlog = "logs/*.md"\n', 10)
+    config = Config()
+    a_md, b_md = os.path.join('logs', 'a.md'), os.path.join('logs', 'b.md')
+    assert config.marking_logs == [a_md, b_md]
+    with pytest.raises(ConfigError):
+        config.marking_log
+    assert list(config.log.lists) == ['axx001', 'bxx001']
+    _write('gdconfig.toml',
+           'year = "2018"\nlog = ["other.md", "logs/b*.md"]\n', 20)
+    assert config.marking_logs == ['other.md', b_md]
+    assert list(config.log.lists) == ['bxx001']
+    assert config.scores == ({'foo': 10}, {})
+    _write('gdconfig.toml', 'year = "2018"\nlog = "other.md"\n', 30)
+    assert config.marking_log == 'other.md'
+    _write('gdconfig.toml', 'year = "2018"\nlog = "missing/*.md"\n', 40)
+    with pytest.raises(ConfigError):
+        config.marking_logs
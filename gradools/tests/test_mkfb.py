@@ -0,0 +1,450 @@
+""" Test mkfb module
+"""
+
+import os
+import sys
+import csv
+import time
+import signal
+import threading
+import types
+import zipfile
+from tempfile import TemporaryDirectory
+from os.path import join as pjoin, exists
+
+from gradools import mkfb
+from gradools.mkfb import (prune_part, write_parts, update_parts,
+                           read_manifest, RenderError, batch_markdown,
+                           mark_pages, read_journal, Journal, Bundle)
+from gradools.canvastools import fname2key
+
+import pytest
+
+
+def test_prune_part():
+    assert prune_part('') == ''
+    assert prune_part("""\
+mb312
+
+* foo: 1
+
+Total: 1
+
+Matthew Brett
+
+Good work.
+""") == '\nMatthew Brett\n\nGood work.'
+
+
+def test_write_parts(monkeypatch):
+    parts = {f'abc{i:03d}': f'Text {i}' for i in range(20)}
+    written = []
+
+    def fake_write_part(stid, text, out_dir, has_notebook, cwd=None,
+                        in_process=True):
+        if stid in ('abc003', 'abc011'):
+            raise ValueError(f'{stid} is broken')
+        written.append((stid, text, out_dir, has_notebook))
+
+    monkeypatch.setattr(mkfb, 'write_part', fake_write_part)
+    for jobs in (1, 4, None):
+        written[:] = []
+        with pytest.raises(RuntimeError) as excinfo:
+            write_parts(parts, 'out', True, jobs=jobs)
+        assert str(excinfo.value) == ('Rendering failed for:\n'
+                                      'abc003: abc003 is broken\n'
+                                      'abc011: abc011 is broken')
+        assert (sorted(written) ==
+                [(stid, text, 'out', True) for stid, text in parts.items()
+                 if stid not in ('abc003', 'abc011')])
+
+
+def test_batch_markdown():
+    parts = {'abc001': 'One', 'abc002': '', 'abc003': '* Three'}
+    markdown = batch_markdown(parts)
+    assert markdown == ('GDOSPLITMARK0\n\nOne\n\nGDOSPLITMARK1\n\n\n\n'
+                        'GDOSPLITMARK2\n\n* Three\n\nGDOSPLITMARK3\n')
+    # As pandoc would give.
+    latex = markdown.replace('* Three', '\\begin{itemize}\n\\item\n  Three'
+                             '\n\\end{itemize}')
+    marked = mark_pages(latex, 3)
+    assert 'GDOSPLITMARK' not in marked
+    assert marked.count(r'\write\gdopages{\thepage}') == 3
+    assert marked.count(r'\clearpage') == 3
+    assert marked.startswith('\\clearpage')
+    assert marked.endswith('\\write\\gdopages{\\thepage}\n')
+    # Unclosed code block in feedback swallows marks.
+    with pytest.raises(ValueError):
+        mark_pages(latex.replace('GDOSPLITMARK2\n', ''), 3)
+
+
+def test_write_parts_batch(monkeypatch):
+    parts = {'abc001': 'One', 'abc002': 'Two'}
+    calls = []
+
+    def fake_batch(parts, out_dir):
+        calls.append(('batch', list(parts)))
+        if 'broken' in parts['abc002']:
+            raise ValueError('Cannot find all student boundaries')
+
+    monkeypatch.setattr(mkfb, 'write_notes_batch', fake_batch)
+    monkeypatch.setattr(mkfb, '_get_pypdf', lambda: mkfb)
+    monkeypatch.setattr(mkfb, 'write_part', lambda stid, *args:
+                        calls.append(('part', stid)))
+    monkeypatch.setattr(mkfb, 'write_notebook',
+                        lambda stid, out_dir, cwd, in_process:
+                        calls.append(('nb', stid)))
+    write_parts(parts, 'out', batch=True)
+    assert calls == [('batch', ['abc001', 'abc002'])]
+    calls[:] = []
+    write_parts(parts, 'out', has_notebook=True, batch=True)
+    assert calls[0] == ('batch', ['abc001', 'abc002'])
+    assert sorted(calls[1:]) == [('nb', 'abc001'), ('nb', 'abc002')]
+    # Failed batch falls back to building each student.
+    calls[:] = []
+    parts['abc002'] = 'Two broken'
+    write_parts(parts, 'out', batch=True)
+    assert sorted(calls[1:]) == [('part', 'abc001'), ('part', 'abc002')]
+    # As does missing pypdf.
+    calls[:] = []
+    monkeypatch.setattr(mkfb, '_get_pypdf', lambda: None)
+    write_parts(parts, 'out', batch=True)
+    assert sorted(calls) == [('part', 'abc001'), ('part', 'abc002')]
+
+
+def test_write_notebook(tmpdir, monkeypatch):
+    exporters = []
+
+    class FakeExporter:
+
+        def __init__(self):
+            exporters.append(self)
+
+        def from_filename(self, fname):
+            return fname.encode('utf8'), {}
+
+    monkeypatch.setitem(sys.modules, 'nbconvert',
+                        types.SimpleNamespace(PDFExporter=FakeExporter))
+    monkeypatch.setattr(mkfb, '_EXPORTER', {})
+    out_dir = str(tmpdir)
+    for stid in ('abc001', 'abc002'):
+        mkfb.write_notebook(stid, out_dir)
+        with open(pjoin(out_dir, stid + '_nb.pdf'), 'rb') as fobj:
+            assert fobj.read() == pjoin(os.getcwd(),
+                                        stid + '.ipynb').encode('utf8')
+    # One exporter, reused.
+    assert len(exporters) == 1
+    # Not in process; run jupyter nbconvert.
+    calls = []
+    monkeypatch.setattr(mkfb, 'check_call',
+                        lambda cmd, cwd: calls.append((cmd, cwd)))
+    mkfb.write_notebook('abc003', out_dir, out_dir, in_process=False)
+    assert calls == [(['jupyter', 'nbconvert', pjoin(out_dir, 'abc003.ipynb'),
+                       '--to', 'pdf', '--output',
+                       pjoin(out_dir, 'abc003_nb')], out_dir)]
+    assert len(exporters) == 1
+    # Without nbconvert, fall back to running jupyter nbconvert.
+    calls[:] = []
+    monkeypatch.setitem(sys.modules, 'nbconvert', None)
+    monkeypatch.setattr(mkfb, '_EXPORTER', {})
+    mkfb.write_notebook('abc004', out_dir, out_dir)
+    assert calls == [(['jupyter', 'nbconvert', pjoin(out_dir, 'abc004.ipynb'),
+                       '--to', 'pdf', '--output',
+                       pjoin(out_dir, 'abc004_nb')], out_dir)]
+    # Version of nbconvert in this environment goes in tool signature.
+    monkeypatch.setitem(sys.modules, 'nbconvert',
+                        types.SimpleNamespace(__version__='7.1'))
+    assert mkfb.tool_signature(True).endswith('\nnbconvert 7.1')
+
+
+def test_notebooks_threaded(tmpdir, monkeypatch):
+    # nbconvert changes working directory while exporting, so only export in
+    # process for one job; otherwise run jupyter nbconvert.
+    exported = []
+
+    class ChdirExporter:
+
+        def from_filename(self, fname):
+            exported.append(fname)
+            with TemporaryDirectory() as tmp:
+                old_dir = os.getcwd()
+                os.chdir(tmp)
+                try:
+                    time.sleep(0.01)
+                    with open(fname, 'rb') as fobj:
+                        return fobj.read(), {}
+                finally:
+                    os.chdir(old_dir)
+
+    class FakePopen:
+
+        def __init__(self, cmd, stdin, stderr, cwd):
+            self.out_fname = pjoin(cwd, cmd[-1])
+            self.returncode = 0
+
+        def communicate(self, text):
+            time.sleep(0.01)
+            with open(self.out_fname, 'wb') as fobj:
+                fobj.write(text)
+            return b'', b''
+
+    def fake_check_call(cmd, cwd):
+        # As for jupyter nbconvert.
+        with open(cmd[2], 'rb') as fobj:
+            contents = fobj.read()
+        with open(cmd[-1] + '.pdf', 'wb') as fobj:
+            fobj.write(contents)
+
+    monkeypatch.setitem(sys.modules, 'nbconvert',
+                        types.SimpleNamespace(PDFExporter=ChdirExporter))
+    monkeypatch.setattr(mkfb, '_EXPORTER', {})
+    monkeypatch.setattr(mkfb, 'Popen', FakePopen)
+    monkeypatch.setattr(mkfb, 'check_call', fake_check_call)
+    monkeypatch.chdir(tmpdir)
+    os.mkdir('feedback')
+    parts = {f'abc{i:03d}': f'Text {i}' for i in range(16)}
+    for stid in parts:
+        with open(stid + '.ipynb', 'wt') as fobj:
+            fobj.write(f'Notebook {stid}')
+    for jobs in (8, 1):
+        done = []
+        write_parts(parts, 'feedback', has_notebook=True, jobs=jobs,
+                    on_done=done.append)
+        assert sorted(done) == sorted(parts)
+        for stid, text in parts.items():
+            with open(pjoin('feedback', stid + '_notes.pdf'), 'rt') as fobj:
+                assert fobj.read() == text
+            with open(pjoin('feedback', stid + '_nb.pdf'), 'rt') as fobj:
+                assert fobj.read() == f'Notebook {stid}'
+        assert os.getcwd() == str(tmpdir)
+        assert len(exported) == (0 if jobs > 1 else len(parts))
+
+
+def test_update_parts(tmpdir, monkeypatch):
+    out_dir = str(tmpdir)
+    built = []
+
+    def fake_write_part(stid, text, out_dir, has_notebook, cwd=None,
+                        in_process=True):
+        if 'broken' in text:
+            raise ValueError(f'{stid} is broken')
+        built.append(stid)
+        for fname in mkfb.out_fnames(stid, out_dir, has_notebook):
+            with open(fname, 'wt') as fobj:
+                fobj.write(text)
+
+    monkeypatch.setattr(mkfb, 'write_part', fake_write_part)
+    monkeypatch.setattr(mkfb, 'tool_signature', lambda has_nb: 'tools')
+    parts = {'abc001': 'One', 'abc002': 'Two', 'abc003': 'Three'}
+    assert sorted(update_parts(parts, out_dir)) == sorted(parts)
+    assert sorted(built) == sorted(parts)
+    # Nothing changed, nothing to build.
+    built[:] = []
+    assert update_parts(parts, out_dir) == []
+    assert built == []
+    # Changed, missing and removed students.
+    parts = {'abc001': 'One', 'abc002': 'Two changed', 'abc004': 'Four'}
+    os.unlink(pjoin(out_dir, 'abc001_notes.pdf'))
+    assert sorted(update_parts(parts, out_dir)) == [
+        'abc001', 'abc002', 'abc004']
+    assert not exists(pjoin(out_dir, 'abc003_notes.pdf'))
+    assert sorted(read_manifest(out_dir)) == ['abc001', 'abc002', 'abc004']
+    # Failures not recorded in manifest, so they build next time.
+    parts['abc002'] = 'Two broken'
+    parts['abc004'] = 'Four changed'
+    with pytest.raises(RenderError):
+        update_parts(parts, out_dir)
+    assert sorted(read_manifest(out_dir)) == ['abc001', 'abc004']
+    assert not exists(pjoin(out_dir, 'abc002_notes.pdf'))
+    parts['abc002'] = 'Two fixed'
+    built[:] = []
+    assert update_parts(parts, out_dir) == ['abc002']
+    # Building some students leaves the others.
+    assert update_parts({'abc002': 'Two again'}, out_dir,
+                        prune=False) == ['abc002']
+    assert sorted(read_manifest(out_dir)) == ['abc001', 'abc002', 'abc004']
+    assert exists(pjoin(out_dir, 'abc001_notes.pdf'))
+    # Tool change rebuilds all.
+    monkeypatch.setattr(mkfb, 'tool_signature', lambda has_nb: 'new tools')
+    assert sorted(update_parts(parts, out_dir)) == sorted(parts)
+
+
+def test_write_part_errors(tmpdir, monkeypatch):
+
+    class FakePopen:
+
+        def __init__(self, cmd, stdin, stderr, cwd):
+            pass
+
+        def communicate(self, text):
+            self.returncode = 1 if b'broken' in text else 0
+            return b'', b'[WARNING] Something odd'
+
+    monkeypatch.setattr(mkfb, 'Popen', FakePopen)
+    # Warnings on stderr are not failures.
+    mkfb.write_part('abc001', 'Text', str(tmpdir))
+    with pytest.raises(RuntimeError) as excinfo:
+        mkfb.write_part('abc001', 'Text broken', str(tmpdir))
+    assert str(excinfo.value) == '[WARNING] Something odd'
+
+
+def test_retries(monkeypatch):
+    attempts = []
+
+    def flaky_write_part(stid, text, out_dir, has_notebook, cwd=None,
+                         in_process=True):
+        attempts.append(stid)
+        if attempts.count(stid) <= int(text):
+            raise ValueError(f'{stid} failed')
+
+    monkeypatch.setattr(mkfb, 'write_part', flaky_write_part)
+    parts = {'abc001': '0', 'abc002': '1', 'abc003': '2'}
+    done = []
+    with pytest.raises(RenderError) as excinfo:
+        write_parts(parts, 'out', retries=1, on_done=done.append)
+    assert list(excinfo.value.errors) == ['abc003']
+    assert sorted(attempts) == ['abc001', 'abc002', 'abc002', 'abc003',
+                                'abc003']
+    assert sorted(done) == ['abc001', 'abc002']
+    attempts[:] = []
+    write_parts(parts, 'out', retries=2)
+    assert len(attempts) == 6
+
+
+@pytest.mark.skipif(not hasattr(signal, 'pthread_kill'),
+                    reason='Needs pthread_kill')
+def test_resume(tmpdir, monkeypatch):
+    out_dir = str(tmpdir)
+    built = []
+
+    def fake_write_part(stid, text, out_dir, has_notebook, cwd=None,
+                        in_process=True):
+        if 'interrupt' in text:
+            # As for Control-C, while main thread waits for renderers.
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+            raise ValueError(f'{stid} interrupted')
+        if 'broken' in text:
+            raise ValueError(f'{stid} is broken')
+        built.append(stid)
+        for fname in mkfb.out_fnames(stid, out_dir, has_notebook):
+            with open(fname, 'wt') as fobj:
+                fobj.write(text)
+
+    monkeypatch.setattr(mkfb, 'write_part', fake_write_part)
+    monkeypatch.setattr(mkfb, 'tool_signature', lambda has_nb: 'tools')
+    parts = {'abc001': 'One', 'abc002': 'Two broken', 'abc003': 'Three'}
+    with pytest.raises(RenderError):
+        update_parts(parts, out_dir)
+    with open(pjoin(out_dir, 'errors.txt'), 'rt') as fobj:
+        assert fobj.read() == 'abc002: abc002 is broken\n'
+    assert not exists(pjoin(out_dir, 'journal.jsonl'))
+    # Journal skips line cut short by interruption.
+    journal = Journal({'abc002': 'key2', 'abc004': 'key4'}, out_dir)
+    journal.record('abc002')
+    journal.record('abc004')
+    with open(journal.fname, 'at') as fobj:
+        fobj.write('["abc005", "ke')
+    assert read_journal(out_dir) == {'abc002': 'key2', 'abc004': 'key4'}
+    journal.remove()
+    # Interrupted run leaves journal of built students.
+    parts.update(abc002='Two fixed', abc003='Three changed',
+                 abc004='Four interrupt')
+    built[:] = []
+    with pytest.raises(KeyboardInterrupt):
+        update_parts(parts, out_dir, jobs=1)
+    assert built == ['abc002', 'abc003']
+    assert sorted(read_journal(out_dir)) == ['abc002', 'abc003']
+    # Resume reuses them.
+    parts['abc004'] = 'Four'
+    built[:] = []
+    assert update_parts(parts, out_dir, resume=True) == ['abc004']
+    assert built == ['abc004']
+    assert sorted(read_manifest(out_dir)) == sorted(parts)
+    assert not exists(pjoin(out_dir, 'errors.txt'))
+    assert not exists(journal.fname)
+    # Without resume, students in journal built again.
+    parts.update(abc003='Three again', abc004='Four interrupt')
+    with pytest.raises(KeyboardInterrupt):
+        update_parts(parts, out_dir, jobs=1)
+    assert sorted(read_journal(out_dir)) == ['abc003']
+    parts['abc004'] = 'Four again'
+    built[:] = []
+    assert sorted(update_parts(parts, out_dir)) == ['abc003', 'abc004']
+    assert built == ['abc003', 'abc004']
+
+
+def test_on_done_errors(tmpdir, monkeypatch):
+    out_dir = str(tmpdir)
+    monkeypatch.setattr(mkfb, 'write_part', lambda *args: None)
+    monkeypatch.setattr(mkfb, 'tool_signature', lambda has_nb: 'tools')
+
+    def on_done(stid):
+        if stid == 'abc002':
+            raise OSError('No space left on device')
+
+    parts = {'abc001': 'One', 'abc002': 'Two'}
+    for batch in (False, True):
+        monkeypatch.setattr(mkfb, '_try_notes_batch',
+                            lambda parts, out_dir: batch)
+        with pytest.raises(RenderError) as excinfo:
+            write_parts(parts, out_dir, batch=batch, on_done=on_done)
+        assert list(excinfo.value.errors) == ['abc002']
+    # Student is not recorded as built.
+    with pytest.raises(RenderError):
+        update_parts(parts, out_dir, on_done=on_done)
+    assert list(read_manifest(out_dir)) == ['abc001']
+
+
+def test_bundle(tmpdir, monkeypatch):
+    out_dir = pjoin(str(tmpdir), 'feedback')
+    os.mkdir(out_dir)
+
+    def fake_write_part(stid, text, out_dir, has_notebook, cwd=None,
+                        in_process=True):
+        if 'broken' in text:
+            raise ValueError(f'{stid} is broken')
+        for fname in mkfb.out_fnames(stid, out_dir, has_notebook):
+            with open(fname, 'wt') as fobj:
+                fobj.write(text)
+
+    monkeypatch.setattr(mkfb, 'write_part', fake_write_part)
+    monkeypatch.setattr(mkfb, 'tool_signature', lambda has_nb: 'tools')
+    parts = {'abc001': 'One', 'abc002': 'Two', 'abc003': 'Three'}
+    update_parts({'abc001': 'One'}, out_dir, True)
+    zip_fname = pjoin(str(tmpdir), 'out.zip')
+    keys = {'abc001': ('Brett', 'Matthew', '124954'),
+            'abc002': ('Brettmatthew', '', '238123')}
+    parts['abc003'] = 'Three broken'
+    with Bundle(zip_fname, keys, out_dir, True) as bundle:
+        with pytest.raises(RenderError):
+            update_parts(parts, out_dir, True, jobs=2, on_done=bundle.add)
+        # Built in this run.
+        assert bundle._added == {'abc002'}
+        for stid in parts:
+            bundle.add(stid)
+        bundle.add('abc002')
+    with zipfile.ZipFile(zip_fname) as zf:
+        names = zf.namelist()
+        assert sorted(names) == [
+            'brett_matthew124954_nb.pdf', 'brett_matthew124954_notes.pdf',
+            'brettmatthew_238123_nb.pdf', 'brettmatthew_238123_notes.pdf',
+            'manifest.csv']
+        assert fname2key(names[0]) in keys.values()
+        assert zf.read('brett_matthew124954_notes.pdf') == b'One'
+        manifest = list(csv.reader(
+            zf.read('manifest.csv').decode('utf8').splitlines()))
+    assert manifest[0] == ['stid', 'family', 'given', 'id_no', 'entry']
+    assert sorted(manifest[1:]) == [
+        ['abc001', 'Brett', 'Matthew', '124954',
+         'brett_matthew124954_nb.pdf'],
+        ['abc001', 'Brett', 'Matthew', '124954',
+         'brett_matthew124954_notes.pdf'],
+        ['abc002', 'Brettmatthew', '', '238123',
+         'brettmatthew_238123_nb.pdf'],
+        ['abc002', 'Brettmatthew', '', '238123',
+         'brettmatthew_238123_notes.pdf']]
+    # Students without submission key named by student id.
+    with Bundle(zip_fname, None, out_dir) as bundle:
+        bundle.add('abc001')
+    with zipfile.ZipFile(zip_fname) as zf:
+        assert sorted(zf.namelist()) == ['abc001_notes.pdf', 'manifest.csv']
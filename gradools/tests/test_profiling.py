@@ -0,0 +1,86 @@
+""" Test profiling module
+"""
+
+import sys
+import json
+import tracemalloc
+from os.path import join as pjoin
+
+from gradools import profiling
+from gradools.profiling import phase, profiled, _pop_profile_target
+
+import pytest
+
+
+def test_pop_profile_target():
+    argv = ['gdo-check', 'log.md']
+    assert _pop_profile_target(argv, {}) is None
+    assert _pop_profile_target(argv, {'GRADOOLS_PROFILE': '0'}) is None
+    assert _pop_profile_target(argv, {'GRADOOLS_PROFILE': '1'}) == 'summary'
+    assert (_pop_profile_target(argv, {'GRADOOLS_PROFILE': 'out.json'})
+            == 'out.json')
+    assert argv == ['gdo-check', 'log.md']
+    argv = ['gdo-check', '--profile', 'log.md']
+    assert _pop_profile_target(argv, {}) == 'summary'
+    assert argv == ['gdo-check', 'log.md']
+    argv = ['gdo-check', 'log.md', '--profile=out.json']
+    assert _pop_profile_target(argv, {'GRADOOLS_PROFILE': '1'}) == 'out.json'
+    assert argv == ['gdo-check', 'log.md']
+
+
+def test_profiled(tmpdir, monkeypatch, capsys):
+
+    @profiled
+    def main(arg):
+        with phase('one'):
+            pass
+        for i in range(3):
+            with phase('two'):
+                pass
+        return arg
+
+    # Off by default, phases do nothing.
+    monkeypatch.delenv('GRADOOLS_PROFILE', raising=False)
+    monkeypatch.setattr(sys, 'argv', ['gdo-foo'])
+    assert phase('one') is phase('two')
+    assert main(10) == 10
+    assert capsys.readouterr().err == ''
+    monkeypatch.setattr(sys, 'argv', ['gdo-foo', '--profile'])
+    assert main(11) == 11
+    lines = capsys.readouterr().err.splitlines()
+    assert [line.split()[:2] for line in lines[1:]] == [
+        ['total', '1'], ['one', '1'], ['two', '3']]
+    assert profiling._PROFILER is None
+    trace_fname = pjoin(str(tmpdir), 'trace.json')
+    monkeypatch.setenv('GRADOOLS_PROFILE', trace_fname)
+    assert main(12) == 12
+    with open(trace_fname, 'rt') as fobj:
+        trace = json.load(fobj)
+    assert [e['name'] for e in trace['events']] == (
+        ['one'] + ['two'] * 3 + ['total'])
+    assert list(trace['summary']) == ['total', 'one', 'two']
+    assert all(e['wall'] >= 0 and e['cpu'] >= 0 for e in trace['events'])
+
+
+@pytest.mark.skipif(not profiling._CAN_PEAK, reason='Needs Python >= 3.9')
+def test_phase_peaks():
+    assert not tracemalloc.is_tracing()
+    profiler = profiling.start_profiling()
+    try:
+        with phase('outer'):
+            with phase('big'):
+                big = bytearray(20 * 2 ** 20)
+                del big
+            # Peak of earlier phase does not carry over.
+            with phase('small'):
+                small = bytearray(2 ** 20)
+                del small
+    finally:
+        assert profiling.stop_profiling() is profiler
+    assert not tracemalloc.is_tracing()
+    peaks = {name: totals['peak_mb']
+             for name, totals in profiler.summary().items()}
+    assert peaks['big'] >= 20
+    assert 1 <= peaks['small'] < 20
+    # Outer phase includes peaks of the phases inside it.
+    assert peaks['outer'] >= peaks['big']
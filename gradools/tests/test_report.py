@@ -1,9 +1,29 @@
 """ Test report module
 """
 
-from os.path import join as pjoin, dirname
+import sys
+import json
+import shutil
+from os.path import join as pjoin, dirname, exists
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+from collections import OrderedDict
 
-from gradools.report import read_old_totals
+import numpy as np
+import pandas as pd
+from numpy.testing import assert_array_equal, assert_almost_equal
+
+from gradools.report import (read_old_totals, merge_marks, current_marks,
+                             iter_year_records, iter_question_records,
+                             import_old_totals, get_totals, parse_years,
+                             load_years, ks_statistic, multi_year_stats,
+                             iter_years_records, histogram_bins,
+                             render_histogram, write_svg_histogram,
+                             start_plot)
+from gradools.markstore import read_year, write_year
+from gradools.scores import ScoreMatrix
+
+import pytest
 
 
 DATA_DIR = pjoin(dirname(__file__), 'data')
@@ -13,3 +33,151 @@ def test_read_old_totals():
     totals = read_old_totals(pjoin(DATA_DIR, 'marks_2017.txt'))
     assert list(totals) == ['mbr312', 'vrr110', 'lxl101']
     assert list(totals.values()) == [43.5, 90.0, 80.5]
+
+
+def test_merge_marks():
+    students = pd.DataFrame({'Student': ['Matthew', 'Martin', 'Valia'],
+                             'SIS Login ID': ['mb312', 'mb110', 'vr101']})
+    marks = OrderedDict([('mb110', 55.0), ('mb312', 72.5)])
+    marked, problems = merge_marks(students, marks, 'Foo (1234)')
+    assert list(marked['SIS Login ID']) == ['mb312', 'mb110']
+    assert list(marked['Foo (1234)']) == [72.5, 55]
+    assert problems == {'unmarked': ['vr101']}
+    assert list(students) == ['Student', 'SIS Login ID']
+    marks['xx999'] = 40
+    marks['yy999'] = 30
+    marks['vr101'] = 61
+    marked, problems = merge_marks(students, marks, 'Foo (1234)')
+    assert list(marked['Foo (1234)']) == [72.5, 55, 61]
+    assert problems == {'not-in-roster': ['xx999', 'yy999']}
+
+
+def test_current_marks():
+    matrix = ScoreMatrix(['mb312', 'vr101', 'mb110'], ['foo', 'bar'],
+                         [[50, 40], [30, 10], [60, 38]], [[0, 0]] * 3)
+
+    class C(dict):
+        year = 2020
+
+    config = C(fudges={2020: 3})
+    assert current_marks(matrix, config) == {
+        'mb312': 93, 'vr101': 43, 'mb110': 100}
+    config.year = 2021
+    assert current_marks(matrix, config) == {
+        'mb312': 90, 'vr101': 40, 'mb110': 98}
+
+
+def test_records():
+    marks = OrderedDict([('mb312', 72.5), ('vr101', 41.0), ('mb110', 60.0)])
+    records = list(iter_year_records(marks, 2020))
+    assert records[:3] == [
+        {'type': 'mark', 'year': 2020, 'id': 'mb312', 'mark': 72.5},
+        {'type': 'mark', 'year': 2020, 'id': 'vr101', 'mark': 41.0},
+        {'type': 'mark', 'year': 2020, 'id': 'mb110', 'mark': 60.0}]
+    summary = records[3]
+    assert summary['type'] == 'summary'
+    assert summary['n'] == 3
+    assert summary['failed'] == ['vr101']
+    matrix = ScoreMatrix(['mb312', 'vr101'], ['foo', 'bar'],
+                         [[50, 0], [30, 0]], [[0, 1], [0, 1]],
+                         maxima=[60, 40])
+    records = list(iter_question_records(matrix))
+    assert records[1] == dict(type='question', question='bar', maximum=40,
+                              n=0, mean=None, std=None, min=None, max=None)
+    # Records are valid JSON.
+    assert [json.loads(json.dumps(r)) for r in records] == records
+
+
+def test_import_old_totals(tmpdir):
+    directory = str(tmpdir)
+    store_dir = pjoin(directory, 'store')
+    shutil.copy(pjoin(DATA_DIR, 'marks_2017.txt'), directory)
+    pd.DataFrame({'SIS Login ID': ['mb312', 'vr101'],
+                  'Foo (1234)': [61.0, 72.5]}).to_csv(
+                      pjoin(directory, 'marks_2018.csv'), index=False)
+    assert import_old_totals(directory, store_dir) == [2017, 2018]
+    assert read_year(2017, store_dir) == {
+        'mbr312': 43.5, 'vrr110': 90.0, 'lxl101': 80.5}
+    assert read_year(2018, store_dir) == {'mb312': 61.0, 'vr101': 72.5}
+    # Years already in store not imported again.
+    assert import_old_totals(directory, store_dir) == []
+    assert get_totals(2018, store_dir) == {'mb312': 61.0, 'vr101': 72.5}
+
+
+def test_parse_years():
+    assert parse_years('2015:2018') == [2015, 2016, 2017, 2018]
+    assert parse_years('2020') == [2020]
+    assert parse_years('2020:2019') == []
+    with pytest.raises(ValueError):
+        parse_years('last:2020')
+
+
+def test_ks_statistic():
+    assert ks_statistic([1, 2, 3], [1, 2, 3]) == 0
+    assert ks_statistic([1, 2], [3, 4]) == 1
+    assert ks_statistic([1, 2, 3, 4], [3, 4, 5, 6]) == 0.5
+    assert np.isnan(ks_statistic([], [1]))
+
+
+def test_multi_year_stats(tmpdir):
+    store_dir = str(tmpdir)
+    write_year({'a': 40, 'b': 60, 'c': 80, 'd': 100}, 2019, store_dir)
+    write_year({'a': 30, 'b': 45, 'c': 70}, 2021, store_dir)
+    columns = load_years(range(2018, 2022), store_dir)
+    assert list(columns) == [2019, 2021]
+    stats = multi_year_stats(columns)
+    assert list(stats.index) == [2019, 2021]
+    assert_array_equal(stats['n'], [4, 3])
+    assert_almost_equal(stats['mean'], [70, 145 / 3])
+    assert_array_equal(stats['median'], [70, 45])
+    assert_array_equal(stats['q25'], [55, 37.5])
+    assert_almost_equal(stats['fail_rate'], [0.25, 2 / 3])
+    assert_almost_equal(stats['mean_delta'], [np.nan, 145 / 3 - 70])
+    assert_array_equal(stats['median_delta'], [np.nan, -25])
+    assert_almost_equal(stats['ks_prev'], [np.nan, 0.5])
+    records = list(iter_years_records(stats))
+    assert records[0]['year'] == 2019
+    assert records[0]['n'] == 4
+    assert records[0]['ks_prev'] is None
+    assert [json.loads(json.dumps(r)) for r in records] == records
+    # Stored year without marks.
+    write_year({}, 2020, store_dir)
+    stats = multi_year_stats(load_years(range(2018, 2022), store_dir))
+    assert_array_equal(stats['n'], [4, 0, 3])
+    assert np.isnan(stats.loc[2020, 'mean'])
+    records = list(iter_years_records(stats))
+    assert records[1]['n'] == 0
+    assert records[1]['mean'] is None
+    assert records[2]['ks_prev'] is None
+    assert [json.loads(json.dumps(r)) for r in records] == records
+
+
+def test_histograms(tmpdir, monkeypatch):
+    values = [40, 55, 55, 61, 72.5, 90]
+    counts, edges = histogram_bins(values)
+    assert_array_equal(counts, np.histogram(values)[0])
+    assert_array_equal(edges, np.histogram(values)[1])
+    root = pjoin(str(tmpdir), 'hist')
+    fname = write_svg_histogram(counts, edges, root + '.svg')
+    svg = ElementTree.parse(fname).getroot()
+    rects = svg.findall('{http://www.w3.org/2000/svg}rect')
+    assert len(rects) == len(counts)
+    assert [float(r.get('height')) > 0 for r in rects] == list(counts > 0)
+    # Without matplotlib, render SVG.
+    monkeypatch.setitem(sys.modules, 'matplotlib', None)
+    monkeypatch.setitem(sys.modules, 'matplotlib.figure', None)
+    assert render_histogram(counts, edges, root) == root + '.svg'
+    monkeypatch.undo()
+    pytest.importorskip('matplotlib')
+    assert render_histogram(counts, edges, root) == root + '.png'
+    assert exists(root + '.png')
+
+
+def test_start_plot(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
+    marks = OrderedDict([('mb312', 72.5), ('vr101', 41.0)])
+    assert start_plot(None, marks, 2020) is None
+    with ThreadPoolExecutor() as plotter:
+        future = start_plot(plotter, marks, 2020)
+    assert exists(future.result())
+    assert future.result().startswith('mark_histogram_2020.')
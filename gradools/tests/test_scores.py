@@ -0,0 +1,153 @@
+""" Test scores module
+"""
+
+from os.path import join as pjoin, dirname
+from io import StringIO
+
+import numpy as np
+
+from gradools.marklog import parse_log
+from gradools.scores import ScoreMatrix
+
+from numpy.testing import assert_array_equal, assert_almost_equal
+
+DATA_DIR = pjoin(dirname(__file__), 'data')
+
+
+def test_from_log():
+    log = parse_log(pjoin(DATA_DIR, 'marking_log.md'))
+    matrix = ScoreMatrix.from_log(log)
+    assert matrix.students == ['mbr110', 'vrr101']
+    assert matrix.questions == list(log.o_scores)
+    assert_array_equal(matrix.maxima, list(log.o_scores.values()))
+    assert not matrix.missing.any()
+    assert_array_equal(matrix.totals, [71, 31])
+    # Example log has wrong total for vrr101.
+    assert_array_equal(matrix.stated, [71, 55])
+    for row, section in zip(matrix.values, log.sections):
+        assert list(row) == list(section.marks.values())
+    assert_array_equal(matrix.problem_rows(*log.scores), [1])
+
+
+def test_totals_log_order():
+    # Floating point totals depend on order of adding; use log order.
+    log = parse_log(StringIO("""\
+Ordinary maxima:
+
+* a: 1
+* b: 1
+* c: 1
+
+## abc001
+
+* c: 0.3
+* b: 0.2
+* a: 0.1
+
+Total: 0.6
+
+## abc002
+
+* a: 0.1
+* b: 0.2
+* c: 0.3
+
+Total: 0.6000000000000001
+"""))
+    matrix = ScoreMatrix.from_log(log)
+    totals = [sum(s.marks.values()) for s in log.sections]
+    assert totals == [0.6, 0.6000000000000001]
+    assert matrix.totals.tolist() == totals
+    assert len(matrix.problem_rows(*log.scores)) == 0
+
+
+def test_problem_rows():
+    log = parse_log(StringIO("""\
+Ordinary maxima:
+
+* foo: 10
+* bar: 5
+
+Extra maxima:
+
+* extra: 2
+
+## abc001
+
+* foo: 4
+* bar: 2
+
+Total: 6
+
+## abc002
+
+* foo: 4
+* baz: 1
+
+Total: 5
+
+## abc003
+
+* foo: 4
+* bar: 1
+* extra: 1
+
+Total: 7
+
+## abc004
+
+* bar: 1
+* foo: 4
+* foo: 5
+
+## abc005
+
+* bar: 1
+* foo: 5
+
+Total: 6
+"""))
+    matrix = ScoreMatrix.from_log(log)
+    assert matrix.questions == ['foo', 'bar', 'extra', 'baz']
+    assert_array_equal(matrix.maxima, [10, 5, 2, np.nan])
+    assert_array_equal(matrix.missing, [[0, 0, 1, 1],
+                                        [0, 1, 1, 0],
+                                        [0, 0, 0, 1],
+                                        [0, 0, 1, 1],
+                                        [0, 0, 1, 1]])
+    # Last of repeated keys wins.
+    assert_array_equal(matrix.totals, [6, 5, 6, 6, 6])
+    assert_array_equal(matrix.stated, [6, 5, 7, np.nan, 6])
+    assert_array_equal(matrix.problem_rows(['foo', 'bar'], ['extra']),
+                       [1, 2, 3])
+    assert_array_equal(matrix.problem_rows(['foo', 'bar'], ['extra', 'baz']),
+                       [1, 2, 3])
+    assert_array_equal(matrix.problem_rows(['foo'], ['bar', 'extra', 'baz']),
+                       [2, 3])
+    assert_array_equal(matrix.problem_rows(['foo', 'bar', 'other'], []),
+                       [0, 1, 2, 3, 4])
+    # Total that is not a number is a problem, for checking to report.
+    log = parse_log(StringIO('## abc001\n\n* foo: 1\n\nTotal: 1 mark\n'))
+    section, = log.sections
+    assert (section.mark_sum, section.stated_total) == (1, None)
+    matrix = ScoreMatrix.from_log(log)
+    assert_array_equal(matrix.stated, [np.nan])
+    assert_array_equal(matrix.problem_rows(['foo'], []), [0])
+
+
+def test_question_stats():
+    matrix = ScoreMatrix(['a', 'b', 'c'], ['q1', 'q2', 'q3'],
+                         [[1, 0, 0], [2, 3, 0], [6, 0, 0]],
+                         [[0, 1, 1], [0, 0, 1], [0, 1, 1]],
+                         maxima=[10, 5, 5])
+    stats = matrix.question_stats()
+    assert list(stats) == ['question', 'maximum', 'n', 'mean', 'std', 'min',
+                           'max']
+    assert list(stats['question']) == ['q1', 'q2', 'q3']
+    assert_array_equal(stats['maximum'], [10, 5, 5])
+    assert_array_equal(stats['n'], [3, 1, 0])
+    assert_almost_equal(stats['mean'], [3, 3, np.nan])
+    assert_almost_equal(stats['std'], [np.std([1, 2, 6], ddof=1), np.nan,
+                                       np.nan])
+    assert_array_equal(stats['min'], [1, 3, np.nan])
+    assert_array_equal(stats['max'], [6, 3, np.nan])
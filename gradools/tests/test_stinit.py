@@ -3,12 +3,16 @@
 
 from os.path import join as pjoin, dirname
 from collections import OrderedDict
+from io import StringIO
 
 import numpy as np
 import pandas as pd
 
 from gradools.mkstable import to_minimal_df
-from gradools.stinit import get_init
+from gradools.mconfig import ConfigError
+from gradools.stinit import get_init, Roster, read_logins, logged_students
+
+import pytest
 
 
 DATA_DIR = pjoin(dirname(__file__), 'data')
@@ -37,3 +41,40 @@ Matthew Brett
 
 """
     assert res == exp
+
+
+def test_roster():
+    students = _config.get_students()
+    roster = Roster(students)
+    assert roster.find('mb312') == ('Matthew Brett', 'mb312')
+    assert roster.find('1357908') == ('Martin Brett', 'mb110')
+    assert roster.find(1357908) == ('Martin Brett', 'mb110')
+    assert roster.find('Martin Brett') == ('Martin Brett', 'mb110')
+    with pytest.raises(RuntimeError):
+        roster.find('xx999')
+    assert get_init('1357908', _config, roster).startswith('## mb110\n')
+    doubled = Roster(pd.concat([students, students.iloc[:1]]))
+    with pytest.raises(RuntimeError):
+        doubled.find('mb312')
+    assert doubled.find('mb110') == ('Martin Brett', 'mb110')
+
+
+def test_read_logins():
+    assert read_logins(StringIO('mb312\n\n  mb110 \n')) == ['mb312', 'mb110']
+
+
+def test_logged_students(tmpdir):
+
+    class LogConfig:
+        use_cache = False
+        marking_logs = [pjoin(DATA_DIR, 'marking_log.md')]
+
+    assert logged_students(LogConfig()) == {'mbr110', 'vrr101'}
+
+    class NoLogConfig:
+
+        @property
+        def marking_logs(self):
+            raise ConfigError('Log marking_log.md does not exist')
+
+    assert logged_students(NoLogConfig()) == set()